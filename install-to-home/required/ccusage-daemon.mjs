@@ -4,13 +4,15 @@
  * ccusage バックグラウンドデーモン
  *
  * 機能:
- * - 5分ごとに ccusage blocks --json を実行してキャッシュ更新
+ * - get-message-usage.py --serve を常駐させ、ログ更新のたびにキャッシュ更新
+ *   （usage.sock で status-line.sh からの問い合わせにも応答。
+ *     起動できない・終了した場合は2分ごとの再計算にフォールバック）
  * - Claude Code プロセス監視（プロセスがなくなったら自己終了）
  * - PIDファイルで重複起動防止
  */
 
-import { execSync } from 'child_process';
-import { writeFileSync, readFileSync, unlinkSync, existsSync, mkdirSync, statSync } from 'fs';
+import { execSync, spawn } from 'child_process';
+import { writeFileSync, readFileSync, unlinkSync, existsSync, mkdirSync, statSync, renameSync } from 'fs';
 import { platform } from 'os';
 import { join } from 'path';
 
@@ -44,6 +46,14 @@ const PID_FILE = join(CACHE_DIR, 'ccusage-daemon.pid');
 const LOG_FILE = join(CACHE_DIR, 'ccusage-daemon.log');
 const WINDOW_STATE_FILE = join(HOME_DIR, '.claude', 'usage-window.json');
 
+// get-message-usage.py --profile が stderr に出力するフェーズ別所要時間の行
+const PERF_LOG_PREFIX = '[PERF]';
+// CCUSAGE_PROFILE=1 のときのみ --profile 付きで起動する（計測は行ごとのタイマー呼び出しを伴うため既定では無効）
+const PROFILE_ENABLED = process.env.CCUSAGE_PROFILE === '1';
+
+// get-message-usage.py --serve の子プロセス（null の場合は定期更新で代替）
+let watcherProcess = null;
+
 // ログローテーション（5MBを超えたら古いログを削除）
 function rotateLogIfNeeded() {
   try {
@@ -79,6 +89,28 @@ function log(message, level = LOG_LEVELS.INFO) {
 
 // ===== usage-window.json 管理関数 =====
 
+/**
+ * ファイルを一時ファイルへの書き込みと rename で置き換える
+ * （ステータスラインや get-message-usage.py が書き込み途中の内容を読まないようにする。
+ *   一時ファイル名は get-message-usage.py の write_json_atomic と同じ形式）
+ * @param {string} path - 書き込み先のパス
+ * @param {string} data - 書き込む内容
+ */
+function writeFileAtomic(path, data) {
+  const tmpPath = `${path}.${process.pid}.tmp`;
+  try {
+    writeFileSync(tmpPath, data, 'utf8');
+    renameSync(tmpPath, path);
+  } catch (error) {
+    try {
+      unlinkSync(tmpPath);
+    } catch (unlinkError) {
+      // 一時ファイルが作られていない場合は無視
+    }
+    throw error;
+  }
+}
+
 /**
  * ウィンドウ状態を読み込む
  * @returns {object|null} ウィンドウ状態（存在しない場合はnull）
@@ -114,7 +146,7 @@ function saveWindowState(windowStart, firstMessageTimestamp = null, resetTimesta
       state.resetTimestamp = resetTimestamp.toISOString();
     }
 
-    writeFileSync(WINDOW_STATE_FILE, JSON.stringify(state, null, 2), 'utf8');
+    writeFileAtomic(WINDOW_STATE_FILE, JSON.stringify(state, null, 2));
     log(`Window state saved: windowStart=${state.windowStart}`, LOG_LEVELS.INFO);
   } catch (error) {
     log(`Failed to save window state: ${error.message}`, LOG_LEVELS.ERROR);
@@ -208,6 +240,21 @@ function getClaudeScriptPath(filename) {
   return join(HOME_DIR, '.claude', filename);
 }
 
+// get-message-usage のパスを取得
+// （tools/build-zipapp.py で作成した .pyz がスクリプトより新しければ、バイトコード済みのそちらを使う）
+function getUsageScriptPath() {
+  const scriptPath = getClaudeScriptPath('get-message-usage.py');
+  const zipappPath = getClaudeScriptPath('get-message-usage.pyz');
+  try {
+    if (existsSync(zipappPath) && statSync(zipappPath).mtimeMs > statSync(scriptPath).mtimeMs) {
+      return zipappPath;
+    }
+  } catch (error) {
+    // スクリプトが存在しない場合などは通常のパスを返す
+  }
+  return scriptPath;
+}
+
 // Claude Code プロセス数を取得（クロスプラットフォーム対応）
 function getClaudeProcessCount() {
   try {
@@ -277,10 +324,10 @@ function getPythonCommand() {
 // メッセージ使用率を取得（Pythonスクリプト経由）
 function getMessageUsage() {
   try {
-    const scriptPath = getClaudeScriptPath('get-message-usage.py');
+    const scriptPath = getUsageScriptPath();
     const pythonCmd = getPythonCommand();
 
-    const output = execSync(`${pythonCmd} "${scriptPath}"`, {
+    const output = execSync(`${pythonCmd} "${scriptPath}"${PROFILE_ENABLED ? ' --profile' : ''}`, {
       encoding: 'utf8',
       stdio: ['pipe', 'pipe', 'pipe'],
       timeout: PYTHON_TIMEOUT
@@ -308,6 +355,67 @@ function getMessageUsage() {
   }
 }
 
+// ログ監視プロセスを起動（get-message-usage.py --serve がキャッシュを更新し続ける）
+function startWatcher() {
+  try {
+    const scriptPath = getUsageScriptPath();
+    const pythonCmd = getPythonCommand();
+
+    // Windows は getPythonCommand() がクォート済みのパスを返すためシェル経由で起動
+    const isWindows = platform() === 'win32';
+    const args = [isWindows ? `"${scriptPath}"` : scriptPath, '--serve'];
+    if (PROFILE_ENABLED) {
+      args.push('--profile');
+    }
+    const child = spawn(pythonCmd, args, {
+      stdio: ['ignore', 'ignore', 'pipe'],
+      shell: isWindows
+    });
+
+    child.stderr.setEncoding('utf8');
+    child.stderr.on('data', (data) => {
+      for (const line of data.split('\n')) {
+        if (line.startsWith(PERF_LOG_PREFIX)) {
+          // 再計算ごとのフェーズ別所要時間（--profile）
+          log(`Perf: ${line.slice(PERF_LOG_PREFIX.length).trim()}`, LOG_LEVELS.INFO);
+        } else if (line.trim()) {
+          log(`Watcher: ${line.trim()}`, LOG_LEVELS.DEBUG);
+        }
+      }
+    });
+
+    child.on('exit', (code, signal) => {
+      log(`Watcher exited (code: ${code}, signal: ${signal}). Falling back to periodic updates`, LOG_LEVELS.WARNING);
+      watcherProcess = null;
+    });
+
+    child.on('error', (error) => {
+      log(`Watcher error: ${error.message}`, LOG_LEVELS.ERROR);
+      watcherProcess = null;
+    });
+
+    watcherProcess = child;
+    log(`Watcher started (PID: ${child.pid})`, LOG_LEVELS.INFO);
+  } catch (error) {
+    log(`Failed to start watcher: ${error.message}`, LOG_LEVELS.ERROR);
+    watcherProcess = null;
+  }
+}
+
+// ログ監視プロセスを停止
+function stopWatcher() {
+  if (watcherProcess) {
+    try {
+      watcherProcess.removeAllListeners('exit');
+      watcherProcess.kill();
+      log('Watcher stopped', LOG_LEVELS.INFO);
+    } catch (error) {
+      log(`Failed to stop watcher: ${error.message}`, LOG_LEVELS.ERROR);
+    }
+    watcherProcess = null;
+  }
+}
+
 // キャッシュ更新（トークンベース）
 function updateCache() {
   log('Updating usage cache...', LOG_LEVELS.INFO);
@@ -341,15 +449,18 @@ function updateCache() {
       resetStatus: usageData.resetStatus || null
     };
 
-    writeFileSync(CACHE_FILE, JSON.stringify(cacheData, null, 2));
+    writeFileAtomic(CACHE_FILE, JSON.stringify(cacheData, null, 2));
     const resetMinutes = Math.floor(cacheData.timeUntilReset / 60);
     const tokenK = Math.round((usageData.tokens?.weighted?.total || 0) / 1000);
     const limitK = Math.round(cacheData.tokenLimit / 1000);
     log(`Cache updated: ${cacheData.tokenPercent}% (${tokenK}K/${limitK}K tokens, reset in ${resetMinutes}m)`, LOG_LEVELS.INFO);
+    if (usageData.perf) {
+      log(`Perf: ${JSON.stringify(usageData.perf)}`, LOG_LEVELS.INFO);
+    }
   } catch (error) {
     log(`Failed to update cache: ${error.message}`, LOG_LEVELS.ERROR);
     // エラー時も空のキャッシュを書き込む
-    writeFileSync(CACHE_FILE, JSON.stringify({
+    writeFileAtomic(CACHE_FILE, JSON.stringify({
       timestamp: new Date().toISOString(),
       tokenPercent: 0,
       tokenLimit: 0,
@@ -398,8 +509,8 @@ async function mainLoop(initialLastUpdate = 0, initialLastProcessCheck = 0) {
       lastProcessCheck = now;
     }
 
-    // キャッシュ更新（5分ごと）
-    if (now - lastUpdate >= UPDATE_INTERVAL) {
+    // キャッシュ更新（監視プロセスが動いていない場合のみ2分ごと）
+    if (watcherProcess === null && now - lastUpdate >= UPDATE_INTERVAL) {
       updateCache();
       lastUpdate = now;
     }
@@ -409,6 +520,7 @@ async function mainLoop(initialLastUpdate = 0, initialLastProcessCheck = 0) {
   }
 
   // 終了処理
+  stopWatcher();
   removePidFile();
   log('Daemon stopped', LOG_LEVELS.INFO);
   process.exit(0);
@@ -418,6 +530,7 @@ async function mainLoop(initialLastUpdate = 0, initialLastProcessCheck = 0) {
 function setupSignalHandlers() {
   const shutdown = () => {
     log('Received shutdown signal', LOG_LEVELS.INFO);
+    stopWatcher();
     removePidFile();
     process.exit(0);
   };
@@ -442,6 +555,9 @@ async function main() {
   // 初回キャッシュ更新
   updateCache();
 
+  // ログ監視プロセスを起動（以降のキャッシュ更新はイベント駆動）
+  startWatcher();
+
   // メインループ開始（初回更新済みなので lastUpdate を設定）
   await mainLoop(Date.now(), Date.now());
 }
@@ -449,6 +565,7 @@ async function main() {
 // 実行
 main().catch(error => {
   log(`Fatal error: ${error.message}`, LOG_LEVELS.ERROR);
+  stopWatcher();
   removePidFile();
   process.exit(1);
 });
@@ -4,23 +4,32 @@ Claude Code 使用量キャリブレーションツール
 
 /usage コマンドの表示値を入力することで、
 トークン制限値を自動調整します。
+
+--fit では複数の読み取り値（時刻と表示値）からモデル別の設定
+（model-calibration.json の limit / base_limit / data_points）をまとめて当てはめます。
 """
 
 import json
+import os
 import sys
-import subprocess
 from pathlib import Path
-from datetime import datetime, timezone
-import statistics
+
+# subprocess / datetime / statistics / importlib / bisect は使用する関数の中で import する
+# （状態表示だけの実行などで読み込みコストを払わないため）
 
 # ホームディレクトリの .claude フォルダ
 CLAUDE_DIR = Path.home() / '.claude'
 CALIBRATION_FILE = CLAUDE_DIR / 'usage-calibration.json'
 USAGE_SCRIPT = CLAUDE_DIR / 'get-message-usage.py'
+USAGE_ZIPAPP = CLAUDE_DIR / 'get-message-usage.pyz'  # tools/build-zipapp.py で作成（任意）
 
 # キャリブレーションデータの最大保存数
 MAX_HISTORY = 10
 
+# --fit: 補間カーブ（interpolate）の節点の最大数と、使用量のウィンドウ（時間）
+CURVE_KNOTS = 8
+WINDOW_HOURS = 5
+
 
 def load_calibration_data():
     """キャリブレーションデータを読み込む"""
@@ -45,22 +54,41 @@ def load_calibration_data():
         }
 
 
+def write_json_atomic(path, data):
+    """get-message-usage.py が書き込み途中の内容を読まないよう、一時ファイルに書いてから置き換える"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+
 def save_calibration_data(data):
     """キャリブレーションデータを保存"""
     try:
-        CLAUDE_DIR.mkdir(parents=True, exist_ok=True)
-        with open(CALIBRATION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        write_json_atomic(CALIBRATION_FILE, data)
     except Exception as e:
         print(f"エラー: キャリブレーションデータの保存に失敗: {e}", file=sys.stderr)
         sys.exit(1)
 
 
+def get_usage_script():
+    """実行する get-message-usage のパスを取得（スクリプトより新しい zipapp があればそちら）"""
+    try:
+        if USAGE_ZIPAPP.stat().st_mtime > USAGE_SCRIPT.stat().st_mtime:
+            return USAGE_ZIPAPP
+    except OSError:
+        pass
+    return USAGE_SCRIPT
+
+
 def get_current_usage():
     """get-message-usage.py を実行して現在の使用状況を取得"""
+    import subprocess
+
     try:
         result = subprocess.run(
-            [sys.executable, str(USAGE_SCRIPT)],
+            [sys.executable, str(get_usage_script())],
             capture_output=True,
             text=True,
             check=False  # 終了コードに関わらず出力を取得
@@ -90,6 +118,9 @@ def calculate_limit(weighted_tokens, usage_percent):
 
 def calibrate(official_usage_percent):
     """キャリブレーションを実行"""
+    import statistics
+    from datetime import datetime, timezone
+
     print(f"[CALIBRATE] /usage コマンドの表示値: {official_usage_percent}%")
     print()
 
@@ -166,8 +197,473 @@ def calibrate(official_usage_percent):
     return calibrated_limit
 
 
+def load_engine():
+    """get-message-usage.py をモジュールとして読み込む（--fit は同じプロセスで集計する）"""
+    import importlib.util
+
+    if not USAGE_SCRIPT.exists():
+        print(f"エラー: {USAGE_SCRIPT} が見つかりません", file=sys.stderr)
+        sys.exit(1)
+    spec = importlib.util.spec_from_file_location('get_message_usage', USAGE_SCRIPT)
+    engine = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(engine)
+    return engine
+
+
+def parse_timestamp(value):
+    """ISO 8601 の時刻を UTC の datetime にする（タイムゾーンのない時刻はローカル時刻とみなす）"""
+    from datetime import datetime, timezone
+
+    return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).astimezone(timezone.utc)
+
+
+def load_readings(path=None):
+    """
+    フィッティングに使う読み取り値（時刻, /usage の表示値）を読み込む
+
+    usage-calibration.json の履歴に加え、path のファイルも読む。ファイルは1行1件で、
+    JSON（{"timestamp": ..., "percent": ...}）または CSV（時刻,使用率）。# で始まる行は無視する。
+    同じ時刻の読み取り値は後のものを使う。
+    """
+    readings = {}
+    for entry in load_calibration_data().get('history', []):
+        try:
+            readings[parse_timestamp(entry['timestamp'])] = float(entry['official_percent'])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+
+    if path is not None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError as e:
+            print(f"エラー: 読み取り値のファイルを開けません: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                if line.startswith('{'):
+                    item = json.loads(line)
+                    timestamp = item['timestamp']
+                    percent = item.get('percent', item.get('official_percent'))
+                else:
+                    timestamp, percent = line.split(',')[:2]
+                readings[parse_timestamp(timestamp)] = float(percent)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                print(f"警告: {path}:{number} を読み飛ばしました（{e}）", file=sys.stderr)
+
+    return sorted((ts, percent) for ts, percent in readings.items() if 0 <= percent <= 100)
+
+
+def resolve_window_starts(engine, times):
+    """
+    各読み取り時刻を含む5時間ウィンドウの開始時刻
+
+    ウィンドウの台帳（終了したウィンドウ）と現在のウィンドウ状態から探し、
+    見つからない場合は読み取り時刻の5時間前からのウィンドウとみなす。
+    """
+    import bisect
+    from datetime import datetime, timedelta
+
+    window = timedelta(hours=WINDOW_HOURS)
+    starts = [
+        datetime.fromisoformat(entry['windowStart'])
+        for entry in engine.load_window_ledger(times[0] - window) if 'windowStart' in entry
+    ]
+    state = engine.get_window_state()
+    if state is not None and 'resetTimestamp' not in state:
+        starts.append(state['windowStart'])
+    starts.sort()
+
+    result = []
+    for ts in times:
+        i = bisect.bisect_right(starts, ts)
+        if i and ts < engine.round_to_hour_utc(starts[i - 1]) + window:
+            result.append(starts[i - 1])
+        else:
+            result.append(ts - window)
+    return result
+
+
+def collect_usage_events(engine, since, until):
+    """
+    since〜until の assistant 応答をログの1回の走査で集める（重複除去済み）
+
+    Returns:
+        list: (UTC エポックからのマイクロ秒, モデル名, 生トークン数, 重み付けトークン数) の時刻順
+    """
+    since_us = int(since.timestamp() * 1000000)
+    until_us = int(until.timestamp() * 1000000)
+    events = []
+    seen = set()
+
+    for path, _ in engine.iter_transcripts(engine.get_log_directory(), since=since):
+        try:
+            with open(path, 'rb') as f:
+                for buf, start, end, _ in engine.iter_transcript_lines(f, 0, engine.archive_format(path)):
+                    if not engine.is_relevant_line(buf, start, end):
+                        continue
+                    try:
+                        entry = json.loads(buf[start:end])
+                        if not isinstance(entry, dict) or entry.get('type') != 'assistant':
+                            continue
+                        event = engine.extract_store_event(entry, str(path))
+                    except (ValueError, KeyError):
+                        continue
+                    if event is None or not since_us < event[0] <= until_us:
+                        continue
+                    if event[15] is not None:
+                        if event[15] in seen:
+                            continue
+                        seen.add(event[15])
+                    events.append((event[0], event[3], sum(event[6:10]), event[12]))
+        except OSError as e:
+            print(f"警告: {path} を読めませんでした: {e}", file=sys.stderr)
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def window_totals(events, starts, times, model_keys, numpy=None):
+    """
+    読み取り値ごとのウィンドウ内のモデル別合計（累積和の差で全読み取り値をまとめて求める）
+
+    Returns:
+        tuple: (生トークン数, 重み付けトークン数) - どちらも [読み取り値][モデル] のリスト
+    """
+    index = {model_key: j for j, model_key in enumerate(model_keys)}
+    start_us = [int(ts.timestamp() * 1000000) for ts in starts]
+    end_us = [int(ts.timestamp() * 1000000) for ts in times]
+
+    if numpy is not None:
+        ts = numpy.fromiter((event[0] for event in events), dtype='i8', count=len(events))
+        model = numpy.fromiter((index[event[1]] for event in events), dtype='i8', count=len(events))
+        values = numpy.array([[event[2], event[3]] for event in events], dtype='f8').reshape(len(events), 2)
+        lo = numpy.searchsorted(ts, numpy.asarray(start_us, dtype='i8'), side='right')
+        hi = numpy.searchsorted(ts, numpy.asarray(end_us, dtype='i8'), side='right')
+
+        # [モデル, イベント, (生, 重み付け)] の累積和
+        masked = values[numpy.newaxis, :, :] * (model[numpy.newaxis, :] == numpy.arange(len(model_keys))[:, numpy.newaxis])[:, :, numpy.newaxis]
+        cumulative = numpy.concatenate((numpy.zeros((len(model_keys), 1, 2)), masked.cumsum(axis=1)), axis=1)
+        totals = cumulative[:, hi, :] - cumulative[:, lo, :]
+        return totals[:, :, 0].T.tolist(), totals[:, :, 1].T.tolist()
+
+    import bisect
+    from itertools import accumulate
+
+    ts = [event[0] for event in events]
+    cumulative = []
+    for model_key in model_keys:
+        raw = [0] + list(accumulate(event[2] if event[1] == model_key else 0 for event in events))
+        weighted = [0.0] + list(accumulate(event[3] if event[1] == model_key else 0.0 for event in events))
+        cumulative.append((raw, weighted))
+
+    raw_totals = []
+    weighted_totals = []
+    for start, end in zip(start_us, end_us):
+        lo = bisect.bisect_right(ts, start)
+        hi = bisect.bisect_right(ts, end)
+        raw_totals.append([raw[hi] - raw[lo] for raw, _ in cumulative])
+        weighted_totals.append([weighted[hi] - weighted[lo] for _, weighted in cumulative])
+    return raw_totals, weighted_totals
+
+
+def solve_least_squares(rows, target, numpy=None):
+    """rows · x ≈ target の最小二乗解（NumPy がなければ正規方程式をガウスの消去法で解く）"""
+    if numpy is not None:
+        return numpy.linalg.lstsq(numpy.asarray(rows, dtype='f8'), numpy.asarray(target, dtype='f8'),
+                                  rcond=None)[0].tolist()
+
+    size = len(rows[0])
+    # 拡大係数行列 [AᵀA | Aᵀb]
+    matrix = [
+        [sum(row[i] * row[j] for row in rows) for j in range(size)]
+        + [sum(row[i] * value for row, value in zip(rows, target))]
+        for i in range(size)
+    ]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(matrix[r][col]))
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        if abs(matrix[col][col]) < 1e-12:
+            continue
+        for r in range(size):
+            if r != col:
+                factor = matrix[r][col] / matrix[col][col]
+                matrix[r] = [a - factor * b for a, b in zip(matrix[r], matrix[col])]
+    return [matrix[i][size] / matrix[i][i] if abs(matrix[i][i]) >= 1e-12 else 0.0 for i in range(size)]
+
+
+def solve_nonnegative(rows, target, numpy=None):
+    """
+    非負制約付き最小二乗（NNLS）: min ‖rows · x - target‖ s.t. x ≥ 0
+
+    SciPy があれば scipy.optimize.nnls を使い、なければ Lawson–Hanson の
+    アクティブセット法で解く（各反復の部分問題は solve_least_squares()）。
+
+    Returns:
+        list: 解 x（各要素 0 以上）
+    """
+    size = len(rows[0])
+    if numpy is not None:
+        try:
+            from scipy.optimize import nnls
+        except ImportError:  # SciPy がなければ下の実装にフォールバック
+            pass
+        else:
+            return nnls(numpy.asarray(rows, dtype='f8'), numpy.asarray(target, dtype='f8'))[0].tolist()
+
+    def gradient(x):
+        # w = Aᵀ(b - Ax)（正の成分は増やすと残差が減る変数）
+        residual = [value - sum(a * b for a, b in zip(row, x)) for row, value in zip(rows, target)]
+        return [sum(row[j] * r for row, r in zip(rows, residual)) for j in range(size)]
+
+    def solve_passive(passive):
+        solution = [0.0] * size
+        if passive:
+            partial = solve_least_squares([[row[j] for j in passive] for row in rows], target, numpy)
+            for j, value in zip(passive, partial):
+                solution[j] = value
+        return solution
+
+    x = [0.0] * size
+    passive = []
+    w = gradient(x)
+    tolerance = 1e-10 * max(1.0, max(abs(v) for v in w))
+    for _ in range(3 * size):
+        candidates = [j for j in range(size) if j not in passive and w[j] > tolerance]
+        if not candidates:
+            break
+        passive.append(max(candidates, key=lambda j: w[j]))
+        passive.sort()
+        s = solve_passive(passive)
+        # 内側ループ: 部分解が負になる変数があれば x から s へ可能な範囲だけ進め、0 になった変数を外す
+        while passive and min(s[j] for j in passive) <= 0:
+            alpha = min(x[j] / (x[j] - s[j]) if x[j] > s[j] else 0.0
+                        for j in passive if s[j] <= 0)
+            x = [a + alpha * (b - a) for a, b in zip(x, s)]
+            passive = [j for j in passive if x[j] > tolerance]
+            s = solve_passive(passive)
+        x = s
+        w = gradient(x)
+    return x
+
+
+def fit_nonnegative(columns, target, numpy=None):
+    """
+    target ≈ Σ 係数 × 列（係数 ≥ 0）を非負の最小二乗（NNLS）で解く
+
+    列は最大値で正規化してから solve_nonnegative() に渡す。
+
+    Args:
+        columns: 列のキー -> 読み取り値ごとの値（0 以上）
+        target: 読み取り値ごとの使用率
+
+    Returns:
+        dict: 列のキー -> 係数（0 になった列は含まない）
+    """
+    scales = {j: max(column) for j, column in columns.items() if max(column) > 0}
+    keys = list(scales)
+    if not keys:
+        return {}
+    rows = [[columns[j][i] / scales[j] for j in keys] for i in range(len(target))]
+    solution = solve_nonnegative(rows, target, numpy)
+    return {j: value / scales[j] for j, value in zip(keys, solution) if value > 0}
+
+
+def curve_knots(values, count=CURVE_KNOTS):
+    """補間カーブの節点（観測された生トークン数の分位点、最大値を含む昇順）"""
+    values = sorted(v for v in values if v > 0)
+    if not values:
+        return []
+    return sorted({values[round((len(values) - 1) * (k + 1) / count)] for k in range(count)})
+
+
+def curve_basis(value, knots):
+    """
+    節点 knots の折れ線カーブの基底（区間ごとの増分に掛かる係数）
+
+    カーブは原点から始まる折れ線で、k 番目の区間の増分 d_k（0 以上）を使って
+    f(x) = Σ d_k × basis_k(x) と表せる（d_k ≥ 0 ならカーブは単調非減少）。
+    interpolate_percent() と同じく最初の節点までは原点から比例させる。
+    """
+    basis = []
+    previous = 0
+    for knot in knots:
+        basis.append(min(max((value - previous) / (knot - previous), 0.0), 1.0))
+        previous = knot
+    return basis
+
+
+def resolve_model_entry(engine, calibration, key, config):
+    """
+    モデル設定のうち、当てはめた値を書き込むエントリ
+
+    inherit_from は、継承元の値をそのまま使っている項目なら継承元に書き込む。
+
+    Args:
+        key: get_model_config() のモデルキー（models / fallback_patterns のキー、または 'unknown'）
+        config: get_model_config() の設定（inherit_from 解決済み）
+
+    Returns:
+        tuple: (計算方式, 書き込む項目名, 書き込み先の dict)
+    """
+    calc_type = config.get('type', 'weight')
+    if calc_type == 'interpolate':
+        field = 'data_points'
+    elif calc_type == 'limit':
+        field = 'limit'
+    else:
+        field = 'base_limit'
+
+    models = calibration.setdefault('models', {})
+    fallbacks = calibration.setdefault('fallback_patterns', {})
+    if key == 'unknown':
+        entry = calibration.setdefault('default', dict(engine.DEFAULT_MODEL_CONFIG))
+    elif key in models:
+        entry = models[key]
+    else:
+        entry = fallbacks[key]
+    inherit = entry.get('inherit_from')
+    if inherit in models and field not in entry:
+        entry = models[inherit]
+    return calc_type, field, entry
+
+
+def fit_calibration(readings_path=None, dry_run=False):
+    """複数の読み取り値からモデル別の設定をまとめて当てはめ、model-calibration.json に書き込む"""
+    import copy
+    import math
+    import time
+    from datetime import datetime, timezone
+
+    started = time.perf_counter()
+    readings = load_readings(readings_path)
+    if len(readings) < 2:
+        print("エラー: --fit には2件以上の読み取り値が必要です", file=sys.stderr)
+        sys.exit(1)
+
+    engine = load_engine()
+    numpy = engine.load_numpy()
+    times = [ts for ts, _ in readings]
+    percents = [percent for _, percent in readings]
+    starts = resolve_window_starts(engine, times)
+
+    print(f"[FIT] 読み取り値: {len(readings)} 件（{times[0]:%Y-%m-%d %H:%M} 〜 {times[-1]:%Y-%m-%d %H:%M} UTC）")
+    events = collect_usage_events(engine, min(starts), times[-1])
+
+    # 同じ設定を使うモデル名はまとめて当てはめる
+    configs = {}
+    keys = {}
+    for model_name in {event[1] for event in events}:
+        keys[model_name], config = engine.get_model_config(model_name)
+        configs[keys[model_name]] = config
+    events = [(ts, keys[model_name], raw, weighted) for ts, model_name, raw, weighted in events]
+    model_keys = sorted(configs)
+    raw, weighted = window_totals(events, starts, times, model_keys, numpy)
+    print(f"[INFO] assistant 応答: {len(events):,} 件 / モデル: {', '.join(model_keys) or 'なし'}")
+
+    # ログが残っていないウィンドウの読み取り値は当てはめに使えない
+    kept = [i for i in range(len(readings)) if any(raw[i])]
+    if len(kept) < len(readings):
+        print(f"[INFO] ウィンドウ内のログがない読み取り値 {len(readings) - len(kept)} 件を除外しました")
+        readings = [readings[i] for i in kept]
+        percents = [percents[i] for i in kept]
+        raw = [raw[i] for i in kept]
+        weighted = [weighted[i] for i in kept]
+    if len(readings) < 2:
+        print("エラー: ウィンドウ内のログがある読み取り値が2件未満です", file=sys.stderr)
+        sys.exit(1)
+
+    calibration = copy.deepcopy(engine.load_model_calibration())
+    targets = [resolve_model_entry(engine, calibration, key, configs[key]) for key in model_keys]
+    base_limit = engine.get_token_limit(engine.get_plan_config())
+
+    def predict(model_configs):
+        return [
+            sum(engine.calculate_model_percent(model_key, config, raw[i][j], weighted[i][j], base_limit)
+                for j, (model_key, config) in enumerate(zip(model_keys, model_configs)))
+            for i in range(len(readings))
+        ]
+
+    def rmse(predicted):
+        return math.sqrt(sum((p - y) ** 2 for p, y in zip(predicted, percents)) / len(percents))
+
+    before = [configs[key] for key in model_keys]
+
+    # 線形モデルは係数（使用率% / 重み付けトークン数）、補間カーブは区間ごとの増分を未知数として、
+    # 全モデルをまとめて非負の最小二乗（NNLS）で当てはめる（補間カーブは単調非減少の折れ線になる）
+    columns = {}
+    knots = {}
+    for j, (calc_type, _, _) in enumerate(targets):
+        if calc_type != 'interpolate':
+            columns[(j, None)] = [row[j] for row in weighted]
+            continue
+        knots[j] = curve_knots(row[j] for row in raw)
+        bases = [curve_basis(row[j], knots[j]) for row in raw]
+        for k in range(len(knots[j])):
+            columns[(j, k)] = [basis[k] for basis in bases]
+    solution = fit_nonnegative(columns, percents, numpy)
+
+    fitted_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    after = []
+    fitted = set()
+    for j, (calc_type, field, entry) in enumerate(targets):
+        config = dict(before[j])
+        if j in knots and any((j, k) in solution for k in range(len(knots[j]))):
+            percent = 0.0
+            points = []
+            for k, knot in enumerate(knots[j]):
+                percent += solution.get((j, k), 0.0)
+                points.append({
+                    'raw_tokens': knot, 'percent': round(percent, 2), 'timestamp': fitted_at,
+                    'note': f'claude-calibrate.py --fit（{len(readings)} 件）'
+                })
+            config['data_points'] = entry['data_points'] = points
+            fitted.add(j)
+        elif (j, None) in solution:
+            config[field] = entry[field] = round(100 / solution[(j, None)])
+            fitted.add(j)
+        after.append(config)
+
+    before_rmse = rmse(predict(before))
+    after_rmse = rmse(predict(after))
+    print()
+    for j, (model_key, (calc_type, field, _)) in enumerate(zip(model_keys, targets)):
+        if j not in fitted:
+            print(f"  {model_key}: {calc_type}（当てはめ不可のため変更なし）")
+        elif calc_type == 'interpolate':
+            points = after[j]['data_points']
+            print(f"  {model_key}: interpolate（{len(points)} 点）"
+                  f" 最大 {points[-1]['raw_tokens']:,} トークン -> {points[-1]['percent']}%")
+        else:
+            print(f"  {model_key}: {field} {before[j].get(field, base_limit):,.0f} -> {after[j][field]:,}")
+    print()
+    print(f"[RESULT] 誤差（RMSE）: {before_rmse:.2f}% -> {after_rmse:.2f}%")
+    print(f"[INFO] 所要時間: {time.perf_counter() - started:.2f} 秒")
+
+    if dry_run:
+        print("[INFO] --dry-run のため保存しません")
+        return
+    if after_rmse > before_rmse:
+        print("[INFO] 現在の設定の方が誤差が小さいため保存しません")
+        return
+
+    calibration['updated_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    try:
+        write_json_atomic(engine.MODEL_CALIBRATION_FILE, calibration)
+    except OSError as e:
+        print(f"エラー: {engine.MODEL_CALIBRATION_FILE} の保存に失敗: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[OK] {engine.MODEL_CALIBRATION_FILE} を更新しました")
+
+
 def show_status():
     """現在のキャリブレーション状態を表示"""
+    from datetime import datetime
+
     calibration_data = load_calibration_data()
 
     if not calibration_data['history']:
@@ -175,6 +671,7 @@ def show_status():
         print()
         print("使い方:")
         print("  python claude-calibrate.py <使用率>")
+        print("  python claude-calibrate.py --fit [読み取り値のファイル] [--dry-run]")
         print()
         print("例:")
         print("  python claude-calibrate.py 30")
@@ -202,6 +699,13 @@ def main():
         show_status()
         return
 
+    if sys.argv[1] == '--fit':
+        options = sys.argv[2:]
+        dry_run = '--dry-run' in options
+        paths = [option for option in options if option != '--dry-run']
+        fit_calibration(paths[0] if paths else None, dry_run)
+        return
+
     try:
         usage_percent = float(sys.argv[1])
     except ValueError:
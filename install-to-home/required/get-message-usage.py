@@ -8,18 +8,175 @@ Claude Code メッセージ使用率計算スクリプト
 """
 
 import json
+import argparse
+import array
+import bisect
+import heapq
 import os
+import re
+import struct
 import sys
-from collections import deque
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
+from hashlib import blake2b
 from pathlib import Path
 
+# 起動時間を抑えるため、一部のモードでしか使わないモジュール
+# （sqlite3, concurrent.futures, socket, threading, select, signal, fcntl, gzip, numpy など）は
+# 使用する関数の中で import する
+
 # ウィンドウ状態管理ファイル
 WINDOW_STATE_FILE = Path.home() / '.claude' / 'usage-window.json'
 
 # パフォーマンスチューニング定数
 MAX_FILES_TO_CHECK = 10  # 初回起動時にチェックする最新ファイル数
 MAX_LINES_TO_READ = 1000  # 大きなファイルからの逆順読み込み行数制限
+REVERSE_READ_BLOCK_SIZE = 64 * 1024  # 末尾から逆順に読み込む際のブロックサイズ
+LATEST_MODEL_MAX_LINES = 100  # 最新モデルの検索でさかのぼる行数（status-line.sh の tail -100 相当）
+DIR_PRUNE_GRACE = timedelta(days=7)  # この期間以上更新のないディレクトリ直下は stat しない
+
+# 圧縮済みのトランスクリプト（ローテーションで圧縮したアーカイブ）の拡張子と形式
+ARCHIVE_SUFFIXES = (('.jsonl.gz', 'gzip'), ('.jsonl.zst', 'zstd'))
+
+# --compact: 集計に使うフィールドだけを残したサイドカー（<トランスクリプト名>.usage）
+COMPACT_SUFFIX = '.usage'
+COMPACT_MIN_IDLE = timedelta(hours=1)  # この期間更新のないトランスクリプトを終了したセッションとみなす
+
+# 増分スキャン用チェックポイント（ファイルごとの読み込み位置と集計値）
+CHECKPOINT_FILE = Path.home() / '.claude' / 'cache' / 'usage-checkpoint.json'
+CHECKPOINT_VERSION = 4  # 2: 時間バケット（buckets）, 3: 重複除去キー（keys）, 4: 応答待ちのメッセージ（pending）
+CHECKPOINT_TAIL_BYTES = 64  # 追記判定に使う処理済み末尾のバイト数
+
+# 集計対象になり得る行のバイトマーカー（一致しない行は JSON デコードしない）
+ASSISTANT_LINE_PATTERN = re.compile(rb'"type"\s*:\s*"assistant"')
+USER_LINE_PATTERN = re.compile(rb'"type"\s*:\s*"(?:user|UserPromptSubmit|user_prompt)"')
+TOOL_RESULT_PATTERN = re.compile(rb'"type"\s*:\s*"tool_result"')
+TEXT_ITEM_PATTERN = re.compile(rb'"type"\s*:\s*"text"')
+USAGE_MARKER = b'"usage"'
+USAGE_MARKER_PATTERN = re.compile(re.escape(USAGE_MARKER))
+MMAP_RELEASE_BYTES = 1024 * 1024  # mmap で走査済みのページを解放する間隔（常駐メモリの上限の目安）
+MARKER_OVERLAP = 256  # 長い行を分割して判定する際、分割位置をまたぐマーカーのために重ねて探すバイト数
+
+# --profile: read_transcript 内の処理別の時間（走査統計に秒で加算し、ワーカー間でも合算できる）
+PROFILE_SCAN_TIMERS = ('readSeconds', 'filterSeconds', 'jsonParseSeconds', 'timestampSeconds', 'aggregateSeconds')
+
+# 重複除去キー（message.id / requestId / uuid の 64 ビットハッシュ、符号付きで SQLite の INTEGER に収まる）
+DEDUPE_KEY_BYTES = 8
+DEDUPE_KEY_TYPECODE = 'q'
+
+# 列指向ストア（固定長カラムファイル、NumPy があれば memmap で集計）
+COLUMNAR_DIR = Path.home() / '.claude' / 'cache' / 'usage-columns'
+COLUMNAR_VERSION = 2  # 2: key 列を追加
+COLUMNAR_COLUMNS = (
+    ('ts', 'q'),              # UTC エポックからのマイクロ秒（昇順）
+    ('kind', 'B'),            # COLUMNAR_KIND_*
+    ('model', 'H'),           # meta.json の models のインデックス
+    ('file', 'I'),            # meta.json の files の id
+    ('input', 'q'),
+    ('output', 'q'),
+    ('cache_creation', 'q'),
+    ('cache_read', 'q'),
+    ('key', 'q'),             # 重複除去キー（event_dedupe_key、なければ 0）
+)
+COLUMNAR_KIND_ASSISTANT = 0
+COLUMNAR_KIND_USER = 1
+_numpy = False  # load_numpy() の結果（False は未読み込み）
+_zstd_open = False  # load_zstd() の結果（False は未読み込み）
+# 応答待ちのユーザーメッセージを追跡する期間（マイクロ秒）
+COLUMNAR_PENDING_TTL_US = 24 * 3600 * 1000000
+
+# 使用率キャッシュ（ccusage-daemon.mjs / --watch モードが書き込む）
+USAGE_CACHE_FILE = Path.home() / '.claude' / 'cache' / 'ccusage-cache.json'
+
+# 複数インスタンスからの同時計算をまとめる（single-flight）。ロックを持つプロセスのみが計算し、
+# 待っていたプロセスは同じ集計方法の計算結果（USAGE_RESULT_FILE）を再利用する
+# （計算結果はウィンドウのリセット時に台帳へ記録する最終集計にも使う）
+USAGE_COMPUTE_LOCK = Path.home() / '.claude' / 'cache' / 'usage-compute.lock'
+USAGE_RESULT_FILE = Path.home() / '.claude' / 'cache' / 'usage-result.json'
+
+# --watch モードの設定
+WATCH_DEBOUNCE = 0.05  # 変更検知後、続く書き込みをまとめる待ち時間（秒）
+WATCH_POLL_INTERVAL = 1.0  # inotify が使えない場合のポーリング間隔（秒）
+WATCH_MAX_INTERVAL = 60.0  # 変更がなくても再計算する間隔（秒）
+
+# --serve モードの問い合わせ用ソケット
+USAGE_SOCKET_FILE = Path.home() / '.claude' / 'cache' / 'usage.sock'
+USAGE_SOCKET_BACKLOG = 16
+USAGE_SOCKET_TIMEOUT = 0.5  # クライアントからのクエリ受信を待つ最大秒数
+
+# --statusline（ステータスラインの描画）の設定
+STATUSLINE_SESSION_CACHE = Path('/tmp/claude-usage-cache.json')  # Session 使用率（24時間以内のみ有効）
+STATUSLINE_SESSION_MAX_AGE = 86400
+STATUSLINE_BUDGET_MS = 20.0  # 描画処理の目標時間（超えた場合は stderr に警告）
+ANSI_GREEN = '\033[32m'
+ANSI_YELLOW = '\033[33m'
+ANSI_RED = '\033[31m'
+ANSI_CYAN = '\033[36m'
+ANSI_RESET = '\033[0m'
+
+# 使用量イベントストア（SQLite, WAL モード）
+EVENT_STORE_FILE = Path.home() / '.claude' / 'usage-events.db'
+EVENT_STORE_TIMEOUT = 5.0  # 他プロセスの書き込み待ちの最大秒数
+EVENT_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,               -- UTC エポックからのマイクロ秒
+    kind TEXT NOT NULL,                -- 'assistant' | 'user'
+    model_key TEXT NOT NULL,
+    model_name TEXT,
+    session TEXT,
+    file TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+    weighted_input REAL NOT NULL DEFAULT 0,
+    weighted_output REAL NOT NULL DEFAULT 0,
+    weighted_total REAL NOT NULL DEFAULT 0,
+    uuid TEXT,
+    parent_uuid TEXT,
+    dedupe_key INTEGER                 -- event_dedupe_key（同じキーのイベントは1行のみ保存）
+);
+CREATE INDEX IF NOT EXISTS idx_events_kind_ts ON events (kind, ts);
+CREATE INDEX IF NOT EXISTS idx_events_parent ON events (parent_uuid);
+CREATE INDEX IF NOT EXISTS idx_events_file ON events (file);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    mtime INTEGER,
+    offset INTEGER,
+    tail_crc INTEGER
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    granularity TEXT NOT NULL,         -- 'minute' | 'hour' | 'day'
+    bucket INTEGER NOT NULL,           -- バケット開始時刻（UTC エポック秒）
+    model_key TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+    weighted_input REAL NOT NULL DEFAULT 0,
+    weighted_output REAL NOT NULL DEFAULT 0,
+    weighted_total REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket, model_key)
+);
+"""
+EVENT_STORE_VERSION = 2  # PRAGMA user_version（1: rollups テーブルを追加, 2: dedupe_key 列を追加）
+
+# 事前集計（ロールアップ）の粒度（粗い順、バケット幅は秒）
+ROLLUP_GRANULARITIES = (('day', 86400), ('hour', 3600), ('minute', 60))
+ROLLUP_COLUMNS = (
+    'requests', 'input_tokens', 'output_tokens', 'cache_creation_tokens', 'cache_read_tokens',
+    'weighted_input', 'weighted_output', 'weighted_total'
+)
+
+# 終了した5時間ウィンドウの最終集計（1行1ウィンドウの JSON Lines）
+WINDOW_LEDGER_FILE = Path.home() / '.claude' / 'usage-window-ledger.jsonl'
+HISTORY_DAYS = 7  # --history のデフォルト集計日数
 
 # Claude Code のログディレクトリ（クロスプラットフォーム対応）
 def get_log_directory():
@@ -81,6 +238,10 @@ OUTPUT_COEFFICIENT = 5.0          # 出力: 入力の 5倍
 # モデルキャリブレーション設定ファイル
 MODEL_CALIBRATION_FILE = Path.home() / '.claude' / 'model-calibration.json'
 
+# プラン・ウィンドウ定義の設定ファイルと、claude-calibrate.py のキャリブレーションデータ
+USAGE_CONFIG_FILE = Path.home() / '.claude' / 'usage-config.json'
+CALIBRATION_FILE = Path.home() / '.claude' / 'usage-calibration.json'
+
 # デフォルトのモデル設定（設定ファイルがない場合のフォールバック）
 DEFAULT_MODEL_CONFIG = {
     "type": "weight",
@@ -88,42 +249,114 @@ DEFAULT_MODEL_CONFIG = {
     "base_limit": 24000000
 }
 
-# キャッシュ（設定ファイルの再読み込みを防ぐ）
-_model_calibration_cache = None
+# 設定ファイルのスナップショット（get_config_snapshot() / refresh_config_snapshot() が作成）
+_config_snapshot = None
+
+# コンパイル済みのモデル照合エンジン（build_model_matcher() が作成）
+_model_matcher = None
+
+# モデル名 → 使用量倍率のメモ
+_model_weight_memo = {}
+
+# 補間カーブのコンパイル結果（data_points の id → (data_points, (xs, ys))）
+_curve_cache = {}
 
 def load_model_calibration():
     """
-    モデルキャリブレーション設定を読み込む（キャッシュ付き）
+    モデルキャリブレーション設定を取得（設定スナップショットから）
 
     Returns:
         dict: キャリブレーション設定
     """
-    global _model_calibration_cache
+    return get_config_snapshot().model_calibration
 
-    if _model_calibration_cache is not None:
-        return _model_calibration_cache
+def simplify_model_key(model_key):
+    """モデルキーからベース名を抽出（opus-4.5 → opus）"""
+    key_lower = model_key.lower()
+    if 'opus' in key_lower:
+        return 'opus'
+    elif 'sonnet' in key_lower:
+        return 'sonnet'
+    elif 'haiku' in key_lower:
+        return 'haiku'
+    return 'unknown'
 
-    if not MODEL_CALIBRATION_FILE.exists():
-        # デフォルト設定を返す
-        _model_calibration_cache = {
-            "models": {},
-            "fallback_patterns": {},
-            "default": DEFAULT_MODEL_CONFIG
-        }
-        return _model_calibration_cache
+def build_model_matcher(calibration):
+    """
+    キャリブレーション設定からモデル照合エンジンを作成
 
-    try:
-        with open(MODEL_CALIBRATION_FILE, 'r', encoding='utf-8') as f:
-            _model_calibration_cache = json.load(f)
-            return _model_calibration_cache
-    except (json.JSONDecodeError, OSError) as e:
-        print(f"Warning: Failed to load model calibration: {e}", file=sys.stderr)
-        _model_calibration_cache = {
-            "models": {},
-            "fallback_patterns": {},
-            "default": DEFAULT_MODEL_CONFIG
-        }
-        return _model_calibration_cache
+    models → fallback_patterns の優先順（設定ファイル内の順序）を保ったまま、
+    全モデルの match_patterns を1つの先頭固定の正規表現にまとめる。
+    各選択肢は先読みで部分一致を判定するため、最初に一致したモデルが選ばれる。
+    inherit_from はここで一度だけ解決する。
+
+    Args:
+        calibration: load_model_calibration() の結果
+
+    Returns:
+        dict: 照合エンジン（pattern / entries / default / memo）
+    """
+    models = calibration.get('models', {})
+    entries = []
+    alternatives = []
+
+    for section in (models, calibration.get('fallback_patterns', {})):
+        for model_key, config in section.items():
+            patterns = [pattern.lower() for pattern in config.get('match_patterns', [])]
+            if not patterns:
+                continue
+
+            # inherit_from があれば継承元の設定とマージ
+            if 'inherit_from' in config:
+                config = {**models.get(config['inherit_from'], {}), **config}
+
+            group = f'm{len(entries)}'
+            alternatives.append(
+                f"(?=.*?(?:{'|'.join(re.escape(pattern) for pattern in patterns)}))(?P<{group}>)"
+            )
+            entries.append((model_key, config, simplify_model_key(model_key)))
+
+    default = ('unknown', calibration.get('default', DEFAULT_MODEL_CONFIG), 'unknown')
+    return {
+        'calibration': calibration,
+        'pattern': re.compile('|'.join(alternatives), re.DOTALL) if alternatives else None,
+        'entries': entries,
+        'default': default,
+        'memo': {}
+    }
+
+def match_model(model_name):
+    """
+    モデル名を照合し (model_key, config, simplified_key) を返す
+
+    結果はモデル名ごとにメモ化するため、同じモデル名の2回目以降は辞書参照1回で済む。
+
+    Args:
+        model_name: モデル名
+
+    Returns:
+        tuple: (model_key, config, simplified_key)
+    """
+    global _model_matcher
+
+    calibration = load_model_calibration()
+    if _model_matcher is None or _model_matcher['calibration'] is not calibration:
+        _model_matcher = build_model_matcher(calibration)
+
+    memo = _model_matcher['memo']
+    result = memo.get(model_name)
+    if result is not None:
+        return result
+
+    result = _model_matcher['default']
+    pattern = _model_matcher['pattern']
+    if pattern is not None:
+        match = pattern.match(model_name.lower() if model_name else '')
+        if match is not None:
+            result = _model_matcher['entries'][int(match.lastgroup[1:])]
+
+    memo[model_name] = result
+    return result
 
 def get_model_config(model_name):
     """
@@ -135,93 +368,84 @@ def get_model_config(model_name):
     Returns:
         tuple: (model_key, config) - モデルキーと設定のタプル
     """
-    calibration = load_model_calibration()
-    model_lower = model_name.lower() if model_name else ''
-
-    # 1. 完全一致を試す（models）
-    for model_key, config in calibration.get('models', {}).items():
-        patterns = config.get('match_patterns', [])
-        for pattern in patterns:
-            if pattern.lower() in model_lower:
-                # inherit_from があれば継承元の設定を取得
-                if 'inherit_from' in config:
-                    inherited = calibration.get('models', {}).get(config['inherit_from'], {})
-                    merged = {**inherited, **config}
-                    return model_key, merged
-                return model_key, config
-
-    # 2. フォールバックパターンを試す
-    for model_key, config in calibration.get('fallback_patterns', {}).items():
-        patterns = config.get('match_patterns', [])
-        for pattern in patterns:
-            if pattern.lower() in model_lower:
-                # inherit_from があれば継承元の設定を取得
-                if 'inherit_from' in config:
-                    inherited = calibration.get('models', {}).get(config['inherit_from'], {})
-                    merged = {**inherited, **config}
-                    return model_key, merged
-                return model_key, config
-
-    # 3. デフォルト設定を返す
-    return 'unknown', calibration.get('default', DEFAULT_MODEL_CONFIG)
+    model_key, config, _ = match_model(model_name)
+    return model_key, config
 
-def interpolate_percent(raw_tokens, data_points):
+def compile_curve(data_points):
     """
-    生トークン数から使用率を補間計算（汎用関数）
+    キャリブレーションデータポイントをトークン数順の配列に変換
 
     Args:
-        raw_tokens: 生トークン数
         data_points: キャリブレーションデータポイントのリスト
 
     Returns:
-        float: 推定使用率（%）
+        tuple: (xs, ys) - トークン数と使用率のタプル（xs の昇順）
     """
-    if not data_points or len(data_points) < 1:
-        return 0.0
-
-    # データポイントをトークン数でソート
     sorted_points = sorted(data_points, key=lambda x: x.get('raw_tokens', 0))
+    xs = tuple(point.get('raw_tokens', 0) for point in sorted_points)
+    ys = tuple(point.get('percent', 0) for point in sorted_points)
+    return xs, ys
+
+def get_compiled_curve(data_points):
+    """data_points のコンパイル結果を取得（同じリストは一度だけコンパイル）"""
+    cached = _curve_cache.get(id(data_points))
+    if cached is not None and cached[0] is data_points:
+        return cached[1]
+
+    curve = compile_curve(data_points)
+    # リスト自体も保持し、id が別オブジェクトに再利用されないようにする
+    _curve_cache[id(data_points)] = (data_points, curve)
+    return curve
+
+def interpolate_curve(raw_tokens, curve):
+    """
+    コンパイル済みカーブから使用率を補間計算（二分探索）
+
+    Args:
+        raw_tokens: 生トークン数
+        curve: compile_curve() の結果
 
-    if raw_tokens <= 0:
+    Returns:
+        float: 推定使用率（%）
+    """
+    xs, ys = curve
+    if not xs or raw_tokens <= 0:
         return 0.0
 
     # 最小値より小さい場合：比例計算
-    first_point = sorted_points[0]
-    if raw_tokens <= first_point.get('raw_tokens', 0):
-        if first_point.get('raw_tokens', 0) > 0:
-            ratio = raw_tokens / first_point['raw_tokens']
-            return first_point.get('percent', 0) * ratio
+    if raw_tokens <= xs[0]:
+        if xs[0] > 0:
+            return ys[0] * (raw_tokens / xs[0])
         return 0.0
 
     # 最大値より大きい場合：外挿
-    last_point = sorted_points[-1]
-    if raw_tokens >= last_point.get('raw_tokens', 0):
-        if len(sorted_points) >= 2:
-            x1 = sorted_points[-2].get('raw_tokens', 0)
-            y1 = sorted_points[-2].get('percent', 0)
-            x2 = last_point.get('raw_tokens', 0)
-            y2 = last_point.get('percent', 0)
+    if raw_tokens >= xs[-1]:
+        if len(xs) >= 2:
+            x1, y1, x2, y2 = xs[-2], ys[-2], xs[-1], ys[-1]
             slope = (y2 - y1) / (x2 - x1) if x2 != x1 else 0
             return y2 + slope * (raw_tokens - x2)
-        else:
-            return last_point.get('percent', 0)
+        return ys[-1]
 
-    # 補間：該当する区間を探す
-    for i in range(len(sorted_points) - 1):
-        x1 = sorted_points[i].get('raw_tokens', 0)
-        y1 = sorted_points[i].get('percent', 0)
-        x2 = sorted_points[i + 1].get('raw_tokens', 0)
-        y2 = sorted_points[i + 1].get('percent', 0)
+    # 補間：x1 < raw_tokens <= x2 となる区間を二分探索
+    i = bisect.bisect_left(xs, raw_tokens)
+    x1, y1, x2, y2 = xs[i - 1], ys[i - 1], xs[i], ys[i]
+    ratio = (raw_tokens - x1) / (x2 - x1)
+    return y1 + (y2 - y1) * ratio
+
+def interpolate_percent(raw_tokens, data_points):
+    """
+    生トークン数から使用率を補間計算（汎用関数）
 
-        if x1 <= raw_tokens <= x2:
-            # 線形補間
-            if x2 == x1:
-                return y1
-            ratio = (raw_tokens - x1) / (x2 - x1)
-            return y1 + (y2 - y1) * ratio
+    Args:
+        raw_tokens: 生トークン数
+        data_points: キャリブレーションデータポイントのリスト
 
-    # フォールバック
-    return last_point.get('percent', 0)
+    Returns:
+        float: 推定使用率（%）
+    """
+    if not data_points:
+        return 0.0
+    return interpolate_curve(raw_tokens, get_compiled_curve(data_points))
 
 def calculate_model_percent(model_key, config, raw_tokens, weighted_tokens, base_limit):
     """
@@ -271,38 +495,16 @@ def get_model_key_from_name(model_name):
     Returns:
         str: 簡略化されたモデルキー（opus, sonnet, haiku, unknown）
     """
-    model_key, _ = get_model_config(model_name)
-
-    # モデルキーからベース名を抽出（opus-4.5 → opus）
-    if 'opus' in model_key.lower():
-        return 'opus'
-    elif 'sonnet' in model_key.lower():
-        return 'sonnet'
-    elif 'haiku' in model_key.lower():
-        return 'haiku'
-    return 'unknown'
+    return match_model(model_name)[2]
 
 def load_calibration_data():
     """
-    キャリブレーションデータを読み込む
+    キャリブレーションデータを取得（設定スナップショットから）
 
     Returns:
-        dict or None: キャリブレーションデータ（存在しない場合はNone）
+        dict or None: キャリブレーションデータ（存在しないか無効な場合はNone）
     """
-    calibration_file = Path.home() / '.claude' / 'usage-calibration.json'
-
-    if not calibration_file.exists():
-        return None
-
-    try:
-        with open(calibration_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # 有効なキャリブレーションデータか確認
-            if data.get('current_limit') and data.get('confidence', 0) > 0:
-                return data
-            return None
-    except (json.JSONDecodeError, OSError):
-        return None
+    return get_config_snapshot().calibration
 
 def get_token_limit(plan):
     """
@@ -315,16 +517,19 @@ def get_token_limit(plan):
         int: トークン制限値
     """
     # キャリブレーションデータを確認
-    calibration_data = load_calibration_data()
+    snapshot = get_config_snapshot()
+    calibration_data = snapshot.calibration
 
     if calibration_data and calibration_data.get('plan') == plan:
         limit = calibration_data.get('current_limit')
         confidence = calibration_data.get('confidence', 0)
 
         if limit and confidence > 0:
-            # デバッグ情報（stderr に出力）
-            print(f"[INFO] キャリブレーション済み制限値を使用: {limit:,.0f} (信頼度: {confidence*100:.0f}%)",
-                  file=sys.stderr)
+            # デバッグ情報（stderr に出力、同じスナップショットでは1回だけ）
+            if not snapshot.limit_reported:
+                snapshot.limit_reported = True
+                print(f"[INFO] キャリブレーション済み制限値を使用: {limit:,.0f} (信頼度: {confidence*100:.0f}%)",
+                      file=sys.stderr)
             return int(limit)
 
     # キャリブレーションデータがない場合はデフォルト値
@@ -332,15 +537,20 @@ def get_token_limit(plan):
 
 def get_model_weight(model_name):
     """モデル名から使用量倍率を取得"""
-    if not model_name:
-        return DEFAULT_MODEL_WEIGHT
+    weight = _model_weight_memo.get(model_name)
+    if weight is not None:
+        return weight
 
-    model_lower = model_name.lower()
-    for key, weight in MODEL_WEIGHTS.items():
-        if key in model_lower:
-            return weight
+    weight = DEFAULT_MODEL_WEIGHT
+    if model_name:
+        model_lower = model_name.lower()
+        for key, model_weight in MODEL_WEIGHTS.items():
+            if key in model_lower:
+                weight = model_weight
+                break
 
-    return DEFAULT_MODEL_WEIGHT
+    _model_weight_memo[model_name] = weight
+    return weight
 
 def calculate_weighted_tokens(usage, model_name):
     """
@@ -393,33 +603,240 @@ def calculate_weighted_tokens(usage, model_name):
 DEFAULT_PLAN = 'pro'
 
 def get_plan_config():
-    """プラン設定を読み込む"""
-    config_file = Path.home() / '.claude' / 'usage-config.json'
-
-    try:
-        if config_file.exists():
-            with open(config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                plan = config.get('plan', DEFAULT_PLAN)
-                return plan
-    except (json.JSONDecodeError, OSError) as e:
-        # 設定ファイルの読み込みに失敗した場合はデフォルトを使用
-        print(f"Warning: Failed to read config file: {e}", file=sys.stderr)
-        pass
-
-    return DEFAULT_PLAN
+    """プラン設定を取得（設定スナップショットから）"""
+    return get_config_snapshot().plan
 
 def get_message_limit():
     """現在のプランに応じたメッセージ制限を取得"""
     plan = get_plan_config()
     return MESSAGE_LIMITS.get(plan, MESSAGE_LIMITS[DEFAULT_PLAN])
 
+# 同時に評価する使用量ウィンドウ（usage-config.json の "windows" で上書き）
+# fixed: usage-window.json の開始時刻から（終了は正時に丸めた開始時刻 + hours）
+# rolling: 現在時刻から hours 時間前まで（USAGE_BUCKET_SECONDS 単位の時間バケットで集計）
+FIXED_WINDOW_HOURS = 5  # fixed ウィンドウの時間（usage-window.json のウィンドウと同じ）
+DEFAULT_USAGE_WINDOWS = ({'name': '5h', 'type': 'fixed', 'hours': FIXED_WINDOW_HOURS},)
+USAGE_WINDOW_TYPES = ('fixed', 'rolling')
+USAGE_BUCKET_SECONDS = 60
+BREAKDOWN_TOP_K = 5  # プロジェクト・セッション別の使用量を出力する上位件数（usageBreakdown）
+
+def get_usage_windows():
+    """
+    usage-config.json のウィンドウ定義を取得（設定スナップショットから）
+
+    Returns:
+        list: ウィンドウ定義のリスト（設定がなければ DEFAULT_USAGE_WINDOWS）
+    """
+    return list(get_config_snapshot().windows)
+
+def parse_usage_windows(definitions):
+    """
+    usage-config.json の "windows" を検証する
+
+    各定義は name, type（fixed | rolling）, hours と、任意で perModel（モデル別の内訳）、
+    limit（ウィンドウ全体の重み付けトークン上限）、modelLimits（モデルキー -> 上限）を持つ。
+    fixed は usage-window.json のウィンドウの集計をそのまま使うため、hours は FIXED_WINDOW_HOURS のみ。
+    不正な定義は警告を出して無視する。
+
+    Args:
+        definitions: "windows" の値（未設定なら None）
+
+    Returns:
+        list: ウィンドウ定義のリスト（設定がなければ DEFAULT_USAGE_WINDOWS）
+    """
+    if definitions is None:
+        return list(DEFAULT_USAGE_WINDOWS)
+
+    windows = []
+    names = set()
+    for definition in definitions if isinstance(definitions, list) else [definitions]:
+        if not isinstance(definition, dict):
+            print(f"Warning: Ignoring invalid window definition: {definition!r}", file=sys.stderr)
+            continue
+        name = definition.get('name')
+        hours = definition.get('hours')
+        model_limits = definition.get('modelLimits') or {}
+        # modelLimits が辞書でない場合は不正な上限（False）として扱う
+        limits = [definition.get('limit'), *model_limits.values()] if isinstance(model_limits, dict) else [False]
+        if (not isinstance(name, str) or not name or name in names
+                or definition.get('type') not in USAGE_WINDOW_TYPES
+                or not isinstance(hours, (int, float)) or isinstance(hours, bool) or hours <= 0
+                or any(limit is not None and (isinstance(limit, bool) or not isinstance(limit, (int, float))
+                                              or limit <= 0)
+                       for limit in limits)):
+            print(f"Warning: Ignoring invalid window definition: {definition!r}", file=sys.stderr)
+            continue
+        if definition['type'] == 'fixed' and hours != FIXED_WINDOW_HOURS:
+            print(f"Warning: Ignoring fixed window {name!r}: hours must be {FIXED_WINDOW_HOURS} "
+                  f"(use a rolling window for other durations)", file=sys.stderr)
+            continue
+        names.add(name)
+        windows.append(definition)
+
+    return windows or list(DEFAULT_USAGE_WINDOWS)
+
+class ConfigSnapshot:
+    """
+    設定ファイル（usage-config.json / usage-calibration.json / model-calibration.json）の検証済みスナップショット
+
+    3つのファイルを一度に読み込んで検証し、各ファイルの (mtime, サイズ) を fingerprint として保持する。
+    読み込み後は内容を変更せず、ファイルが変更された場合は refresh_config_snapshot() が
+    新しいスナップショットに丸ごと差し替える（読み込み途中の設定が混ざることはない）。
+    """
+
+    FILES = (USAGE_CONFIG_FILE, CALIBRATION_FILE, MODEL_CALIBRATION_FILE)
+
+    def __init__(self, fingerprint=None):
+        # 読み込み前に fingerprint を取り、読み込み中に変更された場合は次回の確認で読み込み直す
+        self.fingerprint = self.take_fingerprint() if fingerprint is None else fingerprint
+        self.limit_reported = False  # get_token_limit() がキャリブレーション済み制限値を出力したか
+
+        config = self._load(USAGE_CONFIG_FILE, 'Failed to read config file')
+        if not isinstance(config, dict):
+            if config is not None:
+                print("Warning: Failed to read config file: not an object", file=sys.stderr)
+            config = {}
+        plan = config.get('plan', DEFAULT_PLAN)
+        if not isinstance(plan, str) or not plan:
+            print(f"Warning: Ignoring invalid plan: {plan!r}", file=sys.stderr)
+            plan = DEFAULT_PLAN
+        self.plan = plan
+        self.windows = tuple(parse_usage_windows(config.get('windows')))
+
+        # 有効なキャリブレーションデータのみ使用（読み込めない場合も警告は出さない）
+        calibration = self._load(CALIBRATION_FILE)
+        if not (isinstance(calibration, dict) and calibration.get('current_limit')
+                and isinstance(calibration.get('confidence', 0), (int, float))
+                and calibration.get('confidence', 0) > 0):
+            calibration = None
+        self.calibration = calibration
+
+        model_calibration = self._load(MODEL_CALIBRATION_FILE, 'Failed to load model calibration')
+        if not isinstance(model_calibration, dict):
+            if model_calibration is not None:
+                print("Warning: Failed to load model calibration: not an object", file=sys.stderr)
+            # デフォルト設定を使用
+            model_calibration = {
+                "models": {},
+                "fallback_patterns": {},
+                "default": DEFAULT_MODEL_CONFIG
+            }
+        self.model_calibration = model_calibration
+
+    @classmethod
+    def take_fingerprint(cls):
+        """各設定ファイルの (mtime_ns, サイズ)（存在しないファイルは None）"""
+        fingerprint = []
+        for path in cls.FILES:
+            try:
+                st = path.stat()
+                fingerprint.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    @staticmethod
+    def _load(path, warning=None):
+        """JSON ファイルを読み込む（存在しない場合・失敗した場合は None、warning があれば警告を出す）"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                profile_count('configLoads')
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            if warning is not None:
+                print(f"Warning: {warning}: {e}", file=sys.stderr)
+            return None
+
+def get_config_snapshot():
+    """
+    現在の設定スナップショットを取得（初回のみ読み込む）
+
+    ファイルの変更は確認しないため、モデル照合などの頻繁に呼ばれる処理からも使える。
+    変更の確認は使用率の計算ごとに refresh_config_snapshot() で行う。
+
+    Returns:
+        ConfigSnapshot: 設定スナップショット
+    """
+    global _config_snapshot
+
+    if _config_snapshot is None:
+        _config_snapshot = ConfigSnapshot()
+    return _config_snapshot
+
+def refresh_config_snapshot():
+    """
+    設定ファイルの (mtime, サイズ) が変わっていればスナップショットを読み込み直す
+
+    常駐モード（--watch / --serve）でも再計算のたびに呼ばれるため、
+    キャリブレーションの更新が再起動なしで反映される。
+
+    Returns:
+        ConfigSnapshot: 最新の設定スナップショット
+    """
+    global _config_snapshot
+
+    fingerprint = ConfigSnapshot.take_fingerprint()
+    if _config_snapshot is None or _config_snapshot.fingerprint != fingerprint:
+        _config_snapshot = ConfigSnapshot(fingerprint)
+        # 古い data_points のコンパイル結果を解放（モデル照合エンジンは次の照合で作り直される）
+        _curve_cache.clear()
+    return _config_snapshot
+
+def get_bucket_hours(windows):
+    """時間バケットを保持する必要のある時間（rolling ウィンドウの最長、なければ 0）"""
+    return max((w['hours'] for w in windows if w['type'] == 'rolling'), default=0)
+
+def get_scan_since(window_start, bucket_hours=0):
+    """
+    集計に必要なファイルの更新日時の下限（iter_transcripts の since）
+
+    Args:
+        window_start: ウィンドウ開始時刻
+        bucket_hours: 時間バケットを保持する時間（get_bucket_hours 参照）
+
+    Returns:
+        tuple: (since, bucket_since) - bucket_since は時間バケットの下限（bucket_hours が 0 なら None）
+    """
+    if not bucket_hours:
+        return window_start, None
+    bucket_since = datetime.now(timezone.utc) - timedelta(hours=bucket_hours)
+    return min(window_start, bucket_since), bucket_since
+
+def write_json_atomic(path, data, indent=None):
+    """
+    JSON ファイルを一時ファイルへの書き込みと rename で置き換える
+
+    読み手（ステータスライン・他のインスタンス）が書き込み途中の内容を読むことはない。
+    一時ファイル名にはプロセス ID を含め、同時に書き込む他のプロセスと衝突しないようにする。
+
+    Args:
+        path: 書き込み先のパス
+        data: JSON に変換するデータ
+        indent: json.dumps の indent
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        # json.dump はストリーム出力のため純 Python のエンコーダになる。dumps で一括変換する
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, indent=indent))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
 def get_window_state():
     """ウィンドウ状態を取得"""
     if not WINDOW_STATE_FILE.exists():
         return None
 
     try:
+        profile_count('configLoads')
         with open(WINDOW_STATE_FILE, 'r', encoding='utf-8') as f:
             state = json.load(f)
             result = {
@@ -448,9 +865,7 @@ def save_window_state(window_start, first_message_timestamp=None, reset_timestam
     if reset_timestamp is not None:
         state['resetTimestamp'] = reset_timestamp.isoformat()
 
-    WINDOW_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(WINDOW_STATE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(state, f, indent=2)
+    write_json_atomic(WINDOW_STATE_FILE, state, indent=2)
 
 def round_to_hour_utc(dt):
     """
@@ -484,12 +899,252 @@ def should_reset_window(window_start, now):
     elapsed = now - rounded_start
     return elapsed >= timedelta(hours=5)
 
-def find_latest_activity(log_dir):
+def archive_format(name):
+    """
+    圧縮済みトランスクリプトの形式を判定
+
+    Args:
+        name: ファイル名またはパス
+
+    Returns:
+        str or None: 'gzip' / 'zstd'（非圧縮なら None）
+    """
+    name = str(name)
+    for suffix, archive in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return archive
+    return None
+
+def is_transcript_name(name):
+    """
+    集計対象のトランスクリプトファイル名か判定
+
+    .jsonl と gzip 圧縮の .jsonl.gz に加え、zstd を展開できる環境（load_zstd 参照）では
+    .jsonl.zst も対象にする。
+    """
+    if name.endswith('.jsonl'):
+        return True
+    archive = archive_format(name)
+    return archive == 'gzip' or (archive == 'zstd' and load_zstd() is not None)
+
+def transcript_source(path):
+    """
+    サイドカー（compact_transcripts 参照）なら元のトランスクリプトのパスを返す
+
+    チェックポイントやストアのファイルのキーは、実際に読んだファイルではなく元のパスにする。
+    """
+    path = Path(path)
+    if path.name.endswith(COMPACT_SUFFIX):
+        return path.with_name(path.name[:-len(COMPACT_SUFFIX)])
+    return path
+
+def iter_transcripts(log_dir, since=None, stats=None, prefer_sidecars=True):
+    """
+    os.scandir でログディレクトリ配下のトランスクリプトを列挙
+
+    since を指定した場合、更新日時が since より前のファイルは返さない。さらに
+    mtime が since - DIR_PRUNE_GRACE より前のディレクトリは直下のファイルを stat せず、
+    サブディレクトリがないこと（st_nlink == 2）が分かれば一覧の取得も省略する。
+    ディレクトリの mtime はファイルの作成・削除でしか更新されず追記では変わらないため、
+    長時間続くセッションを取りこぼさないよう DIR_PRUNE_GRACE の余裕を持たせている。
+    圧縮済みのアーカイブ（is_transcript_name 参照）も同じ条件で列挙する。
+    トランスクリプトより新しいサイドカー（compact_transcripts 参照）があれば、代わりにそちらを返す。
+
+    Args:
+        log_dir: Claude Code のログディレクトリパス
+        since: この時刻以降に更新されたファイルのみを返す（datetime、Noneなら全て）
+        stats: 走査統計（指定時は確認したファイル数・mtime で除外した数などを加算）
+        prefer_sidecars: False なら常に元のトランスクリプトを返す
+
+    Yields:
+        tuple: (Path, os.stat_result) - ディレクトリ名順の深さ優先
+    """
+    since_ts = since.timestamp() if since is not None else None
+    prune_before = (since - DIR_PRUNE_GRACE).timestamp() if since is not None else None
+
+    # (ディレクトリパス, ディレクトリ直下のファイルを読むか)
+    stack = [(str(log_dir), True)]
+
+    while stack:
+        dir_path, include_files = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            # 走査中に削除されたディレクトリ等は無視
+            continue
+
+        subdirs = []
+        sidecars = {}
+        if include_files and prefer_sidecars:
+            sidecars = {entry.name: entry for entry in entries if entry.name.endswith(COMPACT_SUFFIX)}
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if prune_before is None:
+                        subdirs.append((entry.path, True))
+                        continue
+                    dir_st = entry.stat(follow_symlinks=False)
+                    if dir_st.st_mtime >= prune_before:
+                        subdirs.append((entry.path, True))
+                    elif dir_st.st_nlink != 2:
+                        # 古いディレクトリでもサブディレクトリの中は確認する
+                        subdirs.append((entry.path, False))
+                    elif stats is not None:
+                        stats['dirsPruned'] += 1
+                    continue
+
+                if not include_files or not is_transcript_name(entry.name):
+                    continue
+
+                st = entry.stat()
+            except OSError:
+                continue
+
+            if stats is not None:
+                stats['filesSeen'] += 1
+            if since_ts is not None and st.st_mtime < since_ts:
+                if stats is not None:
+                    stats['filesSkippedMtime'] += 1
+                continue
+
+            path = entry.path
+            sidecar = sidecars.get(entry.name + COMPACT_SUFFIX)
+            if sidecar is not None:
+                try:
+                    sidecar_st = sidecar.stat()
+                except OSError:
+                    sidecar_st = None
+                # 作成後にトランスクリプトへ追記されたサイドカーは使わない
+                if sidecar_st is not None and sidecar_st.st_mtime_ns >= st.st_mtime_ns:
+                    path, st = sidecar.path, sidecar_st
+            yield Path(path), st
+
+        # 名前順に処理するため逆順に積む
+        stack.extend(reversed(subdirs))
+
+def iter_lines_reverse(f, block_size=REVERSE_READ_BLOCK_SIZE):
+    """
+    バイナリファイルを末尾から固定サイズのブロックで読み、行を新しい順に返す
+
+    呼び出し側が途中で読み込みをやめれば、それ以上さかのぼって読まないため、
+    末尾付近の検索はファイルサイズではなく読んだ範囲の大きさにのみ比例する。
+
+    Args:
+        f: バイナリモードで開いたファイル
+        block_size: 1回に読み込むバイト数
+
+    Yields:
+        bytes: 改行を除いた行（空行は除く）
+    """
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    # 読み込み途中の行の断片（右側の断片から順に格納）
+    pending = []
+
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size)
+
+        end = len(block)
+        while True:
+            newline = block.rfind(b'\n', 0, end)
+            if newline == -1:
+                pending.append(block[:end])
+                break
+
+            pending.append(block[newline + 1:end])
+            line = b''.join(reversed(pending))
+            pending = []
+            if line:
+                yield line
+            end = newline
+
+    line = b''.join(reversed(pending))
+    if line:
+        yield line
+
+def find_latest_entry(jsonl_file, predicate, max_lines=MAX_LINES_TO_READ):
+    """
+    トランスクリプトを末尾からさかのぼり、条件に一致する最新の assistant イベントを返す
+
+    Args:
+        jsonl_file: トランスクリプトのパス
+        predicate: パース済みイベントを受け取り、一致すればTrueを返す関数
+        max_lines: さかのぼる最大行数
+
+    Returns:
+        dict or None: 一致したイベント
+    """
+    archive = archive_format(jsonl_file)
+    with open(jsonl_file, 'rb') as f:
+        if archive is None:
+            lines = iter_lines_reverse(f)
+        else:
+            lines = _read_archive_tail(f, archive, max_lines)
+
+        for count, line in enumerate(lines):
+            if count >= max_lines:
+                break
+            if ASSISTANT_LINE_PATTERN.search(line) is None:
+                continue
+
+            try:
+                entry = json.loads(line)
+            except (json.JSONDecodeError, ValueError):
+                continue
+            if isinstance(entry, dict) and entry.get('type') == 'assistant' and predicate(entry):
+                return entry
+
+    return None
+
+def _read_archive_tail(f, archive, max_lines):
+    """
+    find_latest_entry のアーカイブ用: 展開しながら末尾 max_lines 行のうち
+    assistant の行だけを保持し、新しい順に返す（後ろから読めないため先頭から展開する）
+
+    Returns:
+        list: 改行を除いた行（assistant 以外の行は空の bytes）
+    """
+    tail = []
+    with open_archive(f, archive) as stream:
+        for line in stream:
+            tail.append(line.rstrip(b'\n') if ASSISTANT_LINE_PATTERN.search(line) else b'')
+            if len(tail) > 2 * max_lines:
+                del tail[:-max_lines]
+    return tail[::-1]
+
+def find_latest_model(transcript_path, max_lines=LATEST_MODEL_MAX_LINES):
+    """
+    トランスクリプトの最新の assistant 応答のモデル名を取得
+
+    Args:
+        transcript_path: トランスクリプトのパス
+        max_lines: さかのぼる最大行数
+
+    Returns:
+        str or None: モデル名（例: 'claude-opus-4-5-20251101'）
+    """
+    def has_model(entry):
+        message = entry.get('message')
+        return isinstance(message, dict) and bool(message.get('model'))
+
+    try:
+        entry = find_latest_entry(transcript_path, has_model, max_lines)
+    except OSError:
+        return None
+    return entry['message']['model'] if entry else None
+
+def find_latest_activity(log_dir, since=None):
     """
     ログから最新のアクティビティ（assistant応答）のタイムスタンプを探す
 
     Args:
         log_dir: Claude Code のログディレクトリパス
+        since: この時刻より前に更新されたファイルは確認しない（Noneなら全て）
 
     Returns:
         datetime: 最新のアクティビティタイムスタンプ（見つからない場合はNone）
@@ -497,33 +1152,24 @@ def find_latest_activity(log_dir):
     latest_ts = None
 
     try:
-        # 全プロジェクトのログファイルを走査（更新日時でソート）
-        jsonl_files = sorted(log_dir.rglob('*.jsonl'), key=lambda f: f.stat().st_mtime, reverse=True)
+        # 更新日時が新しい順に最新のN個のファイルのみチェック（パフォーマンス考慮）
+        # 全ファイルをソートせず、サイズNのヒープで選択する
+        newest_files = heapq.nlargest(
+            MAX_FILES_TO_CHECK, iter_transcripts(log_dir, since), key=lambda item: item[1].st_mtime
+        )
 
-        # 最新のN個のファイルのみチェック（パフォーマンス考慮）
-        for jsonl_file in jsonl_files[:MAX_FILES_TO_CHECK]:
+        for jsonl_file, _ in newest_files:
             try:
-                with open(jsonl_file, 'r', encoding='utf-8') as f:
-                    # メモリ枯渇を防ぐため、末尾の限られた行数のみ読み込む
-                    lines = deque(f, maxlen=MAX_LINES_TO_READ)
-
-                    # ファイルを逆順で読む（最新イベントから）
-                    for line in reversed(lines):
-                        if not line.strip():
-                            continue
-
-                        try:
-                            entry = json.loads(line)
-
-                            # assistant応答を探す
-                            if entry.get('type') == 'assistant':
-                                ts_str = entry.get('timestamp')
-                                if ts_str:
-                                    ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                                    if latest_ts is None or ts > latest_ts:
-                                        latest_ts = ts
-                        except (json.JSONDecodeError, ValueError, KeyError):
-                            continue
+                # 末尾から逆順に読み、最新の assistant 応答が見つかった時点で打ち切る
+                entry = find_latest_entry(jsonl_file, lambda e: bool(e.get('timestamp')))
+                if entry is None:
+                    continue
+
+                ts = datetime.fromisoformat(entry['timestamp'].replace('Z', '+00:00'))
+                if latest_ts is None or ts > latest_ts:
+                    latest_ts = ts
+            except (ValueError, AttributeError):
+                continue
             except OSError as e:
                 print(f"Warning: Failed to read file {jsonl_file}: {e}", file=sys.stderr)
                 continue
@@ -532,48 +1178,3000 @@ def find_latest_activity(log_dir):
 
     return latest_ts
 
-def calculate_message_usage(window_hours=5, message_limit=None):
+def new_usage_aggregate():
     """
-    5時間固定ウィンドウ内のメッセージ使用数を計算（リセット機能付き）
-
-    Args:
-        window_hours: ウィンドウの時間（デフォルト5時間）
-        message_limit: メッセージ数の上限（デフォルト250）
+    空のトークン集計データを作成
 
     Returns:
-        dict: メッセージ使用状況
+        dict: raw/weighted/by_model の集計値、ユーザーメッセージのリスト、
+              rolling ウィンドウ用の時間バケット（add_usage_bucket 参照）
     """
-    # メッセージ制限が指定されていない場合、プラン設定から取得
-    if message_limit is None:
-        message_limit = get_message_limit()
+    return {
+        'raw': {'input': 0, 'output': 0, 'cache_creation': 0, 'cache_read': 0, 'total': 0},
+        'weighted': {'input': 0, 'output': 0, 'total': 0},
+        'by_model': {},
+        'messages': [],
+        'buckets': {}
+    }
 
-    plan = get_plan_config()
-    log_dir = get_log_directory()
+def merge_usage_aggregate(dst, src):
+    """
+    集計データ src を dst に加算する（dst を直接更新）
 
-    if not log_dir.exists():
-        return {
-            "error": f"Log directory not found: {log_dir}",
-            "messageCount": 0,
-            "messageLimit": message_limit,
-            "messagePercent": 0
-        }
+    Args:
+        dst: 加算先の集計データ
+        src: 加算する集計データ
+    """
+    for key, value in src['raw'].items():
+        dst['raw'][key] += value
+    for key, value in src['weighted'].items():
+        dst['weighted'][key] += value
+
+    for model_key, model_data in src['by_model'].items():
+        if model_key not in dst['by_model']:
+            dst['by_model'][model_key] = {
+                'requests': 0,
+                'inputTokens': 0,
+                'outputTokens': 0,
+                'rawTokens': 0,
+                'weightedTokens': 0
+            }
+        target = dst['by_model'][model_key]
+        for key in target:
+            target[key] += model_data.get(key, 0)
 
-    now = datetime.now(timezone.utc)
+    dst['messages'].extend(src['messages'])
 
-    # ウィンドウ状態を取得
-    window_state = get_window_state()
+    for bucket, models in src.get('buckets', {}).items():
+        target_models = dst['buckets'].get(bucket)
+        if target_models is None:
+            dst['buckets'][bucket] = {model_key: list(values) for model_key, values in models.items()}
+            continue
+        for model_key, values in models.items():
+            target = target_models.get(model_key)
+            if target is None:
+                target_models[model_key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    target[i] += value
+
+def add_usage_bucket(buckets, ts, model_key, usage, weighted_total):
+    """
+    assistant 応答1件を時間バケットに加算する
 
-    # リセット判定：5時間経過したかチェック
-    if window_state is not None and should_reset_window(window_state['windowStart'], now):
-        # 5時間経過 → ウィンドウをリセット（0%に戻す）
-        # リセットタイムスタンプを記録（この時点以降のメッセージのみカウントする）
-        save_window_state(
-            window_start=now,  # ダミー（すぐに上書きされる）
-            first_message_timestamp=now,  # ダミー
-            reset_timestamp=now  # リセット時点のタイムスタンプを記録
-        )
+    バケットは USAGE_BUCKET_SECONDS 単位の開始時刻（UTC エポック秒の文字列。
+    チェックポイントの JSON にそのまま保存するため）-> モデルキー ->
+    [リクエスト数, input, output, cache_creation, cache_read, 重み付けトークン数]。
 
-        # トークン制限値を取得
+    Args:
+        buckets: 加算先のバケット
+        ts: 応答のタイムスタンプ
+        model_key: モデルキー
+        usage: message.usage
+        weighted_total: 重み付けトークン数
+    """
+    bucket = str(int(ts.timestamp()) // USAGE_BUCKET_SECONDS * USAGE_BUCKET_SECONDS)
+    models = buckets.get(bucket)
+    if models is None:
+        models = buckets[bucket] = {}
+    values = models.get(model_key)
+    if values is None:
+        values = models[model_key] = [0, 0, 0, 0, 0, 0]
+    values[0] += 1
+    values[1] += usage.get('input_tokens', 0)
+    values[2] += usage.get('output_tokens', 0)
+    values[3] += usage.get('cache_creation_input_tokens', 0)
+    values[4] += usage.get('cache_read_input_tokens', 0)
+    values[5] += weighted_total
+
+class UsageBreakdown:
+    """
+    プロジェクト・セッション（トランスクリプト）別の使用量の上位 K 件
+
+    ファイルごとの合計をパス順に add() する。プロジェクト（ログディレクトリ直下のディレクトリ）の
+    合計はパスがそのディレクトリを抜けた時点で確定させるため、保持するのは上位 K 件の
+    最小ヒープ2つと集計中のプロジェクト1件だけで、アクティブなセッション数によらず一定。
+    アクティブなプロジェクト・セッションの数は件数だけを数える。
+    """
+
+    def __init__(self, log_dir, top_k=BREAKDOWN_TOP_K):
+        self.log_dir = Path(log_dir)
+        self.top_k = top_k
+        # (weightedTokens, キー, 集計値) の最小ヒープ（先頭が上位 K 件のうち最小）
+        self.projects = []
+        self.sessions = []
+        self.project = None
+        self.active_projects = 0
+        self.active_sessions = 0
+        self.total_weighted = 0
+
+    def _offer(self, heap, key, totals):
+        item = (totals['weightedTokens'], key, totals)
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+
+    def _close_project(self):
+        if self.project is not None:
+            self._offer(self.projects, self.project['project'], self.project)
+            self.project = None
+
+    def add(self, file_key, weighted, raw, requests, messages):
+        """
+        1ファイル分の合計を加える（ウィンドウ内の応答・メッセージがなければ数えない）
+
+        Args:
+            file_key: トランスクリプトのパス（transcript_source 参照）
+            weighted: 重み付けトークン数
+            raw: 生トークン数（input / output / cache_creation / cache_read の合計）
+            requests: assistant 応答数
+            messages: ユーザーメッセージ数
+        """
+        if not (requests or messages):
+            return
+
+        path = Path(file_key)
+        try:
+            parts = path.relative_to(self.log_dir).parts
+        except ValueError:
+            parts = ()
+        project = parts[0] if len(parts) > 1 else path.parent.name
+        totals = {'weightedTokens': weighted, 'rawTokens': raw, 'requests': requests, 'messages': messages}
+
+        self.active_sessions += 1
+        self.total_weighted += weighted
+        self._offer(self.sessions, str(path), {
+            'session': path.name.split('.jsonl', 1)[0],
+            'project': project,
+            **totals
+        })
+
+        if self.project is None or self.project['project'] != project:
+            self._close_project()
+            self.project = {'project': project, 'sessions': 0,
+                            **dict.fromkeys(totals, 0)}
+            self.active_projects += 1
+        self.project['sessions'] += 1
+        for key, value in totals.items():
+            self.project[key] += value
+
+    def add_aggregate(self, file_key, aggregate):
+        """ファイル単位の集計データ（new_usage_aggregate 形式）を add() する"""
+        self.add(
+            file_key,
+            aggregate['weighted']['total'],
+            sum(aggregate['raw'].values()),
+            sum(model_data['requests'] for model_data in aggregate['by_model'].values()),
+            len(aggregate['messages'])
+        )
+
+    def report(self):
+        """
+        出力用の結果（weightedTokens の多い順、weightedRatio は全体に占める割合%）
+
+        Returns:
+            dict: topK / activeProjects / activeSessions / projects / sessions
+        """
+        self._close_project()
+
+        def ranked(heap):
+            items = [totals for _, _, totals in sorted(heap, key=lambda item: item[:2], reverse=True)]
+            for totals in items:
+                ratio = totals['weightedTokens'] / self.total_weighted * 100 if self.total_weighted > 0 else 0
+                totals['weightedRatio'] = round(ratio, 1)
+            return items
+
+        return {
+            'topK': self.top_k,
+            'activeProjects': self.active_projects,
+            'activeSessions': self.active_sessions,
+            'projects': ranked(self.projects),
+            'sessions': ranked(self.sessions)
+        }
+
+def is_countable_user_message(message):
+    """
+    ユーザーメッセージが実際の入力（テキストあり）かを判定
+
+    Args:
+        message: user イベントの message オブジェクト
+
+    Returns:
+        bool: カウント対象ならTrue
+    """
+    if not isinstance(message, dict):
+        # message がない形式のイベントはそのままカウント対象
+        return True
+
+    content = message.get('content', '')
+
+    # content が配列形式の場合の処理
+    if isinstance(content, list):
+        # 配列が空の場合は除外
+        if len(content) == 0:
+            return False
+        # 最初の要素が text オブジェクトかチェック
+        first_item = content[0]
+        if not isinstance(first_item, dict) or first_item.get('type') != 'text':
+            return False
+        # text の内容が空の場合は除外
+        text_content = first_item.get('text', '')
+        return isinstance(text_content, str) and len(text_content.strip()) > 0
+
+    # content が文字列形式の場合の処理
+    if isinstance(content, str):
+        return len(content.strip()) > 0
+
+    # その他の形式は除外
+    return False
+
+def is_countable_user_entry(entry):
+    """
+    ユーザーイベントが実際の入力（テキストあり）かを判定
+
+    サイドカー（compact_transcripts 参照）の行は message を持たず、判定結果を hasText に持つ。
+
+    Args:
+        entry: パース済みの user イベント
+
+    Returns:
+        bool: カウント対象ならTrue
+    """
+    if 'hasText' in entry and 'message' not in entry:
+        return entry['hasText'] is True
+    return is_countable_user_message(entry.get('message', {}))
+
+def parse_entry_timestamp(ts_str, stats=None):
+    """
+    イベントの ISO 8601 タイムスタンプ（末尾 Z 形式を含む）を解析
+
+    Args:
+        ts_str: タイムスタンプ文字列
+        stats: --profile 時の走査統計（指定時は解析時間を timestampSeconds に加算）
+
+    Returns:
+        datetime: タイムゾーン付きの日時
+    """
+    if stats is None:
+        return datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+
+    started = time.perf_counter()
+    try:
+        return datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+    finally:
+        stats['timestampSeconds'] += time.perf_counter() - started
+
+def event_dedupe_key(entry):
+    """
+    イベントの重複除去キーを作成
+
+    assistant 応答はストリーミング中に同じ message.id / requestId の行が複数書かれ、
+    再開したセッションには以前の履歴が同じ uuid のまま複製されるため、
+    assistant 応答は message.id と requestId、ユーザーメッセージは uuid をキーにする。
+
+    Args:
+        entry: パース済みのイベント
+
+    Returns:
+        int or None: 64 ビットの符号付き整数（識別子がなければ None = 重複判定しない）
+    """
+    if entry.get('type') == 'assistant':
+        message = entry.get('message')
+        message_id = message.get('id') if isinstance(message, dict) else None
+        request_id = entry.get('requestId')
+        if not (message_id or request_id):
+            return None
+        ident = f"a:{message_id or ''}:{request_id or ''}"
+    else:
+        msg_uuid = entry.get('uuid')
+        if not msg_uuid:
+            return None
+        ident = f"u:{msg_uuid}"
+
+    digest = blake2b(ident.encode('utf-8'), digest_size=DEDUPE_KEY_BYTES).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+def encode_dedupe_keys(keys):
+    """重複除去キーの array をチェックポイント保存用の base64 文字列にする"""
+    import binascii
+    return binascii.b2a_base64(keys.tobytes(), newline=False).decode('ascii')
+
+def decode_dedupe_keys(file_entry):
+    """
+    チェックポイントエントリから重複除去キーを読み込む
+
+    Args:
+        file_entry: チェックポイントエントリ（None 可）
+
+    Returns:
+        array.array: 重複除去キー
+    """
+    import binascii
+
+    keys = array.array(DEDUPE_KEY_TYPECODE)
+    if file_entry is not None and file_entry.get('keys'):
+        keys.frombytes(binascii.a2b_base64(file_entry['keys']))
+    return keys
+
+class DedupeKeySet:
+    """
+    全ファイルが採用済みの重複除去キーの集合（scan_transcripts が変更のあった実行でのみ作る）
+
+    キーはソート済みの array（1キー DEDUPE_KEY_BYTES バイト）に保持して二分探索で判定し、
+    走査中に追加・削除したキー（変更のあったファイルの分）だけを set に持つ。
+    Python の set に全キーを入れる場合と比べてメモリはおよそ 1/8 になる。
+    """
+
+    def __init__(self, key_arrays=()):
+        keys = array.array(DEDUPE_KEY_TYPECODE)
+        for key_array in key_arrays:
+            keys.extend(key_array)
+        numpy = load_numpy()
+        if numpy is not None and keys:
+            keys = array.array(DEDUPE_KEY_TYPECODE, numpy.sort(numpy.frombuffer(keys, dtype='i8')).tobytes())
+        else:
+            keys = array.array(DEDUPE_KEY_TYPECODE, sorted(keys))
+        self._sorted = keys
+        self._added = set()
+        self._removed = set()
+
+    def __contains__(self, key):
+        if key in self._added:
+            return True
+        if key in self._removed:
+            return False
+        index = bisect.bisect_left(self._sorted, key)
+        return index < len(self._sorted) and self._sorted[index] == key
+
+    def add_keys(self, keys):
+        self._removed.difference_update(keys)
+        self._added.update(keys)
+
+    def discard_keys(self, keys):
+        self._added.difference_update(keys)
+        self._removed.update(keys)
+
+class EventDedupe:
+    """
+    1ファイル分の走査で使う重複除去フィルター
+
+    seen は他のファイルで採用済みのキー（全ファイル共通、読み取りのみ）。
+    ファイルごとに採用したキーは互いに重ならないよう管理するため、このファイルを
+    先頭から集計し直す場合は、前回このファイルが採用したキー（excluded）を
+    seen に含まれていても未採用として扱う。
+    """
+
+    def __init__(self, seen=None, accepted=(), excluded=()):
+        self.seen = seen if seen is not None else frozenset()
+        self.excluded = frozenset(excluded)
+        self.keys = array.array(DEDUPE_KEY_TYPECODE, accepted)
+        self._accepted = set(self.keys)
+        self.skipped = 0
+
+    def accept(self, key):
+        """
+        キーを採用できるか判定（採用したキーは記録される）
+
+        Args:
+            key: event_dedupe_key の結果
+
+        Returns:
+            bool: 初出なら True、重複なら False
+        """
+        if key is None:
+            return True
+        if key in self._accepted or (key in self.seen and key not in self.excluded):
+            self.skipped += 1
+            return False
+        self._accepted.add(key)
+        self.keys.append(key)
+        return True
+
+def accumulate_entry(entry, aggregate, window_start, pending_messages, file_name, timing_stats=None,
+                     bucket_since=None, dedupe=None):
+    """
+    JSONL の1イベントを集計データに加算する
+
+    Args:
+        entry: パース済みのイベント
+        aggregate: 加算先の集計データ
+        window_start: ウィンドウ開始時刻（これより後のイベントのみ集計）
+        pending_messages: 応答待ちのユーザーメッセージ（uuid -> aggregate['messages'] の要素、更新される）
+        file_name: イベントを含むファイル名
+        timing_stats: --profile 時の走査統計（タイムスタンプの解析時間を加算）
+        bucket_since: この時刻以降の assistant 応答は時間バケットにも加算する（Noneなら加算しない）
+        dedupe: EventDedupe（指定時は採用済みのイベントを集計しない）
+    """
+    event_type = entry.get('type', '')
+
+    # アシスタント応答からモデル情報とトークン使用量を収集
+    if event_type == 'assistant':
+        message = entry.get('message', {})
+        if not isinstance(message, dict):
+            return
+
+        # 直前のユーザーメッセージのモデルを、それに対する応答のモデルで確定させる
+        model_name = message.get('model', '')
+        if model_name and pending_messages:
+            waiting = pending_messages.pop(entry.get('parentUuid'), None)
+            if waiting is not None:
+                waiting['model'] = model_name
+                waiting['weight'] = get_model_weight(model_name)
+
+        # トークン使用量を取得
+        usage = message.get('usage', {})
+        ts_str = entry.get('timestamp')
+
+        # 最終応答のみをカウント（usage が存在し、output_tokens > 0）
+        # stop_reasonがnullの場合もカウント（ストリーミング中のイベント対応）
+        if not (usage and ts_str and usage.get('output_tokens', 0) > 0):
+            return
+
+        ts = parse_entry_timestamp(ts_str, timing_stats)
+        in_window = ts > window_start
+        in_buckets = bucket_since is not None and ts >= bucket_since
+        if not (in_window or in_buckets):
+            return
+        # ストリーミング中の重複行・再開セッションに複製された応答は1回だけ数える
+        if dedupe is not None and not dedupe.accept(event_dedupe_key(entry)):
+            return
+
+        # 重み付けトークン数を計算
+        weighted = calculate_weighted_tokens(usage, model_name)
+        model_key = get_model_key_from_name(model_name)
+
+        # rolling ウィンドウ用の時間バケット（ウィンドウ開始前の応答も含む）
+        if in_buckets:
+            add_usage_bucket(aggregate['buckets'], ts, model_key, usage, weighted['total_weighted'])
+        if not in_window:
+            return
+
+        # 生トークン数を集計
+        aggregate['raw']['input'] += usage.get('input_tokens', 0)
+        aggregate['raw']['output'] += usage.get('output_tokens', 0)
+        aggregate['raw']['cache_creation'] += usage.get('cache_creation_input_tokens', 0)
+        aggregate['raw']['cache_read'] += usage.get('cache_read_input_tokens', 0)
+
+        # 重み付けトークン数を集計
+        aggregate['weighted']['input'] += weighted['weighted_input']
+        aggregate['weighted']['output'] += weighted['weighted_output']
+        aggregate['weighted']['total'] += weighted['total_weighted']
+
+        # モデル別の集計（汎用関数を使用）
+        if model_key not in aggregate['by_model']:
+            aggregate['by_model'][model_key] = {
+                'requests': 0,
+                'inputTokens': 0,
+                'outputTokens': 0,
+                'rawTokens': 0,
+                'weightedTokens': 0
+            }
+
+        model_data = aggregate['by_model'][model_key]
+        model_data['requests'] += 1
+        model_data['inputTokens'] += weighted['raw_input']
+        model_data['outputTokens'] += weighted['raw_output']
+        model_data['rawTokens'] += weighted['raw_input'] + weighted['raw_output']
+        model_data['weightedTokens'] += weighted['total_weighted']
+
+    # ユーザーメッセージ送信イベントを処理
+    elif event_type in ['UserPromptSubmit', 'user_prompt', 'user']:
+        # サイドチェーン（サブエージェント）のメッセージを除外
+        if entry.get('isSidechain', False):
+            return
+
+        # 実際のユーザーメッセージのみをカウント
+        if not is_countable_user_entry(entry):
+            return
+
+        # タイムスタンプの解析
+        ts_str = entry.get('timestamp')
+        msg_uuid = entry.get('uuid')
+        if not ts_str:
+            return
+
+        # ISO 8601形式をパース
+        ts = parse_entry_timestamp(ts_str, timing_stats)
+        if ts > window_start:
+            if dedupe is not None and not dedupe.accept(event_dedupe_key(entry)):
+                return
+
+            # モデルは応答（parentUuid がこのメッセージの assistant 行）を読んだ時点で確定する
+            message_data = {
+                'timestamp': ts.isoformat(),
+                'file': file_name,
+                'model': '',
+                'weight': get_model_weight('')
+            }
+            aggregate['messages'].append(message_data)
+            if msg_uuid:
+                pending_messages[msg_uuid] = message_data
+
+@contextmanager
+def map_transcript(f):
+    """
+    開いているトランスクリプトを読み取り専用で mmap する
+
+    行の判定（is_relevant_line）は mmap 上で直接行い、json.loads に渡す行のみを
+    スライスでコピーするため、巨大なツール実行結果の行も Python のオブジェクトにならない。
+    空ファイルや mmap できない環境ではファイル全体を bytes として読み込む。
+
+    Args:
+        f: バイナリモードで開いたファイル
+
+    Yields:
+        mmap.mmap or bytes: ファイルの内容
+    """
+    import mmap
+
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # 空ファイルは mmap できない
+        buf = None
+
+    if buf is None:
+        f.seek(0)
+        yield f.read()
+        return
+
+    try:
+        yield buf
+    finally:
+        buf.close()
+
+def release_pages(buf, start, end):
+    """
+    mmap の [start, end) のページを常駐メモリから外す（bytes や madvise のない環境では何もしない）
+
+    読み取り専用のファイルマッピングのため内容は変わらず、再度参照すればページキャッシュから読み直される。
+    """
+    import mmap
+
+    if not (hasattr(buf, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')):
+        return
+    start -= start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if end > start:
+        buf.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def iter_line_spans(buf, offset):
+    """
+    バッファの指定位置から改行で終わる行の範囲を順に返す
+
+    改行で終わっていない末尾の行（書き込み途中）は返さず、
+    次回の実行で改めて読み込む。改行は MMAP_RELEASE_BYTES ずつ探し、走査済みの
+    ページは同じ間隔で解放するため、ファイルや行が大きくても常駐メモリは増え続けない。
+
+    Args:
+        buf: map_transcript のバッファ
+        offset: 読み込み開始位置（バイト）
+
+    Yields:
+        tuple: (行の開始位置, その行の直後のバイト位置)
+    """
+    find = buf.find
+    size = len(buf)
+    released = offset
+
+    while offset < size:
+        search_from = offset
+        while True:
+            search_end = search_from + MMAP_RELEASE_BYTES
+            newline = find(b'\n', search_from, search_end)
+            if newline >= 0 or search_end >= size:
+                break
+            # 長い行は改行を探した部分から解放する（判定時に改めて分割して読む）
+            release_pages(buf, search_from, search_end)
+            search_from = search_end
+
+        if newline < 0:
+            # 書き込み途中の行は次回に持ち越す
+            return
+        yield offset, newline + 1
+        offset = newline + 1
+
+        if offset - released >= MMAP_RELEASE_BYTES:
+            release_pages(buf, released, offset)
+            released = offset
+
+def load_zstd():
+    """
+    zstd の展開を必要になった時点で読み込む
+
+    Python 3.14 以降の compression.zstd、なければ zstandard パッケージを使う。
+
+    Returns:
+        callable or None: バイナリファイルを受け取り、展開した内容を読めるファイルを返す関数
+                          （どちらも利用できない場合は None）
+    """
+    global _zstd_open
+
+    if _zstd_open is False:
+        try:
+            from compression import zstd
+            _zstd_open = zstd.ZstdFile
+        except ImportError:
+            try:
+                import zstandard
+            except ImportError:  # .jsonl.zst は集計対象にしない
+                _zstd_open = None
+            else:
+                def _zstd_open(f):
+                    import io
+
+                    reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                    return io.BufferedReader(reader)
+    return _zstd_open
+
+def open_archive(f, archive):
+    """
+    圧縮済みトランスクリプトを展開しながら読むファイルを開く
+
+    Args:
+        f: バイナリモードで開いたアーカイブ
+        archive: archive_format の形式
+
+    Returns:
+        file: 展開後の内容を行単位で読めるファイル
+    """
+    if archive == 'gzip':
+        import gzip
+
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    zstd_open = load_zstd()
+    if zstd_open is None:
+        raise OSError('zstd archives require Python 3.14+ or the zstandard package')
+    return zstd_open(f)
+
+def iter_transcript_lines(f, offset, archive=None):
+    """
+    開いているトランスクリプトの行を順に返す
+
+    非圧縮のファイルは mmap 上の行の範囲（iter_line_spans）を返す。圧縮済みのアーカイブは
+    展開しながら1行ずつ bytes として返し、書き込み途中にはならないため
+    改行で終わらない末尾の行も返す。アーカイブは途中から展開できないため常に先頭から読む。
+
+    Args:
+        f: バイナリモードで開いたファイル
+        offset: 読み込み開始位置（非圧縮のファイルのみ）
+        archive: archive_format の形式（非圧縮なら None）
+
+    Yields:
+        tuple: (バッファ, 行の開始位置, 行の終了位置, 処理済みのバイト位置)
+               バイト位置はアーカイブでは展開後の先頭からの位置
+    """
+    if archive is None:
+        with map_transcript(f) as buf:
+            for start, end in iter_line_spans(buf, offset):
+                yield buf, start, end, end
+        return
+
+    offset = 0
+    try:
+        with open_archive(f, archive) as stream:
+            for line in stream:
+                offset += len(line)
+                yield line, 0, len(line), offset
+    except (EOFError, zlib.error) as e:
+        # 途中で切れた・壊れたアーカイブは読み込みエラーとして扱う
+        raise OSError(f"Corrupt {archive} archive: {e}") from e
+
+class UsageProfile:
+    """
+    --profile 用のフェーズ別の所要時間とカウンター
+
+    フェーズはネストしてよい（walk・scan は collect の内訳）。ファイル単位の処理の内訳
+    （PROFILE_SCAN_TIMERS）はワーカープロセスでも計測できるよう走査統計側で持ち、
+    report() でまとめる。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self, scan_stats=None):
+        """
+        出力用の perf オブジェクトを作成
+
+        Args:
+            scan_stats: 走査統計（PROFILE_SCAN_TIMERS のキーは取り除かれる）
+
+        Returns:
+            dict: totalMs, phasesMs, scanPhasesMs, counters
+        """
+        scan_stats = scan_stats if scan_stats is not None else {}
+        scan_phases = {
+            key[:-len('Seconds')]: round(scan_stats.pop(key) * 1000, 3)
+            for key in PROFILE_SCAN_TIMERS if key in scan_stats
+        }
+        # タイムスタンプの解析は集計処理の中で行うため、集計時間からは除く
+        if 'aggregate' in scan_phases:
+            scan_phases['aggregate'] = round(scan_phases['aggregate'] - scan_phases.get('timestamp', 0), 3)
+
+        return {
+            'totalMs': round((time.perf_counter() - self.started) * 1000, 3),
+            'phasesMs': {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            'scanPhasesMs': scan_phases,
+            'counters': {**scan_stats, **self.counters}
+        }
+
+# 計測中の UsageProfile（--profile 指定時のみ。None なら計測しない）
+_profile = None
+
+def start_profile():
+    """計測を（やり直して）開始し、UsageProfile を返す"""
+    global _profile
+    _profile = UsageProfile()
+    return _profile
+
+def profile_phase(name):
+    """with 文でフェーズの所要時間を計測（計測しない場合は何もしない）"""
+    return _profile.phase(name) if _profile is not None else nullcontext()
+
+def profile_count(name, amount=1):
+    """カウンターを加算（計測しない場合は何もしない）"""
+    if _profile is not None:
+        _profile.count(name, amount)
+
+def new_scan_stats(profile=False):
+    """
+    走査統計（今回の実行で実際に読み込んだ分のカウンター）を作成
+
+    Args:
+        profile: True なら処理別の所要時間（PROFILE_SCAN_TIMERS）も計測する
+
+    Returns:
+        dict: カウンター
+    """
+    stats = {
+        'filesSeen': 0,
+        'filesSkippedMtime': 0,
+        'dirsPruned': 0,
+        'filesOpened': 0,
+        'bytesRead': 0,
+        'linesParsed': 0,
+        'linesSkipped': 0,
+        'eventsCounted': 0,
+        'duplicatesSkipped': 0,
+        'dedupeKeysReleased': 0,
+        'parseErrors': 0
+    }
+    if profile:
+        stats.update(dict.fromkeys(PROFILE_SCAN_TIMERS, 0.0))
+    return stats
+
+def merge_scan_stats(dst, src):
+    """走査統計 src を dst に加算する（dst を直接更新）"""
+    for key, value in src.items():
+        dst[key] = dst.get(key, 0) + value
+
+def is_relevant_line(line, start=0, end=None):
+    """
+    JSON をデコードせずに、集計対象になり得る行かをバイト列で判定
+
+    usage 付きの assistant 応答と、ツール実行結果以外の user イベントのみを対象とする。
+    文字列内の引用符はエスケープされているため、マーカーはトップレベル・ネストした
+    オブジェクトのキーにしか一致せず、判定は安全側（余分に True）に倒れる。
+
+    Args:
+        line: JSONL の1行（バイト列）、または行を含むバッファ（mmap）
+        start: バッファ内の行の開始位置
+        end: バッファ内の行の終了位置（Noneなら末尾）
+
+    Returns:
+        bool: json.loads する必要があればTrue
+    """
+    if end is None:
+        end = len(line)
+    if end - start > MMAP_RELEASE_BYTES and hasattr(line, 'madvise'):
+        return _is_relevant_long_line(line, start, end)
+
+    if ASSISTANT_LINE_PATTERN.search(line, start, end) is not None and line.find(USAGE_MARKER, start, end) >= 0:
+        return True
+
+    if USER_LINE_PATTERN.search(line, start, end) is None:
+        return False
+
+    # テキストを含まないツール実行結果はカウント対象にならない
+    return (TOOL_RESULT_PATTERN.search(line, start, end) is None
+            or TEXT_ITEM_PATTERN.search(line, start, end) is not None)
+
+def _is_relevant_long_line(buf, start, end):
+    """
+    is_relevant_line の長い行（mmap）用の判定
+
+    各マーカーを MMAP_RELEASE_BYTES ずつ探し、探し終えた部分のページを解放するため、
+    巨大なツール実行結果の行でも常駐メモリは行の長さに比例しない。
+
+    Returns:
+        bool: json.loads する必要があればTrue
+    """
+    patterns = (ASSISTANT_LINE_PATTERN, USAGE_MARKER_PATTERN, USER_LINE_PATTERN,
+                TOOL_RESULT_PATTERN, TEXT_ITEM_PATTERN)
+    found = [False] * len(patterns)
+    pos = start
+
+    while pos < end:
+        chunk_end = min(end, pos + MMAP_RELEASE_BYTES)
+        # 分割位置をまたぐマーカーも見つかるよう、前の部分の末尾と重ねて探す
+        search_start = max(start, pos - MARKER_OVERLAP)
+        for i, pattern in enumerate(patterns):
+            if not found[i] and pattern.search(buf, search_start, chunk_end) is not None:
+                found[i] = True
+        release_pages(buf, pos, chunk_end)
+        pos = chunk_end
+
+    assistant, usage, user, tool_result, text = found
+    if assistant and usage:
+        return True
+    # テキストを含まないツール実行結果はカウント対象にならない
+    return user and (not tool_result or text)
+
+def read_transcript(f, offset, window_start, file_name, stats=None, bucket_since=None, dedupe=None,
+                    pending_messages=None, archive=None):
+    """
+    開いているトランスクリプトを指定バイト位置から読み込んで集計
+
+    ユーザーメッセージのモデルは、応答待ちのメッセージをファイル単位で保持し、
+    対応する assistant 応答を読んだ時点で確定させる（確定したものは保持しない）。
+    ファイルごとの集計結果は読み込み順や並列実行に依存しない。
+
+    Args:
+        f: バイナリモードで開いたファイル
+        offset: 読み込み開始位置（バイト）
+        window_start: ウィンドウ開始時刻
+        file_name: ファイル名
+        stats: 走査統計（指定時は読み込んだ行数を加算）
+        bucket_since: 時間バケットに加算する下限時刻（accumulate_entry 参照）
+        dedupe: EventDedupe（指定時は重複したイベントを集計しない）
+        pending_messages: 前回までの応答待ちのユーザーメッセージ（uuid -> メッセージ、更新される）
+        archive: 圧縮済みのアーカイブの形式（iter_transcript_lines 参照）
+
+    Returns:
+        tuple: (集計データ, 処理済みのバイト位置)
+    """
+    if stats is None:
+        stats = new_scan_stats()
+    aggregate = new_usage_aggregate()
+    if pending_messages is None:
+        pending_messages = {}
+    start_offset = offset
+
+    lines = iter_transcript_lines(f, offset, archive)
+
+    if PROFILE_SCAN_TIMERS[0] in stats:
+        offset = _read_transcript_profiled(
+            lines, offset, window_start, file_name, stats, aggregate, pending_messages, bucket_since, dedupe
+        )
+    else:
+        for buf, start, end, offset in lines:
+            # 集計に関係しない行（ツール実行結果・スナップショット等）はコピーもデコードもしない
+            if not is_relevant_line(buf, start, end):
+                stats['linesSkipped'] += 1
+                continue
+            stats['linesParsed'] += 1
+
+            try:
+                entry = json.loads(buf[start:end])
+                if isinstance(entry, dict):
+                    accumulate_entry(entry, aggregate, window_start, pending_messages, file_name,
+                                     bucket_since=bucket_since, dedupe=dedupe)
+            except (json.JSONDecodeError, ValueError, KeyError):
+                # JSONパースエラーや予期されるキーエラーは数えて無視
+                stats['parseErrors'] += 1
+                continue
+
+    stats['bytesRead'] += offset - start_offset
+    stats['eventsCounted'] += len(aggregate['messages']) + sum(
+        model_data['requests'] for model_data in aggregate['by_model'].values()
+    )
+    if dedupe is not None:
+        stats['duplicatesSkipped'] += dedupe.skipped
+        dedupe.skipped = 0
+    return aggregate, offset
+
+def _read_transcript_profiled(lines, offset, window_start, file_name, stats, aggregate, pending_messages,
+                              bucket_since=None, dedupe=None):
+    """
+    read_transcript の --profile 用ループ（行ごとに読み込み・判定・デコード・集計の時間を計る）
+
+    Args:
+        lines: iter_transcript_lines のイテレータ
+
+    Returns:
+        int: 処理済みのバイト位置
+    """
+    perf_counter = time.perf_counter
+
+    while True:
+        started = perf_counter()
+        item = next(lines, None)
+        read_done = perf_counter()
+        stats['readSeconds'] += read_done - started
+        if item is None:
+            return offset
+        buf, start, end, offset = item
+
+        relevant = is_relevant_line(buf, start, end)
+        filtered = perf_counter()
+        stats['filterSeconds'] += filtered - read_done
+        if not relevant:
+            stats['linesSkipped'] += 1
+            continue
+        stats['linesParsed'] += 1
+
+        try:
+            entry = json.loads(buf[start:end])
+        except ValueError:
+            stats['parseErrors'] += 1
+            continue
+        finally:
+            parsed = perf_counter()
+            stats['jsonParseSeconds'] += parsed - filtered
+
+        try:
+            if isinstance(entry, dict):
+                accumulate_entry(entry, aggregate, window_start, pending_messages, file_name, stats, bucket_since,
+                                 dedupe)
+        except (ValueError, KeyError):
+            stats['parseErrors'] += 1
+        finally:
+            stats['aggregateSeconds'] += perf_counter() - parsed
+
+def _read_tail_crc(f, offset):
+    """処理済み位置の直前 CHECKPOINT_TAIL_BYTES バイトの CRC32 を計算"""
+    start = max(0, offset - CHECKPOINT_TAIL_BYTES)
+    f.seek(start)
+    return zlib.crc32(f.read(offset - start))
+
+def can_resume_from(f, st, inode, offset, tail_crc):
+    """
+    前回の処理済み位置から読み込みを再開できるか判定
+
+    inode の変化（ローテーション・再利用）、サイズの縮小（切り詰め）、
+    処理済み末尾のバイト列の変化（書き換え）を検出した場合は False を返す。
+
+    Args:
+        f: バイナリモードで開いたファイル
+        st: ファイルの stat 結果
+        inode: 前回記録した inode
+        offset: 前回の処理済み位置
+        tail_crc: 前回記録した末尾バイト列の CRC32
+
+    Returns:
+        bool: 再開できるならTrue
+    """
+    return (inode == st.st_ino
+            and 0 < offset <= st.st_size
+            and _read_tail_crc(f, offset) == tail_crc)
+
+def is_checkpoint_current(previous, st):
+    """チェックポイント記録後にファイルが変更されていないか判定"""
+    return (previous is not None
+            and previous.get('inode') == st.st_ino
+            and previous.get('size') == st.st_size
+            and previous.get('mtime') == st.st_mtime_ns)
+
+def scan_transcript_incremental(jsonl_file, st, previous, window_start, stats=None, bucket_since=None,
+                                seen=None):
+    """
+    チェックポイントを使ってトランスクリプトの追記分のみを集計
+
+    続きから読み込めない場合（can_resume_from 参照）は、
+    このファイルのみ先頭から再集計する。
+    集計したイベントの重複除去キーはエントリの keys に、応答待ちのユーザーメッセージは
+    pending（uuid -> messages のインデックス）に保存し、次回以降の追記分に引き継ぐ。
+    圧縮済みのアーカイブは追記されない前提で、変更された場合は先頭から再集計する。
+
+    Args:
+        jsonl_file: トランスクリプトのパス
+        st: jsonl_file の stat 結果
+        previous: 前回のチェックポイントエントリ（なければNone）
+        window_start: ウィンドウ開始時刻
+        stats: 走査統計（指定時は読み込んだ行数を加算）
+        bucket_since: 時間バケットに加算する下限時刻（accumulate_entry 参照）
+        seen: 他のファイルで採用済みの重複除去キー（EventDedupe 参照）
+
+    Returns:
+        dict: 新しいチェックポイントエントリ
+    """
+    # 変更がなければファイルを開かずに前回の集計値を再利用
+    if is_checkpoint_current(previous, st):
+        return previous
+
+    archive = archive_format(jsonl_file)
+    with open(jsonl_file, 'rb') as f:
+        if stats is not None:
+            stats['filesOpened'] += 1
+        offset = 0
+        aggregate = new_usage_aggregate()
+        previous_keys = decode_dedupe_keys(previous)
+        dedupe = EventDedupe(seen, excluded=previous_keys)
+        pending = {}
+
+        if previous is not None and archive is None and can_resume_from(
+                f, st, previous.get('inode'), previous.get('offset', 0), previous.get('tailCrc')):
+            # 前回の続きから読み込む
+            offset = previous['offset']
+            aggregate = previous['aggregate']
+            dedupe = EventDedupe(seen, accepted=previous_keys, excluded=previous_keys)
+            messages = aggregate['messages']
+            pending = {
+                msg_uuid: messages[index]
+                for msg_uuid, index in previous.get('pending', {}).items() if index < len(messages)
+            }
+
+        delta, offset = read_transcript(f, offset, window_start, transcript_source(jsonl_file).name, stats,
+                                        bucket_since, dedupe, pending, archive)
+        merge_usage_aggregate(aggregate, delta)
+
+        if pending:
+            index_of = {id(message): index for index, message in enumerate(aggregate['messages'])}
+            pending = {msg_uuid: index_of[id(message)] for msg_uuid, message in pending.items()}
+
+        return {
+            'inode': st.st_ino,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'offset': offset,
+            'tailCrc': _read_tail_crc(f, offset) if archive is None else None,
+            'aggregate': aggregate,
+            'keys': encode_dedupe_keys(dedupe.keys),
+            'pending': pending
+        }
+
+def load_checkpoint(window_start, bucket_hours=0):
+    """
+    増分スキャン用のチェックポイントを読み込む
+
+    ファイルごとの集計値はウィンドウ開始時刻と時間バケットの保持期間に依存するため、
+    どちらかが前回と異なる場合は空のチェックポイントを返す。
+
+    Args:
+        window_start: 現在のウィンドウ開始時刻
+        bucket_hours: 時間バケットを保持する時間（get_bucket_hours 参照）
+
+    Returns:
+        dict: ファイルパス -> チェックポイントエントリ
+    """
+    if not CHECKPOINT_FILE.exists():
+        return {}
+
+    try:
+        with open(CHECKPOINT_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Warning: Failed to read checkpoint: {e}", file=sys.stderr)
+        return {}
+
+    if (not isinstance(data, dict)
+            or data.get('version') != CHECKPOINT_VERSION
+            or data.get('windowStart') != window_start.isoformat()
+            or data.get('bucketHours', 0) != bucket_hours):
+        return {}
+
+    return data.get('files', {})
+
+def save_checkpoint(window_start, files, bucket_hours=0):
+    """
+    増分スキャン用のチェックポイントを保存
+
+    Args:
+        window_start: 集計に使用したウィンドウ開始時刻
+        files: ファイルパス -> チェックポイントエントリ
+        bucket_hours: 時間バケットを保持する時間
+    """
+    data = {
+        'version': CHECKPOINT_VERSION,
+        'windowStart': window_start.isoformat(),
+        'bucketHours': bucket_hours,
+        'files': files
+    }
+
+    try:
+        write_json_atomic(CHECKPOINT_FILE, data)
+    except OSError as e:
+        print(f"Warning: Failed to save checkpoint: {e}", file=sys.stderr)
+
+# 走査中のファイル以外で採用済みの重複除去キー（scan_transcripts が設定し、ワーカーには初期化時に渡す）
+_scan_seen_keys = None
+
+def _set_scan_seen_keys(seen):
+    """プロセスプールのワーカー初期化（採用済みの重複除去キーを受け取る）"""
+    global _scan_seen_keys
+    _scan_seen_keys = seen
+
+def _scan_candidate(task):
+    """
+    1ファイル分の増分スキャン（プロセスプールのワーカーからも呼ばれる）
+
+    Args:
+        task: (パス, stat結果, 前回のチェックポイントエントリ, ウィンドウ開始時刻, 処理別の時間を計測するか,
+               時間バケットに加算する下限時刻)
+
+    Returns:
+        tuple: (新しいチェックポイントエントリ, 走査統計, 警告メッセージ)
+            - エラー時はチェックポイントエントリが None
+    """
+    jsonl_file, st, previous, window_start, profile, bucket_since = task
+    stats = new_scan_stats(profile)
+    try:
+        entry = scan_transcript_incremental(jsonl_file, st, previous, window_start, stats, bucket_since,
+                                            _scan_seen_keys)
+        return entry, stats, None
+    except OSError as e:
+        # ファイル読み込みエラー
+        return None, stats, f"Warning: Failed to read file {jsonl_file}: {e}"
+    except Exception as e:
+        # その他の予期しないエラー
+        return None, stats, f"Error processing file {jsonl_file}: {e}"
+
+def scan_transcripts(tasks, workers=1):
+    """
+    候補ファイルを増分スキャンする（workers > 1 ならプロセスプールで並列実行）
+
+    大きいファイルから順にワーカーへ割り当てるが、結果は常に tasks の順序で返す。
+    重複除去キーは tasks の順に確定させる。直列実行ではそれまでのファイルが採用した
+    キーを見ながら走査し、並列実行では同じ実行の中で先のファイルが採用したキーと
+    重なったファイルのみを親プロセスで走査し直すため、集計結果は直列実行と一致する。
+
+    Args:
+        tasks: _scan_candidate に渡すタスクのリスト
+        workers: ワーカープロセス数
+
+    Returns:
+        list: タスクごとの _scan_candidate の結果
+    """
+    global _scan_seen_keys
+    results = [None] * len(tasks)
+    pending = []
+
+    for i, task in enumerate(tasks):
+        # 変更のないファイルはプロセス間通信のコストをかけずに再利用
+        if is_checkpoint_current(task[2], task[1]):
+            results[i] = (task[2], new_scan_stats(), None)
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    # 全ファイルが前回までに採用した重複除去キー（ファイル間で重ならない）
+    seen = DedupeKeySet(decode_dedupe_keys(task[2]) for task in tasks)
+
+    if workers > 1 and len(pending) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+
+        pending.sort(key=lambda i: tasks[i][1].st_size, reverse=True)
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)),
+                                     initializer=_set_scan_seen_keys, initargs=(seen,)) as executor:
+                futures = [(i, executor.submit(_scan_candidate, tasks[i])) for i in pending]
+                for i, future in futures:
+                    results[i] = future.result()
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            # プロセスプールが使えない環境では直列実行にフォールバック
+            print(f"Warning: Parallel scan unavailable, falling back to serial: {e}", file=sys.stderr)
+
+    # tasks の順に重複除去キーを確定させる
+    _scan_seen_keys = seen
+    claimed = set()
+    try:
+        for i in sorted(pending):
+            if results[i] is None:
+                results[i] = _scan_candidate(tasks[i])
+            elif results[i][0] is not None and not claimed.isdisjoint(decode_dedupe_keys(results[i][0])):
+                # 並列実行中に先のファイルが同じイベントを採用していた
+                entry, stats, warning = _scan_candidate(tasks[i])
+                merge_scan_stats(stats, results[i][1])
+                results[i] = (entry, stats, warning)
+
+            if results[i][0] is not None:
+                previous_keys = set(decode_dedupe_keys(tasks[i][2]))
+                keys = set(decode_dedupe_keys(results[i][0]))
+                released = previous_keys - keys
+                seen.discard_keys(released)
+                seen.add_keys(keys - previous_keys)
+                claimed.update(keys)
+                # 書き換えで消えたイベント（他のファイルでは重複として数えていない可能性がある）
+                results[i][1]['dedupeKeysReleased'] += len(released)
+    finally:
+        _scan_seen_keys = None
+
+    return results
+
+def dedupe_keys_released(checkpoint, next_checkpoint, stats):
+    """
+    前回のチェックポイントで採用した重複除去キーが、今回の走査で失われたか判定
+
+    ファイルが書き換えられて短くなった場合は scan_transcripts が数えた
+    stats['dedupeKeysReleased']、削除・リネームされた場合はチェックポイントにあって
+    ファイルがなくなったことで判定する（キーはデコードしない）。
+    更新日時がウィンドウより古くなって走査対象から外れたファイルは対象外
+    （同じイベントの複製もウィンドウ外のため集計に影響しない）。
+
+    Args:
+        checkpoint: 前回のチェックポイント（ファイルパス -> エントリ）
+        next_checkpoint: 今回の走査結果
+        stats: 今回の走査統計
+
+    Returns:
+        bool: 失われたキーがあればTrue
+    """
+    if stats['dedupeKeysReleased']:
+        return True
+    return any(
+        previous.get('keys') and file_key not in next_checkpoint and not os.path.exists(file_key)
+        for file_key, previous in checkpoint.items()
+    )
+
+def scan_usage(log_dir, window_start, workers=1, bucket_hours=0):
+    """
+    ログディレクトリを走査してウィンドウ内の使用量を集計
+
+    bucket_hours を指定した場合、同じ走査で直近 bucket_hours 時間の assistant 応答を
+    時間バケット（rolling ウィンドウ用）にも集計する。
+
+    Args:
+        log_dir: Claude Code のログディレクトリパス
+        window_start: ウィンドウ開始時刻
+        workers: 並列スキャンのワーカープロセス数（1なら直列）
+        bucket_hours: 時間バケットを保持する時間（0 なら集計しない）
+
+    Returns:
+        dict: 集計データ（new_usage_aggregate 形式、'scan' に今回の走査統計、
+              'breakdown' にプロジェクト・セッション別の上位（UsageBreakdown.report）を含む）
+    """
+    # トークン使用量情報を保存
+    token_usage_data = new_usage_aggregate()
+    breakdown = UsageBreakdown(log_dir)
+
+    # 前回実行時のチェックポイント（ウィンドウが変わっていれば空）
+    with profile_phase('checkpointLoad'):
+        checkpoint = load_checkpoint(window_start, bucket_hours)
+    next_checkpoint = {}
+    profile = _profile is not None
+    scan_stats = new_scan_stats(profile)
+
+    since, bucket_since = get_scan_since(window_start, bucket_hours)
+
+    # 全プロジェクトのログファイルを1回で走査（パフォーマンス改善）
+    # ファイルの最終更新日時がウィンドウ内のもののみ（高速化）
+    with profile_phase('walk'):
+        candidates = list(iter_transcripts(log_dir, since=since, stats=scan_stats))
+
+    # 前回からの追記分のみを読み込んで集計（ファイル順に合算）
+    with profile_phase('scan'):
+        while True:
+            tasks = [
+                (jsonl_file, st, checkpoint.get(str(transcript_source(jsonl_file))), window_start, profile,
+                 bucket_since)
+                for jsonl_file, st in candidates
+            ]
+            pass_stats = new_scan_stats(profile)
+            for task, (file_entry, stats, warning) in zip(tasks, scan_transcripts(tasks, workers)):
+                merge_scan_stats(pass_stats, stats)
+                if warning is not None:
+                    print(warning, file=sys.stderr)
+                    continue
+                file_key = str(transcript_source(task[0]))
+                next_checkpoint[file_key] = file_entry
+                merge_usage_aggregate(token_usage_data, file_entry['aggregate'])
+                # ファイルごとの集計値はチェックポイントにあるため、プロジェクト・セッション別も追加の走査なしで求まる
+                breakdown.add_aggregate(file_key, file_entry['aggregate'])
+
+            merge_scan_stats(scan_stats, pass_stats)
+
+            # 採用済みのイベントが消えた場合、他のファイルで重複として除外した同じイベントは
+            # どのファイルにも数えられていないため、チェックポイントを使わずに走査し直す
+            if not checkpoint or not dedupe_keys_released(checkpoint, next_checkpoint, pass_stats):
+                break
+            checkpoint = {}
+            next_checkpoint = {}
+            token_usage_data = new_usage_aggregate()
+            breakdown = UsageBreakdown(log_dir)
+
+    # 次回実行用にチェックポイントを保存（ウィンドウ外になったファイルは破棄）
+    # 変更のないファイルは前回のエントリをそのまま再利用しているため、全て同一なら書き込みを省略
+    unchanged = (
+        len(next_checkpoint) == len(checkpoint)
+        and all(checkpoint.get(path) is entry for path, entry in next_checkpoint.items())
+    )
+    if not unchanged:
+        with profile_phase('checkpointSave'):
+            save_checkpoint(window_start, next_checkpoint, bucket_hours)
+
+    token_usage_data['scan'] = scan_stats
+    token_usage_data['breakdown'] = breakdown.report()
+    return token_usage_data
+
+def compact_entry(entry):
+    """
+    イベントから集計（calculate_message_usage・イベントストア・列指向ストア）に使うフィールドだけを取り出す
+
+    assistant 応答は usage とモデル・重複除去に使う ID を、ユーザーメッセージは本文の代わりに
+    実際の入力かどうか（hasText、is_countable_user_entry 参照）を残す。
+
+    Args:
+        entry: パース済みのイベント
+
+    Returns:
+        dict or None: サイドカーに書くイベント（集計に関係しなければ None）
+    """
+    event_type = entry.get('type', '')
+    compact = {
+        key: entry[key]
+        for key in ('type', 'timestamp', 'uuid', 'parentUuid', 'sessionId', 'requestId')
+        if entry.get(key) is not None
+    }
+    if entry.get('isSidechain', False):
+        compact['isSidechain'] = True
+
+    if event_type == 'assistant':
+        message = entry.get('message')
+        if not isinstance(message, dict) or 'usage' not in message:
+            return None
+        compact['message'] = {
+            key: message[key] for key in ('id', 'model') if message.get(key) is not None
+        }
+        usage = message['usage']
+        # トークン数以外（service_tier やツール利用の内訳など）は集計に使わない
+        compact['message']['usage'] = {
+            key: value for key, value in usage.items() if isinstance(value, (int, float))
+        } if isinstance(usage, dict) else usage
+    elif event_type in ['UserPromptSubmit', 'user_prompt', 'user']:
+        compact['hasText'] = is_countable_user_entry(entry)
+    else:
+        return None
+    return compact
+
+def compact_transcripts(log_dir, now=None, min_idle=COMPACT_MIN_IDLE):
+    """
+    終了したセッションのトランスクリプトごとに、集計に使うフィールドだけのサイドカーを作る
+
+    サイドカーは <トランスクリプト名>.usage（JSONL）で、更新日時を元のファイルと揃える。
+    iter_transcripts は元のファイルより新しくないサイドカーを無視するため、
+    作成後に追記されたセッションは元のファイルから集計され、次回の --compact で作り直される。
+
+    Args:
+        log_dir: Claude Code のログディレクトリパス
+        now: 現在時刻（Noneなら現在のUTC時刻）
+        min_idle: この期間更新のないトランスクリプトのみを対象にする
+
+    Returns:
+        dict: 作成・スキップしたファイル数と、元のファイル・サイドカーの合計サイズ
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    idle_before = (now - min_idle).timestamp()
+    summary = {'compacted': 0, 'upToDate': 0, 'active': 0, 'errors': 0, 'sourceBytes': 0, 'sidecarBytes': 0}
+
+    for jsonl_file, st in iter_transcripts(log_dir, prefer_sidecars=False):
+        if st.st_mtime >= idle_before:
+            summary['active'] += 1
+            continue
+
+        sidecar = jsonl_file.with_name(jsonl_file.name + COMPACT_SUFFIX)
+        try:
+            if sidecar.stat().st_mtime_ns >= st.st_mtime_ns:
+                summary['upToDate'] += 1
+                continue
+        except OSError:
+            pass
+
+        temp_path = sidecar.with_name(f'{sidecar.name}.{os.getpid()}.tmp')
+        try:
+            with open(jsonl_file, 'rb') as f, open(temp_path, 'w', encoding='utf-8') as out:
+                for buf, start, end, _ in iter_transcript_lines(f, 0, archive_format(jsonl_file)):
+                    if not is_relevant_line(buf, start, end):
+                        continue
+                    try:
+                        entry = json.loads(buf[start:end])
+                    except ValueError:
+                        continue
+                    compact = compact_entry(entry) if isinstance(entry, dict) else None
+                    if compact is not None:
+                        out.write(json.dumps(compact, separators=(',', ':')) + '\n')
+            # 元のファイルと同じ更新日時にしてから置き換える（mtime による除外も元のファイルと同じになる）
+            os.utime(temp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(temp_path, sidecar)
+        except OSError as e:
+            print(f"Warning: Failed to compact file {jsonl_file}: {e}", file=sys.stderr)
+            summary['errors'] += 1
+            try:
+                temp_path.unlink()
+            except OSError:
+                pass
+            continue
+
+        summary['compacted'] += 1
+        summary['sourceBytes'] += st.st_size
+        summary['sidecarBytes'] += sidecar.stat().st_size
+
+    return summary
+
+def open_event_store(db_path=None):
+    """
+    使用量イベントストア（SQLite）を開く
+
+    WAL モードで開くため、ステータスライン・キャリブレーション・
+    ad-hoc なレポートから同時に参照できる。
+
+    Args:
+        db_path: データベースファイルのパス（デフォルト: EVENT_STORE_FILE）
+
+    Returns:
+        sqlite3.Connection: 接続
+    """
+    import sqlite3
+
+    if db_path is None:
+        db_path = EVENT_STORE_FILE
+
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=EVENT_STORE_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(EVENT_STORE_SCHEMA)
+    if conn.execute('PRAGMA user_version').fetchone()[0] < EVENT_STORE_VERSION:
+        migrate_event_store(conn)
+    return conn
+
+def migrate_event_store(conn):
+    """
+    既存のイベントストアを現在のスキーマに移行
+
+    dedupe_key 列の追加前に取り込まれたイベントは重複を含むため、トランスクリプトが
+    残っているファイルの分は削除して次回の取り込みで読み直す（削除済みのファイルの分は
+    そのまま残す）。その上で、イベントから rollups テーブルを作り直す。
+
+    Args:
+        conn: sqlite3.Connection
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # 他プロセスが先に移行を終えていれば何もしない
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < EVENT_STORE_VERSION:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(events)')}
+            if 'dedupe_key' not in columns:
+                conn.execute('ALTER TABLE events ADD COLUMN dedupe_key INTEGER')
+            if version < 2:
+                for (path,) in conn.execute('SELECT path FROM files').fetchall():
+                    if os.path.exists(path):
+                        conn.execute('DELETE FROM events WHERE file = ?', (path,))
+                        conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            conn.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_events_dedupe ON events (dedupe_key) '
+                'WHERE dedupe_key IS NOT NULL'
+            )
+
+            conn.execute('DELETE FROM rollups')
+            for granularity, size in ROLLUP_GRANULARITIES:
+                conn.execute(
+                    f'INSERT INTO rollups (granularity, bucket, model_key, {", ".join(ROLLUP_COLUMNS)}) '
+                    'SELECT ?, ts / 1000000 / ? * ?, model_key, COUNT(*), SUM(input_tokens), SUM(output_tokens), '
+                    'SUM(cache_creation_tokens), SUM(cache_read_tokens), '
+                    'SUM(weighted_input), SUM(weighted_output), SUM(weighted_total) '
+                    "FROM events WHERE kind = 'assistant' GROUP BY 2, 3",
+                    (granularity, size, size)
+                )
+            conn.execute(f'PRAGMA user_version = {EVENT_STORE_VERSION}')
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+def update_rollups(conn, events, sign=1):
+    """
+    assistant イベントを分・時・日単位のロールアップに加算
+
+    Args:
+        conn: sqlite3.Connection
+        events: (ts_us, model_key, input, output, cache_creation, cache_read,
+                 weighted_input, weighted_output, weighted_total) の iterable
+        sign: 1 なら加算、-1 なら減算（ファイルの取り込み直し時）
+    """
+    totals = {}
+    for ts_us, model_key, *values in events:
+        seconds = ts_us // 1000000
+        for granularity, size in ROLLUP_GRANULARITIES:
+            key = (granularity, seconds - seconds % size, model_key)
+            current = totals.get(key)
+            if current is None:
+                totals[key] = [1, *values]
+            else:
+                current[0] += 1
+                for i, value in enumerate(values, 1):
+                    current[i] += value
+
+    if not totals:
+        return
+
+    conn.executemany(
+        f'INSERT INTO rollups (granularity, bucket, model_key, {", ".join(ROLLUP_COLUMNS)}) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (granularity, bucket, model_key) DO UPDATE SET '
+        + ', '.join(f'{column} = {column} + excluded.{column}' for column in ROLLUP_COLUMNS),
+        [(*key, *(value * sign for value in values)) for key, values in totals.items()]
+    )
+    if sign < 0:
+        conn.execute('DELETE FROM rollups WHERE requests <= 0')
+
+def extract_store_event(entry, file_key):
+    """
+    JSONL の1イベントからストアに保存する行を作成
+
+    集計対象（usage付きのassistant応答、実際のユーザーメッセージ）以外は None を返す。
+    最後の列は重複除去キー（event_dedupe_key）。
+
+    Args:
+        entry: パース済みのイベント
+        file_key: イベントを含むファイルのパス
+
+    Returns:
+        tuple or None: events テーブルの1行
+    """
+    event_type = entry.get('type', '')
+    ts_str = entry.get('timestamp')
+    if not ts_str:
+        return None
+
+    if event_type == 'assistant':
+        message = entry.get('message', {})
+        if not isinstance(message, dict):
+            return None
+
+        usage = message.get('usage', {})
+        if not (usage and usage.get('output_tokens', 0) > 0):
+            return None
+
+        model_name = message.get('model', '')
+        weighted = calculate_weighted_tokens(usage, model_name)
+        kind = 'assistant'
+        model_key = get_model_key_from_name(model_name)
+        tokens = (
+            usage.get('input_tokens', 0),
+            usage.get('output_tokens', 0),
+            usage.get('cache_creation_input_tokens', 0),
+            usage.get('cache_read_input_tokens', 0),
+            weighted['weighted_input'],
+            weighted['weighted_output'],
+            weighted['total_weighted']
+        )
+    elif event_type in ['UserPromptSubmit', 'user_prompt', 'user']:
+        if entry.get('isSidechain', False):
+            return None
+        if not is_countable_user_entry(entry):
+            return None
+
+        kind = 'user'
+        model_name = ''
+        model_key = 'unknown'
+        tokens = (0, 0, 0, 0, 0.0, 0.0, 0.0)
+    else:
+        return None
+
+    ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+    ts_us = int(ts.timestamp()) * 1000000 + ts.microsecond
+
+    return (
+        ts_us, kind, model_key, model_name,
+        entry.get('sessionId') or Path(file_key).stem, file_key,
+        *tokens,
+        entry.get('uuid'), entry.get('parentUuid'),
+        event_dedupe_key(entry)
+    )
+
+def ingest_usage_events(conn, log_dir, stats=None, since=None):
+    """
+    ログディレクトリのトランスクリプトから追記分のイベントをストアに取り込む
+
+    ファイルごとの読み込み位置は files テーブルで管理し、ローテーションや
+    切り詰めを検出した場合はそのファイルのイベントのみを削除して取り込み直す。
+    その結果どのファイルにも残らなかったイベント（他のファイルでは重複として
+    取り込まなかったもの）があれば、対象のファイルを先頭から読み直して複製を取り込む。
+    削除済みのトランスクリプトのイベントは履歴として残す。
+    dedupe_key が既に保存されているイベント（ストリーミング中の重複行や、
+    再開したセッションに複製された履歴）は取り込まない。
+
+    集計時は since にウィンドウの開始時刻を渡し、走査と同じく古いディレクトリを
+    stat しない。書き込みロックは変更のあったファイルがある場合のみ取得する。
+
+    Args:
+        conn: open_event_store() の接続
+        log_dir: Claude Code のログディレクトリパス
+        stats: 走査統計（指定時は読み込んだ行数を加算）
+        since: この時刻以降に更新されたファイルのみ取り込む（iter_transcripts 参照、Noneなら全て）
+
+    Returns:
+        int: 取り込んだイベント数
+    """
+    if stats is None:
+        stats = new_scan_stats()
+
+    def lookup(file_key):
+        return conn.execute(
+            'SELECT inode, size, mtime, offset, tail_crc FROM files WHERE path = ?', (file_key,)
+        ).fetchone()
+
+    def is_current(previous, st):
+        return previous is not None and tuple(previous[:3]) == (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    candidates = [
+        (jsonl_file, st) for jsonl_file, st in iter_transcripts(log_dir, since=since, stats=stats)
+        if not is_current(lookup(str(transcript_source(jsonl_file))), st)
+    ]
+    if not candidates:
+        return 0
+    inserted = 0
+    reread = False
+
+    # 同時に取り込みが走っても重複しないよう書き込みロックを取得してから読み込み位置を確認し直す
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        while True:
+            released = False
+            for jsonl_file, st in candidates:
+                file_key = str(transcript_source(jsonl_file))
+                try:
+                    previous = None if reread else lookup(file_key)
+                    if is_current(previous, st):
+                        continue
+
+                    rows = []
+                    removed_keys = []
+                    archive = archive_format(jsonl_file)
+                    with open(jsonl_file, 'rb') as f:
+                        stats['filesOpened'] += 1
+                        offset = 0
+                        if previous is not None:
+                            if archive is None and can_resume_from(f, st, previous[0], previous[3], previous[4]):
+                                offset = previous[3]
+                            else:
+                                update_rollups(conn, conn.execute(
+                                    'SELECT ts, model_key, input_tokens, output_tokens, cache_creation_tokens, '
+                                    'cache_read_tokens, weighted_input, weighted_output, weighted_total '
+                                    "FROM events WHERE file = ? AND kind = 'assistant'",
+                                    (file_key,)
+                                ).fetchall(), sign=-1)
+                                removed_keys = [row[0] for row in conn.execute(
+                                    'SELECT dedupe_key FROM events WHERE file = ? AND dedupe_key IS NOT NULL',
+                                    (file_key,)
+                                )]
+                                conn.execute('DELETE FROM events WHERE file = ?', (file_key,))
+
+                        start_offset = offset
+                        for buf, start, end, offset in iter_transcript_lines(f, offset, archive):
+                            if not is_relevant_line(buf, start, end):
+                                stats['linesSkipped'] += 1
+                                continue
+                            stats['linesParsed'] += 1
+                            try:
+                                entry = json.loads(buf[start:end])
+                                if isinstance(entry, dict):
+                                    row = extract_store_event(entry, file_key)
+                                    if row is not None:
+                                        rows.append(row)
+                            except (json.JSONDecodeError, ValueError, KeyError):
+                                stats['parseErrors'] += 1
+                                continue
+
+                        stats['bytesRead'] += offset - start_offset
+                        tail_crc = _read_tail_crc(f, offset) if archive is None else None
+
+                    # 重複して無視された行はロールアップにも加算しない
+                    parsed_rows = len(rows)
+                    rows = [
+                        row for row in rows
+                        if conn.execute(
+                            'INSERT OR IGNORE INTO events (ts, kind, model_key, model_name, session, file, '
+                            'input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens, '
+                            'weighted_input, weighted_output, weighted_total, uuid, parent_uuid, dedupe_key) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            row
+                        ).rowcount
+                    ]
+                    update_rollups(conn, (
+                        (row[0], row[2], *row[6:13]) for row in rows if row[1] == 'assistant'
+                    ))
+                    conn.execute(
+                        'INSERT OR REPLACE INTO files (path, inode, size, mtime, offset, tail_crc) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (file_key, st.st_ino, st.st_size, st.st_mtime_ns, offset, tail_crc)
+                    )
+                    inserted += len(rows)
+                    stats['eventsCounted'] += len(rows)
+                    stats['duplicatesSkipped'] += parsed_rows - len(rows)
+                    # 書き換えで消えたイベントは、他のファイルで重複として取り込まなかった可能性がある
+                    if removed_keys and not released:
+                        released = any(
+                            conn.execute('SELECT 1 FROM events WHERE dedupe_key = ?', (key,)).fetchone() is None
+                            for key in removed_keys
+                        )
+                except OSError as e:
+                    print(f"Warning: Failed to read file {jsonl_file}: {e}", file=sys.stderr)
+                    continue
+
+            if not released:
+                break
+            # 書き換えで消えたイベントの複製を他のファイルから取り込むため、対象のファイルを
+            # 先頭から読み直す（取り込み済みのイベントは dedupe_key で無視される）
+            candidates = list(iter_transcripts(log_dir, since=since, stats=stats))
+            reread = True
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+    return inserted
+
+def query_store_usage(log_dir, window_start, bucket_hours=0):
+    """
+    イベントストアに追記分を取り込んだ上で、ウィンドウ内の使用量を集計
+
+    Args:
+        log_dir: Claude Code のログディレクトリパス
+        window_start: ウィンドウ開始時刻
+        bucket_hours: 直近この時間の分単位ロールアップを時間バケットとして返す（0 なら返さない）
+
+    Returns:
+        dict: 集計データ（new_usage_aggregate 形式）
+    """
+    conn = open_event_store()
+    try:
+        scan_stats = new_scan_stats()
+        with profile_phase('ingest'):
+            ingest_usage_events(conn, log_dir, scan_stats, since=get_scan_since(window_start, bucket_hours)[0])
+
+        start_us = int(window_start.timestamp()) * 1000000 + window_start.microsecond
+        aggregate = new_usage_aggregate()
+
+        rows = conn.execute(
+            'SELECT model_key, COUNT(*), SUM(input_tokens), SUM(output_tokens), '
+            'SUM(cache_creation_tokens), SUM(cache_read_tokens), '
+            'SUM(weighted_input), SUM(weighted_output), SUM(weighted_total) '
+            "FROM events WHERE kind = 'assistant' AND ts > ? "
+            'GROUP BY model_key ORDER BY MIN(ts)',
+            (start_us,)
+        )
+        for model_key, requests, inp, out, cc, cr, w_in, w_out, w_total in rows:
+            aggregate['raw']['input'] += inp
+            aggregate['raw']['output'] += out
+            aggregate['raw']['cache_creation'] += cc
+            aggregate['raw']['cache_read'] += cr
+            aggregate['weighted']['input'] += w_in
+            aggregate['weighted']['output'] += w_out
+            aggregate['weighted']['total'] += w_total
+            aggregate['by_model'][model_key] = {
+                'requests': requests,
+                'inputTokens': inp + cc + cr,
+                'outputTokens': out,
+                'rawTokens': inp + cc + cr + out,
+                'weightedTokens': w_total
+            }
+
+        # ユーザーメッセージ（応答した assistant のモデルを結合）
+        rows = conn.execute(
+            'SELECT u.ts, u.file, '
+            "(SELECT a.model_name FROM events a WHERE a.kind = 'assistant' "
+            'AND a.parent_uuid = u.uuid LIMIT 1) '
+            "FROM events u WHERE u.kind = 'user' AND u.ts > ? ORDER BY u.ts",
+            (start_us,)
+        )
+        for ts_us, file_key, model_name in rows:
+            ts = datetime.fromtimestamp(ts_us // 1000000, timezone.utc).replace(microsecond=ts_us % 1000000)
+            model_name = model_name or ''
+            aggregate['messages'].append({
+                'timestamp': ts.isoformat(),
+                'file': Path(file_key).name,
+                'model': model_name,
+                'weight': get_model_weight(model_name)
+            })
+
+        # プロジェクト・セッション別（パス順に流して上位のみ保持）
+        breakdown = UsageBreakdown(log_dir)
+        rows = conn.execute(
+            "SELECT file, COALESCE(SUM(weighted_total), 0), "
+            'COALESCE(SUM(input_tokens + output_tokens + cache_creation_tokens + cache_read_tokens), 0), '
+            "SUM(kind = 'assistant'), SUM(kind = 'user') "
+            'FROM events WHERE ts > ? GROUP BY file ORDER BY file',
+            (start_us,)
+        )
+        for file_key, weighted, raw, requests, messages in rows:
+            breakdown.add(file_key, weighted, raw, requests, messages)
+        aggregate['breakdown'] = breakdown.report()
+
+        # rolling ウィンドウ用の時間バケット（分単位のロールアップがそのまま使える）
+        if bucket_hours:
+            since_s = int(time.time() - bucket_hours * 3600) // USAGE_BUCKET_SECONDS * USAGE_BUCKET_SECONDS
+            rows = conn.execute(
+                'SELECT bucket, model_key, requests, input_tokens, output_tokens, '
+                'cache_creation_tokens, cache_read_tokens, weighted_total '
+                "FROM rollups WHERE granularity = 'minute' AND bucket >= ?",
+                (since_s,)
+            )
+            for bucket, model_key, *values in rows:
+                aggregate['buckets'].setdefault(str(bucket), {})[model_key] = values
+
+        aggregate['scan'] = scan_stats
+        return aggregate
+    finally:
+        conn.close()
+
+def split_rollup_range(start_s, end_s, granularities=ROLLUP_GRANULARITIES):
+    """
+    時間範囲を、なるべく粗い粒度のロールアップバケットで覆う範囲に分解
+
+    例えば 09:30〜翌日 02:00 は「09:30〜10:00 の分」「10:00〜24:00 の時」
+    「00:00〜02:00 の時」に分解される。最も細かい粒度は分単位に切り捨てる。
+
+    Args:
+        start_s: 開始時刻（UTC エポック秒）
+        end_s: 終了時刻（UTC エポック秒、この時刻を含まない）
+        granularities: 使用する粒度（粗い順）
+
+    Returns:
+        list: (granularity, bucket_start, bucket_end) のリスト
+    """
+    if start_s >= end_s:
+        return []
+
+    (granularity, size), finer = granularities[0], granularities[1:]
+    if not finer:
+        return [(granularity, start_s - start_s % size, end_s)]
+
+    lo = -(-start_s // size) * size
+    hi = end_s - end_s % size
+    if lo >= hi:
+        return split_rollup_range(start_s, end_s, finer)
+    return (
+        split_rollup_range(start_s, lo, finer)
+        + [(granularity, lo, hi)]
+        + split_rollup_range(hi, end_s, finer)
+    )
+
+def query_rollups(conn, start, end):
+    """
+    ロールアップのみから期間内の使用量を集計（生のイベントは参照しない）
+
+    Args:
+        conn: sqlite3.Connection
+        start: 開始時刻（datetime）
+        end: 終了時刻（datetime、この時刻を含まない）
+
+    Returns:
+        dict: 集計データ（new_usage_aggregate 形式、messages は空）
+    """
+    aggregate = new_usage_aggregate()
+    sums = ', '.join(f'SUM({column})' for column in ROLLUP_COLUMNS)
+
+    for granularity, lo, hi in split_rollup_range(int(start.timestamp()), int(end.timestamp())):
+        rows = conn.execute(
+            f'SELECT model_key, {sums} FROM rollups '
+            'WHERE granularity = ? AND bucket >= ? AND bucket < ? GROUP BY model_key',
+            (granularity, lo, hi)
+        )
+        for model_key, requests, inp, out, cc, cr, w_in, w_out, w_total in rows:
+            aggregate['raw']['input'] += inp
+            aggregate['raw']['output'] += out
+            aggregate['raw']['cache_creation'] += cc
+            aggregate['raw']['cache_read'] += cr
+            aggregate['weighted']['input'] += w_in
+            aggregate['weighted']['output'] += w_out
+            aggregate['weighted']['total'] += w_total
+
+            model_data = aggregate['by_model'].setdefault(model_key, {
+                'requests': 0, 'inputTokens': 0, 'outputTokens': 0, 'rawTokens': 0, 'weightedTokens': 0
+            })
+            model_data['requests'] += requests
+            model_data['inputTokens'] += inp + cc + cr
+            model_data['outputTokens'] += out
+            model_data['rawTokens'] += inp + cc + cr + out
+            model_data['weightedTokens'] += w_total
+
+    return aggregate
+
+def load_numpy():
+    """
+    NumPy を必要になった時点で読み込む
+
+    Returns:
+        module or None: numpy（未インストールの場合は None）
+    """
+    global _numpy
+
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:  # 列指向ストアは array / bisect にフォールバック
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+@contextmanager
+def file_lock(lock_path):
+    """
+    アドバイザリロック（排他）を取得するコンテキストマネージャ
+
+    fcntl が使える環境は flock、Windows は msvcrt.locking を使用する。
+
+    Args:
+        lock_path: ロックファイルのパス
+    """
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        fcntl = None
+    try:
+        import msvcrt
+    except ImportError:  # macOS / Linux
+        msvcrt = None
+
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class ColumnarUsageStore:
+    """
+    固定長カラムファイルによる使用量イベントの列指向ストア
+
+    COLUMNAR_COLUMNS の各列を個別のファイルに追記し、NumPy があれば numpy.memmap で
+    開いてウィンドウ集計をベクトル演算で行う。行は ts の昇順に保つため、
+    ウィンドウの開始位置は ts 列の二分探索（searchsorted）で求まる。
+    列ファイルは追記のみで更新し、既存の末尾より古い行が届いた場合（並行セッションや
+    遅れて書かれた行）は、その行の ts 以降の重なる範囲だけを並べ直して書き直す。
+    ユーザー行のモデルが後から確定した場合は列を書き換えず、meta.json の
+    modelPatches（"ファイル ID:ts" -> モデル ID）に記録して集計時に適用する。
+    NumPy がない環境では array / bisect による同等の処理にフォールバックする。
+    重複したイベント（同じ key の行）は取り込み時には除かず、集計範囲の中で
+    最初の行のみを数える（複製は元のイベントと同じ ts を持つため同じ範囲に入る）。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = COLUMNAR_DIR if directory is None else directory
+        self.meta = self._load_meta()
+
+    def _column_path(self, name):
+        return self.directory / f'{name}.col'
+
+    def _load_meta(self):
+        meta_file = self.directory / 'meta.json'
+        empty = {'version': COLUMNAR_VERSION, 'count': 0, 'maxTs': 0, 'models': [], 'nextFileId': 0, 'files': {}}
+
+        if not meta_file.exists():
+            return empty
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Failed to read columnar metadata: {e}", file=sys.stderr)
+            return empty
+
+        if meta.get('version') != COLUMNAR_VERSION:
+            return empty
+        return meta
+
+    def _save_meta(self):
+        write_json_atomic(self.directory / 'meta.json', self.meta)
+
+    def _repair(self):
+        """中断した範囲の書き直しを完了し、メタデータ更新前に中断した追記分（count を超える部分）を切り捨てる"""
+        if 'merge' in self.meta:
+            self._finish_merge()
+        count = self.meta['count']
+        for name, typecode in COLUMNAR_COLUMNS:
+            path = self._column_path(name)
+            expected = count * array.array(typecode).itemsize
+            if not path.exists():
+                if count:
+                    # 列ファイルが欠けている場合は全体を作り直す
+                    self.meta = {**self.meta, 'count': 0, 'maxTs': 0, 'files': {}}
+                    return self._repair()
+                path.touch()
+            elif path.stat().st_size > expected:
+                with open(path, 'r+b') as f:
+                    f.truncate(expected)
+
+    def _read_all(self):
+        """全列を array として読み込む"""
+        columns = {}
+        for name, typecode in COLUMNAR_COLUMNS:
+            values = array.array(typecode)
+            with open(self._column_path(name), 'rb') as f:
+                values.fromfile(f, self.meta['count'])
+            columns[name] = values
+        return columns
+
+    def _write_all(self, columns):
+        """全列を書き直す（ts 順に並べ替えた結果や、ファイル単位の削除を反映）"""
+        for name, _ in COLUMNAR_COLUMNS:
+            path = self._column_path(name)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                columns[name].tofile(f)
+            os.replace(tmp_path, path)
+
+    def _append(self, rows):
+        for index, (name, typecode) in enumerate(COLUMNAR_COLUMNS):
+            with open(self._column_path(name), 'ab') as f:
+                array.array(typecode, (row[index] for row in rows)).tofile(f)
+
+    def _lower_bound(self, ts_us):
+        """ts 列で ts_us 以上になる最初の行（列全体は読まず、mmap 上で二分探索する）"""
+        import mmap
+
+        count = self.meta['count']
+        if count == 0:
+            return 0
+        with open(self._column_path('ts'), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            view = memoryview(buf).cast('q')
+            try:
+                return bisect.bisect_left(view, ts_us, 0, count)
+            finally:
+                view.release()
+
+    def _read_rows(self, start):
+        """start 行目以降の全列を行（リスト）として読み込む"""
+        columns = []
+        for name, typecode in COLUMNAR_COLUMNS:
+            values = array.array(typecode)
+            with open(self._column_path(name), 'rb') as f:
+                f.seek(start * values.itemsize)
+                values.fromfile(f, self.meta['count'] - start)
+            columns.append(values)
+        return [list(row) for row in zip(*columns)]
+
+    def _merge_suffix(self, new_rows):
+        """
+        既存の末尾より古い行を含む追記分を、重なる範囲（new_rows の最小の ts 以降）とだけ並べ直す
+
+        並べ直した範囲を <列>.merge に書き、meta.json に merge（書き直す開始行）を記録してから
+        列ファイルに反映する。途中で中断しても次回の _repair() が反映をやり直す。
+
+        Args:
+            new_rows: 追記する行（ts の昇順）
+        """
+        start = self._lower_bound(new_rows[0][0])
+        # 既存の行を先に置いた安定ソート（全体を並べ直した場合と同じ順序）
+        rows = self._read_rows(start) + new_rows
+        rows.sort(key=lambda row: row[0])
+        self._fold_model_patches(rows)
+
+        for index, (name, typecode) in enumerate(COLUMNAR_COLUMNS):
+            with open(self._column_path(name).with_suffix('.merge'), 'wb') as f:
+                array.array(typecode, (row[index] for row in rows)).tofile(f)
+        self.meta['count'] = start + len(rows)
+        self.meta['merge'] = start
+        self._save_meta()
+        self._finish_merge()
+
+    def _finish_merge(self):
+        """<列>.merge を列ファイルの merge 行目以降に反映する（何度実行しても同じ結果になる）"""
+        start = self.meta['merge']
+        for name, typecode in COLUMNAR_COLUMNS:
+            path = self._column_path(name)
+            merge_path = path.with_suffix('.merge')
+            if not merge_path.exists():
+                continue
+            with open(merge_path, 'rb') as src, open(path, 'r+b') as dst:
+                dst.truncate(start * array.array(typecode).itemsize)
+                dst.seek(0, os.SEEK_END)
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            merge_path.unlink()
+        del self.meta['merge']
+        self._save_meta()
+
+    def _fold_model_patches(self, rows):
+        """書き直す行に modelPatches を反映し、反映した分を表から除く"""
+        patches = self.meta.get('modelPatches')
+        if not patches:
+            return
+        for row in rows:
+            if row[1] == COLUMNAR_KIND_USER:
+                model_id = patches.pop(f'{row[3]}:{row[0]}', None)
+                if model_id is not None:
+                    row[2] = model_id
+
+    def _model_id(self, model_name, model_ids):
+        if model_name not in model_ids:
+            model_ids[model_name] = len(self.meta['models'])
+            self.meta['models'].append(model_name)
+        return model_ids[model_name]
+
+    def ingest(self, log_dir, stats=None, since=None):
+        """
+        トランスクリプトの追記分を列ファイルに取り込む
+
+        ファイルごとの読み込み位置はメタデータで管理し、ローテーションや切り詰めを
+        検出したファイルはそのファイルの行のみを削除して取り込み直す。
+        集計時は since にウィンドウの開始時刻を渡し、古いディレクトリを stat しない
+        （ingest_usage_events と同じ）。columns.lock は変更のあったファイルがある場合のみ取得する。
+
+        Args:
+            log_dir: Claude Code のログディレクトリパス
+            stats: 走査統計（指定時は読み込んだ行数を加算）
+            since: この時刻以降に更新されたファイルのみ取り込む（iter_transcripts 参照、Noneなら全て）
+
+        Returns:
+            int: 取り込んだイベント数
+        """
+        if stats is None:
+            stats = new_scan_stats()
+
+        self.meta = self._load_meta()
+        candidates = [
+            (jsonl_file, st) for jsonl_file, st in iter_transcripts(log_dir, since=since, stats=stats)
+            if not is_checkpoint_current(self.meta['files'].get(str(transcript_source(jsonl_file))), st)
+        ]
+        if not candidates and 'merge' not in self.meta:
+            return 0
+
+        with file_lock(self.directory / 'columns.lock'):
+            # ロック待ちの間に他のプロセスが取り込んだ分を読み直す
+            self.meta = self._load_meta()
+            self._repair()
+
+            files = self.meta['files']
+            model_ids = {name: i for i, name in enumerate(self.meta['models'])}
+            new_rows = []
+            dropped_files = set()
+            # 既に書き込み済みのユーザー行に後から確定したモデル（ts, file_id, model_id）
+            model_patches = []
+
+            for jsonl_file, st in candidates:
+                file_key = str(transcript_source(jsonl_file))
+                previous = files.get(file_key)
+                if is_checkpoint_current(previous, st):
+                    continue
+
+                try:
+                    archive = archive_format(jsonl_file)
+                    with open(jsonl_file, 'rb') as f:
+                        stats['filesOpened'] += 1
+                        offset = 0
+                        # 応答待ちのユーザーメッセージ（uuid -> ts）。応答のモデルで後から確定する
+                        pending = {}
+                        if previous is None:
+                            file_id = self.meta['nextFileId']
+                            self.meta['nextFileId'] += 1
+                        else:
+                            file_id = previous['id']
+                            if archive is None and can_resume_from(f, st, previous['inode'], previous['offset'],
+                                                                   previous['tailCrc']):
+                                offset = previous['offset']
+                                pending = previous.get('pending', {})
+                            else:
+                                dropped_files.add(file_id)
+                        batch_users = {}
+                        start_offset = offset
+
+                        for buf, start, end, offset in iter_transcript_lines(f, offset, archive):
+                            if not is_relevant_line(buf, start, end):
+                                stats['linesSkipped'] += 1
+                                continue
+                            stats['linesParsed'] += 1
+                            try:
+                                entry = json.loads(buf[start:end])
+                                if not isinstance(entry, dict):
+                                    continue
+                                event = extract_store_event(entry, file_key)
+                            except (json.JSONDecodeError, ValueError, KeyError):
+                                stats['parseErrors'] += 1
+                                continue
+                            if event is None:
+                                continue
+                            stats['eventsCounted'] += 1
+
+                            ts_us, kind, _, model_name = event[:4]
+                            uuid, parent_uuid = event[13:15]
+                            model_id = self._model_id(model_name, model_ids)
+                            row = [
+                                ts_us,
+                                COLUMNAR_KIND_ASSISTANT if kind == 'assistant' else COLUMNAR_KIND_USER,
+                                model_id,
+                                file_id,
+                                *event[6:10],
+                                event[15] or 0
+                            ]
+                            new_rows.append(row)
+
+                            if kind == 'user':
+                                if uuid:
+                                    pending[uuid] = ts_us
+                                    batch_users[uuid] = row
+                            elif parent_uuid in pending:
+                                # ユーザーメッセージのモデルは直後の応答のモデルとみなす
+                                user_ts = pending.pop(parent_uuid)
+                                if parent_uuid in batch_users:
+                                    batch_users.pop(parent_uuid)[2] = model_id
+                                else:
+                                    model_patches.append((user_ts, file_id, model_id))
+
+                        stats['bytesRead'] += offset - start_offset
+
+                        # 応答が付かないまま古くなったユーザーメッセージは追跡をやめる
+                        if pending:
+                            horizon = max(pending.values()) - COLUMNAR_PENDING_TTL_US
+                            pending = {uuid: ts for uuid, ts in pending.items() if ts >= horizon}
+
+                        files[file_key] = {
+                            'id': file_id,
+                            'inode': st.st_ino,
+                            'size': st.st_size,
+                            'mtime': st.st_mtime_ns,
+                            'offset': offset,
+                            'tailCrc': _read_tail_crc(f, offset) if archive is None else None,
+                            'pending': pending
+                        }
+                except OSError as e:
+                    print(f"Warning: Failed to read file {jsonl_file}: {e}", file=sys.stderr)
+                    continue
+
+            new_rows.sort(key=lambda row: row[0])
+
+            # 後から確定したユーザー行のモデルは表に記録（応答待ちの追跡期間を過ぎたものは捨てる）
+            patches = self.meta.setdefault('modelPatches', {})
+            for ts_us, file_id, model_id in model_patches:
+                if file_id not in dropped_files:
+                    patches[f'{file_id}:{ts_us}'] = model_id
+
+            out_of_order = new_rows and new_rows[0][0] < self.meta['maxTs']
+            if new_rows:
+                self.meta['maxTs'] = max(self.meta['maxTs'], new_rows[-1][0])
+
+            if dropped_files:
+                # ローテーション・切り詰めがあった場合のみ全体を書き直す
+                rows = [row for row in self._read_rows(0) if row[3] not in dropped_files]
+                rows.extend(new_rows)
+                rows.sort(key=lambda row: row[0])
+                self._fold_model_patches(rows)
+                self._write_all({
+                    name: array.array(typecode, (row[index] for row in rows))
+                    for index, (name, typecode) in enumerate(COLUMNAR_COLUMNS)
+                })
+                self.meta['count'] = len(rows)
+            elif out_of_order:
+                self._merge_suffix(new_rows)
+            elif new_rows:
+                self._append(new_rows)
+                self.meta['count'] += len(new_rows)
+
+            horizon = self.meta['maxTs'] - COLUMNAR_PENDING_TTL_US
+            self.meta['modelPatches'] = {
+                key: model_id for key, model_id in patches.items() if int(key.split(':')[1]) >= horizon
+            }
+            self._save_meta()
+
+        return len(new_rows)
+
+    def _open_columns(self):
+        """列ファイルを開く（NumPy があれば memmap、なければ array）"""
+        numpy = load_numpy()
+        count = self.meta['count']
+        if numpy is None:
+            return self._read_all()
+
+        columns = {}
+        for name, typecode in COLUMNAR_COLUMNS:
+            if count == 0:
+                columns[name] = numpy.zeros(0, dtype=typecode)
+            else:
+                columns[name] = numpy.memmap(self._column_path(name), dtype=typecode, mode='r', shape=(count,))
+        return columns
+
+    def aggregate(self, window_start, breakdown=None):
+        """
+        ウィンドウ内の使用量を集計
+
+        Args:
+            window_start: ウィンドウ開始時刻（これより後のイベントを集計）
+            breakdown: UsageBreakdown（指定時はファイル別の合計をパス順に加える）
+
+        Returns:
+            dict: 集計データ（new_usage_aggregate 形式）
+        """
+        start_us = int(window_start.timestamp()) * 1000000 + window_start.microsecond
+        columns = self._open_columns()
+        file_names = {entry['id']: Path(path).name for path, entry in self.meta['files'].items()}
+        weights, model_keys, key_of_model = self._model_tables()
+
+        if load_numpy() is not None:
+            aggregate, file_totals = self._aggregate_numpy(
+                columns, start_us, weights, model_keys, key_of_model, file_names
+            )
+        else:
+            aggregate, file_totals = self._aggregate_python(
+                columns, start_us, weights, model_keys, key_of_model, file_names
+            )
+
+        if breakdown is not None:
+            for path, entry in sorted(self.meta['files'].items()):
+                totals = file_totals.get(entry['id'])
+                if totals is not None:
+                    breakdown.add(path, *totals)
+        return aggregate
+
+    @staticmethod
+    def _first_rows(keys):
+        """
+        集計範囲の key 列から、重複を除いて数える行のマスクを作る（NumPy 用）
+
+        Args:
+            keys: 集計範囲の key 列
+
+        Returns:
+            numpy.ndarray: 各 key の最初の行と key のない行が True
+        """
+        numpy = load_numpy()
+        keep = keys == 0
+        if len(keys):
+            keep[numpy.unique(keys, return_index=True)[1]] = True
+        return keep
+
+    def _model_tables(self):
+        """
+        モデル ID ごとの重みと集計キー（モデル数は少ないため Python で前計算）
+
+        Returns:
+            tuple: (モデル ID -> 重み, 集計キーのリスト, モデル ID -> 集計キーの番号)
+        """
+        models = self.meta['models']
+        weights = [get_model_weight(name) for name in models]
+        model_keys = []
+        key_of_model = []
+        for name in models:
+            model_key = get_model_key_from_name(name)
+            if model_key not in model_keys:
+                model_keys.append(model_key)
+            key_of_model.append(model_keys.index(model_key))
+        return weights, model_keys, key_of_model
+
+    def buckets(self, since):
+        """
+        since 以降の assistant 応答を時間バケット（add_usage_bucket と同じ形式）に集計
+
+        Args:
+            since: 集計の下限時刻（この時刻を含む）
+
+        Returns:
+            dict: バケット開始時刻 -> モデルキー -> 値のリスト
+        """
+        since_us = int(since.timestamp()) * 1000000 + since.microsecond
+        bucket_us = USAGE_BUCKET_SECONDS * 1000000
+        columns = self._open_columns()
+        weights, model_keys, key_of_model = self._model_tables()
+        buckets = {}
+        numpy = load_numpy()
+
+        if numpy is None:
+            seen = set()
+            for i in range(bisect.bisect_left(columns['ts'], since_us), self.meta['count']):
+                if columns['kind'][i] != COLUMNAR_KIND_ASSISTANT:
+                    continue
+                key = columns['key'][i]
+                if key:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                model_id = columns['model'][i]
+                input_tokens = columns['input'][i]
+                output_tokens = columns['output'][i]
+                cache_creation = columns['cache_creation'][i]
+                cache_read = columns['cache_read'][i]
+                weighted = (input_tokens + cache_creation * CACHE_CREATION_COEFFICIENT
+                            + cache_read * CACHE_READ_COEFFICIENT
+                            + output_tokens * OUTPUT_COEFFICIENT) * weights[model_id]
+
+                bucket = str(columns['ts'][i] // bucket_us * USAGE_BUCKET_SECONDS)
+                values = buckets.setdefault(bucket, {}).setdefault(
+                    model_keys[key_of_model[model_id]], [0, 0, 0, 0, 0, 0]
+                )
+                for j, value in enumerate((1, input_tokens, output_tokens, cache_creation, cache_read, weighted)):
+                    values[j] += value
+            return buckets
+
+        if not model_keys:
+            return buckets
+        lo = int(numpy.searchsorted(columns['ts'], since_us, side='left'))
+        assistant = (columns['kind'][lo:] == COLUMNAR_KIND_ASSISTANT) & self._first_rows(columns['key'][lo:])
+        model = columns['model'][lo:][assistant]
+        input_tokens = columns['input'][lo:][assistant]
+        output_tokens = columns['output'][lo:][assistant]
+        cache_creation = columns['cache_creation'][lo:][assistant]
+        cache_read = columns['cache_read'][lo:][assistant]
+        weighted = ((input_tokens + cache_creation * CACHE_CREATION_COEFFICIENT + cache_read * CACHE_READ_COEFFICIENT)
+                    + output_tokens * OUTPUT_COEFFICIENT) * numpy.asarray(weights, dtype='f8')[model]
+
+        # (バケット, 集計キー) の組ごとに bincount で合計する
+        n = len(model_keys)
+        group = (columns['ts'][lo:][assistant] // bucket_us) * n + numpy.asarray(key_of_model, dtype='i8')[model]
+        groups, inverse = numpy.unique(group, return_inverse=True)
+        sums = [numpy.bincount(inverse, minlength=len(groups))] + [
+            numpy.bincount(inverse, weights=column, minlength=len(groups))
+            for column in (input_tokens, output_tokens, cache_creation, cache_read, weighted)
+        ]
+        for i, value in enumerate(groups.tolist()):
+            bucket = str(value // n * USAGE_BUCKET_SECONDS)
+            buckets.setdefault(bucket, {})[model_keys[value % n]] = [
+                int(sums[0][i]), int(sums[1][i]), int(sums[2][i]), int(sums[3][i]), int(sums[4][i]), float(sums[5][i])
+            ]
+        return buckets
+
+    @staticmethod
+    def _new_model_data():
+        return {'requests': 0, 'inputTokens': 0, 'outputTokens': 0, 'rawTokens': 0, 'weightedTokens': 0}
+
+    def _append_messages(self, aggregate, ts_values, model_values, file_values, file_names):
+        patches = self.meta.get('modelPatches') or {}
+        for ts_us, model_id, file_id in zip(ts_values, model_values, file_values):
+            ts_us = int(ts_us)
+            ts = datetime.fromtimestamp(ts_us // 1000000, timezone.utc).replace(microsecond=ts_us % 1000000)
+            model_name = self.meta['models'][patches.get(f'{int(file_id)}:{ts_us}', int(model_id))]
+            aggregate['messages'].append({
+                'timestamp': ts.isoformat(),
+                'file': file_names.get(int(file_id), ''),
+                'model': model_name,
+                'weight': get_model_weight(model_name)
+            })
+
+    def _aggregate_numpy(self, columns, start_us, weights, model_keys, key_of_model, file_names):
+        numpy = load_numpy()
+        aggregate = new_usage_aggregate()
+        lo = int(numpy.searchsorted(columns['ts'], start_us, side='right'))
+
+        kind = columns['kind'][lo:]
+        first = self._first_rows(columns['key'][lo:])
+        assistant = (kind == COLUMNAR_KIND_ASSISTANT) & first
+        model = columns['model'][lo:][assistant]
+        input_tokens = columns['input'][lo:][assistant]
+        output_tokens = columns['output'][lo:][assistant]
+        cache_creation = columns['cache_creation'][lo:][assistant]
+        cache_read = columns['cache_read'][lo:][assistant]
+
+        weight = numpy.asarray(weights, dtype='f8')[model] if len(weights) else numpy.zeros(0)
+        weighted_input = (input_tokens + cache_creation * CACHE_CREATION_COEFFICIENT
+                          + cache_read * CACHE_READ_COEFFICIENT) * weight
+        weighted_output = output_tokens * OUTPUT_COEFFICIENT * weight
+
+        aggregate['raw']['input'] = int(input_tokens.sum())
+        aggregate['raw']['output'] = int(output_tokens.sum())
+        aggregate['raw']['cache_creation'] = int(cache_creation.sum())
+        aggregate['raw']['cache_read'] = int(cache_read.sum())
+        aggregate['weighted']['input'] = float(weighted_input.sum())
+        aggregate['weighted']['output'] = float(weighted_output.sum())
+        aggregate['weighted']['total'] = float((weighted_input + weighted_output).sum())
+
+        if len(model_keys):
+            key = numpy.asarray(key_of_model, dtype='i8')[model]
+            n = len(model_keys)
+            requests = numpy.bincount(key, minlength=n)
+            raw_input = numpy.bincount(key, weights=input_tokens + cache_creation + cache_read, minlength=n)
+            raw_output = numpy.bincount(key, weights=output_tokens, minlength=n)
+            weighted_total = numpy.bincount(key, weights=weighted_input + weighted_output, minlength=n)
+
+            for i, model_key in enumerate(model_keys):
+                if requests[i] == 0:
+                    continue
+                aggregate['by_model'][model_key] = {
+                    'requests': int(requests[i]),
+                    'inputTokens': int(raw_input[i]),
+                    'outputTokens': int(raw_output[i]),
+                    'rawTokens': int(raw_input[i] + raw_output[i]),
+                    'weightedTokens': float(weighted_total[i])
+                }
+
+        user = (kind != COLUMNAR_KIND_ASSISTANT) & first
+        self._append_messages(
+            aggregate, columns['ts'][lo:][user], columns['model'][lo:][user], columns['file'][lo:][user], file_names
+        )
+
+        # ファイル ID ごとの [重み付けトークン数, 生トークン数, 応答数, メッセージ数]
+        n = self.meta['nextFileId']
+        assistant_files = columns['file'][lo:][assistant]
+        user_files = columns['file'][lo:][user]
+        sums = (
+            numpy.bincount(assistant_files, weights=weighted_input + weighted_output, minlength=n),
+            numpy.bincount(assistant_files, weights=input_tokens + output_tokens + cache_creation + cache_read,
+                           minlength=n),
+            numpy.bincount(assistant_files, minlength=n),
+            numpy.bincount(user_files, minlength=n)
+        )
+        file_totals = {
+            file_id: [float(sums[0][file_id]), int(sums[1][file_id]), int(sums[2][file_id]), int(sums[3][file_id])]
+            for file_id in numpy.flatnonzero(sums[2] + sums[3]).tolist()
+        }
+        return aggregate, file_totals
+
+    def _aggregate_python(self, columns, start_us, weights, model_keys, key_of_model, file_names):
+        aggregate = new_usage_aggregate()
+        lo = bisect.bisect_right(columns['ts'], start_us)
+        user_rows = []
+        seen = set()
+        # ファイル ID ごとの [重み付けトークン数, 生トークン数, 応答数, メッセージ数]
+        file_totals = {}
+
+        for i in range(lo, self.meta['count']):
+            key = columns['key'][i]
+            if key:
+                if key in seen:
+                    continue
+                seen.add(key)
+            model_id = columns['model'][i]
+            totals = file_totals.get(columns['file'][i])
+            if totals is None:
+                totals = file_totals[columns['file'][i]] = [0.0, 0, 0, 0]
+            if columns['kind'][i] != COLUMNAR_KIND_ASSISTANT:
+                user_rows.append((columns['ts'][i], model_id, columns['file'][i]))
+                totals[3] += 1
+                continue
+
+            input_tokens = columns['input'][i]
+            output_tokens = columns['output'][i]
+            cache_creation = columns['cache_creation'][i]
+            cache_read = columns['cache_read'][i]
+            weight = weights[model_id]
+            weighted_input = (input_tokens + cache_creation * CACHE_CREATION_COEFFICIENT
+                              + cache_read * CACHE_READ_COEFFICIENT) * weight
+            weighted_output = output_tokens * OUTPUT_COEFFICIENT * weight
+
+            aggregate['raw']['input'] += input_tokens
+            aggregate['raw']['output'] += output_tokens
+            aggregate['raw']['cache_creation'] += cache_creation
+            aggregate['raw']['cache_read'] += cache_read
+            aggregate['weighted']['input'] += weighted_input
+            aggregate['weighted']['output'] += weighted_output
+            aggregate['weighted']['total'] += weighted_input + weighted_output
+
+            model_data = aggregate['by_model'].setdefault(model_keys[key_of_model[model_id]], self._new_model_data())
+            model_data['requests'] += 1
+            model_data['inputTokens'] += input_tokens + cache_creation + cache_read
+            model_data['outputTokens'] += output_tokens
+            model_data['rawTokens'] += input_tokens + cache_creation + cache_read + output_tokens
+            model_data['weightedTokens'] += weighted_input + weighted_output
+
+            totals[0] += weighted_input + weighted_output
+            totals[1] += input_tokens + cache_creation + cache_read + output_tokens
+            totals[2] += 1
+
+        if user_rows:
+            self._append_messages(aggregate, *zip(*user_rows), file_names)
+        return aggregate, file_totals
+
+def query_columnar_usage(log_dir, window_start, bucket_hours=0):
+    """
+    列指向ストアに追記分を取り込んだ上で、ウィンドウ内の使用量を集計
+
+    Args:
+        log_dir: Claude Code のログディレクトリパス
+        window_start: ウィンドウ開始時刻
+        bucket_hours: 直近この時間の assistant 応答を時間バケットとしても返す（0 なら返さない）
+
+    Returns:
+        dict: 集計データ（new_usage_aggregate 形式）
+    """
+    store = ColumnarUsageStore()
+    scan_stats = new_scan_stats()
+    with profile_phase('ingest'):
+        store.ingest(log_dir, scan_stats, since=get_scan_since(window_start, bucket_hours)[0])
+
+    with profile_phase('query'):
+        breakdown = UsageBreakdown(log_dir)
+        aggregate = store.aggregate(window_start, breakdown)
+        aggregate['breakdown'] = breakdown.report()
+        if bucket_hours:
+            aggregate['buckets'] = store.buckets(datetime.now(timezone.utc) - timedelta(hours=bucket_hours))
+    aggregate['scan'] = scan_stats
+    return aggregate
+
+def summarize_rollup_usage(aggregate, base_limit=None):
+    """
+    ロールアップの集計結果を台帳・履歴用の形式にまとめる
+
+    Args:
+        aggregate: query_rollups() の結果
+        base_limit: 使用率の基準となる制限値（指定時のみ tokenPercent を付与）
+
+    Returns:
+        dict: requests / tokens / modelBreakdown（と tokenPercent）
+    """
+    raw = dict(aggregate['raw'])
+    raw['total'] = raw['input'] + raw['output'] + raw['cache_creation'] + raw['cache_read']
+    weighted_total = aggregate['weighted']['total']
+
+    model_breakdown = {}
+    for model_key, model_data in aggregate['by_model'].items():
+        model_breakdown[model_key] = {
+            'requests': model_data['requests'],
+            'rawTokens': model_data['rawTokens'],
+            'weightedTokens': model_data['weightedTokens'],
+            'weightedRatio': round(model_data['weightedTokens'] / weighted_total * 100, 1) if weighted_total > 0 else 0
+        }
+
+    summary = {
+        'requests': sum(m['requests'] for m in model_breakdown.values()),
+        'tokens': {'raw': raw, 'weighted': aggregate['weighted']},
+        'modelBreakdown': model_breakdown
+    }
+    if base_limit is not None:
+        summary['tokenPercent'] = round(weighted_total / base_limit * 100) if base_limit > 0 else 0
+    return summary
+
+def read_last_ledger_entry():
+    """台帳の最後のウィンドウを取得（ファイル末尾から逆向きに読む）"""
+    try:
+        with open(WINDOW_LEDGER_FILE, 'rb') as f:
+            for line in iter_lines_reverse(f):
+                try:
+                    return json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return None
+
+def load_last_window_aggregate(window_start):
+    """
+    直前の計算結果（USAGE_RESULT_FILE）から、指定したウィンドウの集計を取り出す
+
+    ウィンドウのリセット時にログを走査し直さず、終了したウィンドウの最終集計として使う。
+
+    Args:
+        window_start: ウィンドウ開始時刻
+
+    Returns:
+        tuple or None: (集計データ（query_rollups() と同じ形式）, 計算時刻)
+            - 同じウィンドウの結果がない場合は None
+    """
+    shared = read_json_file(USAGE_RESULT_FILE)
+    try:
+        usage = shared['usage']
+        if usage.get('windowStart') != window_start.isoformat():
+            return None
+        raw = usage['tokens']['raw']
+        aggregate = {
+            'raw': {key: raw[key] for key in ('input', 'output', 'cache_creation', 'cache_read')},
+            'weighted': usage['tokens']['weighted'],
+            'by_model': usage['modelBreakdown']
+        }
+        return aggregate, datetime.fromtimestamp(shared['finishedAt'], timezone.utc)
+    except (TypeError, KeyError, AttributeError, ValueError, OSError):
+        return None
+
+def record_closed_window(window_start, window_hours, plan, source='scan'):
+    """
+    終了したウィンドウの最終集計を台帳（WINDOW_LEDGER_FILE）に追記
+
+    store モードではイベントストアのロールアップ（追記分のみ取り込み済み）から、
+    それ以外では直前の計算結果から集計する（ステータス更新中にログ全体を走査しない）。
+    直前の計算結果が別のウィンドウのものなら記録しない。同じウィンドウが既に
+    記録されている場合（複数プロセスが同時にリセットした場合など）も何もしない。
+
+    Args:
+        window_start: 終了したウィンドウの開始時刻
+        window_hours: ウィンドウの時間
+        plan: プラン名
+        source: 集計方法（calculate_message_usage を参照）
+    """
+    import sqlite3
+
+    window_end = round_to_hour_utc(window_start) + timedelta(hours=window_hours)
+
+    try:
+        with file_lock(WINDOW_LEDGER_FILE.with_suffix('.lock')):
+            last_entry = read_last_ledger_entry()
+            if last_entry is not None and last_entry.get('windowStart') == window_start.isoformat():
+                return
+
+            if source == 'store':
+                conn = open_event_store()
+                try:
+                    ingest_usage_events(conn, get_log_directory(), since=window_start)
+                    aggregate = query_rollups(conn, window_start, window_end)
+                finally:
+                    conn.close()
+                as_of = datetime.now(timezone.utc)
+            else:
+                last = load_last_window_aggregate(window_start)
+                if last is None:
+                    return
+                aggregate, as_of = last
+
+            entry = {
+                'windowStart': window_start.isoformat(),
+                'windowEnd': window_end.isoformat(),
+                'closedAt': datetime.now(timezone.utc).isoformat(),
+                'asOf': as_of.isoformat(),
+                'plan': plan,
+                **summarize_rollup_usage(aggregate, get_token_limit(plan))
+            }
+            with open(WINDOW_LEDGER_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+    except (sqlite3.Error, OSError) as e:
+        print(f"Warning: Failed to record closed window: {e}", file=sys.stderr)
+
+def load_window_ledger(since):
+    """
+    台帳から指定時刻以降に終了したウィンドウを読み込む
+
+    Args:
+        since: この時刻以降に終了したウィンドウのみ返す
+
+    Returns:
+        list: 台帳のエントリ（古い順）
+    """
+    entries = []
+    try:
+        with open(WINDOW_LEDGER_FILE, 'rb') as f:
+            for line in iter_lines_reverse(f):
+                try:
+                    entry = json.loads(line)
+                    if datetime.fromisoformat(entry['windowEnd']) < since:
+                        break
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    continue
+                entries.append(entry)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: Failed to read window ledger: {e}", file=sys.stderr)
+
+    entries.reverse()
+    return entries
+
+def build_usage_history(days=HISTORY_DAYS, ingest=False):
+    """
+    過去のウィンドウ・日別合計・モデル構成比をロールアップと台帳のみから作成
+
+    トランスクリプトは読まない（ロールアップは --store での集計時に更新される）。
+    ingest を指定した場合のみ、先にストアへ未取り込みの追記分を取り込む。
+    イベントストアがなく ingest も指定されていない場合（daemon の既定の scan モード）は
+    データベースを作らず、台帳のウィンドウのみを返す（rollups: false と理由を含める）。
+
+    Args:
+        days: 集計する日数（今日を含む、UTC 日付）
+        ingest: True なら集計前にイベントストアへ追記分を取り込む（--history --store）
+
+    Returns:
+        dict: 使用量の履歴
+    """
+    import sqlite3
+
+    now = datetime.now(timezone.utc)
+    since = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    history = {
+        'generatedAt': now.isoformat(),
+        'since': since.isoformat(),
+        'days': days,
+        'windows': load_window_ledger(since)
+    }
+
+    if not ingest and not EVENT_STORE_FILE.exists():
+        return {
+            **history,
+            'rollups': False,
+            'note': 'Event store not found: daily totals and model mix need --history --store',
+            'daily': [],
+            'modelMix': {}
+        }
+
+    conn = open_event_store()
+    try:
+        if ingest:
+            try:
+                ingest_usage_events(conn, get_log_directory())
+            except sqlite3.Error as e:
+                print(f"Warning: Failed to update event store: {e}", file=sys.stderr)
+
+        daily = []
+        for day in range(days):
+            day_start = since + timedelta(days=day)
+            daily.append({
+                'date': day_start.date().isoformat(),
+                **summarize_rollup_usage(query_rollups(conn, day_start, day_start + timedelta(days=1)))
+            })
+
+        model_mix = summarize_rollup_usage(query_rollups(conn, since, now + timedelta(minutes=1)))
+    finally:
+        conn.close()
+
+    return {
+        **history,
+        'rollups': True,
+        'daily': daily,
+        'modelMix': model_mix['modelBreakdown']
+    }
+
+def build_bucket_prefix_sums(buckets):
+    """
+    時間バケットをモデルごとの累積和（prefix sum）に変換
+
+    Args:
+        buckets: add_usage_bucket 形式の時間バケット
+
+    Returns:
+        tuple: (昇順のバケット開始時刻のリスト, モデルキー -> 累積値のリスト)
+            - 累積値のリストは先頭に 0 を持ち、i 番目までのバケットの合計が [i] に入る
+    """
+    starts = sorted(int(bucket) for bucket in buckets)
+    model_keys = {model_key for models in buckets.values() for model_key in models}
+    prefix = {}
+    for model_key in model_keys:
+        running = [0, 0, 0, 0, 0, 0]
+        sums = [running]
+        for start in starts:
+            values = buckets[str(start)].get(model_key)
+            if values is not None:
+                running = [a + b for a, b in zip(running, values)]
+            sums.append(running)
+        prefix[model_key] = sums
+    return starts, prefix
+
+def evaluate_usage_windows(definitions, aggregate, window_start, now, base_limit):
+    """
+    すべてのウィンドウ定義を1回の走査結果から評価
+
+    fixed ウィンドウは通常の集計結果（window_start 以降）をそのまま使う。rolling ウィンドウは
+    時間バケットの累積和の差（バケット単位で切り捨てた開始時刻から現在まで）で求める。
+
+    Args:
+        definitions: get_usage_windows() のウィンドウ定義
+        aggregate: 走査結果（new_usage_aggregate 形式、buckets を含む）
+        window_start: 5時間ウィンドウの開始時刻
+        now: 現在時刻
+        base_limit: fixed ウィンドウで limit 未指定時の制限値（tokenPercent と同じ基準）
+
+    Returns:
+        dict: ウィンドウ名 -> 使用量（定義の順）
+    """
+    starts, prefix = build_bucket_prefix_sums(aggregate.get('buckets', {}))
+    results = {}
+
+    for definition in definitions:
+        hours = definition['hours']
+        limit = definition.get('limit')
+        model_limits = definition.get('modelLimits') or {}
+
+        if definition['type'] == 'fixed':
+            start = window_start
+            end = round_to_hour_utc(window_start) + timedelta(hours=hours)
+            by_model = {
+                model_key: (data['requests'], data['rawTokens'], data['weightedTokens'])
+                for model_key, data in aggregate['by_model'].items()
+            }
+            raw = dict(aggregate['raw'])
+            weighted_total = aggregate['weighted']['total']
+            if limit is None:
+                limit = base_limit
+        else:
+            start = now - timedelta(hours=hours)
+            end = now
+            first = bisect.bisect_left(starts, int(start.timestamp()) // USAGE_BUCKET_SECONDS * USAGE_BUCKET_SECONDS)
+            raw = {'input': 0, 'output': 0, 'cache_creation': 0, 'cache_read': 0}
+            weighted_total = 0
+            by_model = {}
+            for model_key, sums in prefix.items():
+                values = [b - a for a, b in zip(sums[first], sums[-1])]
+                if values[0] == 0:
+                    continue
+                by_model[model_key] = (values[0], sum(values[1:5]), values[5])
+                raw['input'] += values[1]
+                raw['output'] += values[2]
+                raw['cache_creation'] += values[3]
+                raw['cache_read'] += values[4]
+                weighted_total += values[5]
+
+        raw['total'] = raw['input'] + raw['output'] + raw['cache_creation'] + raw['cache_read']
+        window = {
+            'type': definition['type'],
+            'hours': hours,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'requests': sum(requests for requests, _, _ in by_model.values()),
+            'tokens': {'raw': raw, 'weighted': {'total': weighted_total}}
+        }
+        if limit:
+            window['limit'] = limit
+            window['percent'] = round(weighted_total / limit * 100)
+
+        if definition.get('perModel'):
+            window['byModel'] = {}
+            for model_key, (requests, raw_tokens, weighted_tokens) in by_model.items():
+                model_window = {'requests': requests, 'rawTokens': raw_tokens, 'weightedTokens': weighted_tokens}
+                if model_key in model_limits:
+                    model_window['limit'] = model_limits[model_key]
+                    model_window['percent'] = round(weighted_tokens / model_limits[model_key] * 100)
+                window['byModel'][model_key] = model_window
+
+        results[definition['name']] = window
+
+    return results
+
+def calculate_message_usage(window_hours=5, message_limit=None, source='scan', workers=1):
+    """
+    5時間固定ウィンドウ内のメッセージ使用数を計算（リセット機能付き）
+
+    Args:
+        window_hours: ウィンドウの時間（デフォルト5時間）
+        message_limit: メッセージ数の上限（デフォルト250）
+        source: 集計方法（'scan': ログを直接走査, 'store': SQLite イベントストア,
+                'columnar': 列指向ストア）
+        workers: トランスクリプト走査のワーカープロセス数（1なら直列）
+
+    Returns:
+        dict: メッセージ使用状況
+    """
+    # メッセージ制限が指定されていない場合、プラン設定から取得
+    with profile_phase('config'):
+        refresh_config_snapshot()
+        if message_limit is None:
+            message_limit = get_message_limit()
+
+        plan = get_plan_config()
+        usage_windows = get_usage_windows()
+        bucket_hours = get_bucket_hours(usage_windows)
+    log_dir = get_log_directory()
+
+    if not log_dir.exists():
+        return {
+            "error": f"Log directory not found: {log_dir}",
+            "messageCount": 0,
+            "messageLimit": message_limit,
+            "messagePercent": 0
+        }
+
+    now = datetime.now(timezone.utc)
+
+    # ウィンドウ状態を取得
+    with profile_phase('config'):
+        window_state = get_window_state()
+
+    # リセット判定：5時間経過したかチェック
+    if window_state is not None and should_reset_window(window_state['windowStart'], now):
+        # 終了したウィンドウの最終集計を台帳に記録（リセット後の待機状態だった場合を除く）
+        if 'resetTimestamp' not in window_state:
+            record_closed_window(window_state['windowStart'], window_hours, plan, source)
+
+        # 5時間経過 → ウィンドウをリセット（0%に戻す）
+        # リセットタイムスタンプを記録（この時点以降のメッセージのみカウントする）
+        save_window_state(
+            window_start=now,  # ダミー（すぐに上書きされる）
+            first_message_timestamp=now,  # ダミー
+            reset_timestamp=now  # リセット時点のタイムスタンプを記録
+        )
+
+        # トークン制限値を取得
         token_limit = get_token_limit(plan)
 
         # 0%を返す（次のメッセージで新しいウィンドウ開始）
@@ -591,6 +4189,7 @@ def calculate_message_usage(window_hours=5, message_limit=None):
                 "weighted": {"input": 0, "output": 0, "total": 0}
             },
             "modelBreakdown": {},
+            "usageBreakdown": UsageBreakdown(log_dir).report(),
 
             # トークン制限と使用率（リセット時は0%）
             "tokenLimit": token_limit,
@@ -610,6 +4209,7 @@ def calculate_message_usage(window_hours=5, message_limit=None):
 
             # 後方互換性
             "messagePercent": 0,
+            "windows": {},
             "resetStatus": "Window expired - waiting for next message"
         }
 
@@ -618,7 +4218,8 @@ def calculate_message_usage(window_hours=5, message_limit=None):
         # 完全な初回起動（usage-window.json が存在しない）
         # ログから最新のアクティビティを探して、そこからウィンドウを開始
         # ただし、5時間以上前のアクティビティは無視（期限切れとして扱う）
-        latest_activity = find_latest_activity(log_dir)
+        with profile_phase('latestActivity'):
+            latest_activity = find_latest_activity(log_dir, since=now - timedelta(hours=5))
         if latest_activity and (now - latest_activity) < timedelta(hours=5):
             # 5時間以内のアクティビティがある → そこからウィンドウ開始
             window_start = latest_activity
@@ -640,153 +4241,27 @@ def calculate_message_usage(window_hours=5, message_limit=None):
         window_start = window_state['windowStart']
         reset_timestamp = None
 
-    messages = []
-    # アシスタント応答のモデル情報を保存（parentUuid -> model_name）
-    assistant_models = {}
-    # トークン使用量情報を保存
-    token_usage_data = {
-        'raw': {'input': 0, 'output': 0, 'cache_creation': 0, 'cache_read': 0, 'total': 0},
-        'weighted': {'input': 0, 'output': 0, 'total': 0},
-        'by_model': {}
-    }
-
-    # 全プロジェクトのログファイルを1回で走査（パフォーマンス改善）
-    for jsonl_file in log_dir.rglob('*.jsonl'):
-        try:
-            # ファイルの最終更新日時がウィンドウ内かチェック（高速化）
-            # タイムゾーン混在を防ぐため、明示的にUTC変換
-            mtime_local = datetime.fromtimestamp(jsonl_file.stat().st_mtime)
-            mtime = mtime_local.astimezone(timezone.utc)
-            if mtime < window_start:
-                continue
-
-            # JSONLファイルを1行ずつ読み込み（assistantとuserを同時に処理）
-            with open(jsonl_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if not line.strip():
-                        continue
-
-                    try:
-                        entry = json.loads(line)
-                        event_type = entry.get('type', '')
-
-                        # アシスタント応答からモデル情報とトークン使用量を収集
-                        if event_type == 'assistant':
-                            parent_uuid = entry.get('parentUuid')
-                            message = entry.get('message', {})
-                            if isinstance(message, dict):
-                                model_name = message.get('model', '')
-                                if parent_uuid and model_name:
-                                    assistant_models[parent_uuid] = model_name
-
-                                # トークン使用量を取得
-                                usage = message.get('usage', {})
-                                ts_str = entry.get('timestamp')
-
-                                # 最終応答のみをカウント（usage が存在し、output_tokens > 0）
-                                # stop_reasonがnullの場合もカウント（ストリーミング中のイベント対応）
-                                if usage and ts_str and usage.get('output_tokens', 0) > 0:
-                                    ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                                    if ts > window_start:
-                                        # 重み付けトークン数を計算
-                                        weighted = calculate_weighted_tokens(usage, model_name)
-
-                                        # 生トークン数を集計
-                                        input_tokens = usage.get('input_tokens', 0)
-                                        output_tokens = usage.get('output_tokens', 0)
-                                        cache_creation = usage.get('cache_creation_input_tokens', 0)
-                                        cache_read = usage.get('cache_read_input_tokens', 0)
-
-                                        token_usage_data['raw']['input'] += input_tokens
-                                        token_usage_data['raw']['output'] += output_tokens
-                                        token_usage_data['raw']['cache_creation'] += cache_creation
-                                        token_usage_data['raw']['cache_read'] += cache_read
-
-                                        # 重み付けトークン数を集計
-                                        token_usage_data['weighted']['input'] += weighted['weighted_input']
-                                        token_usage_data['weighted']['output'] += weighted['weighted_output']
-                                        token_usage_data['weighted']['total'] += weighted['total_weighted']
-
-                                        # モデル別の集計（汎用関数を使用）
-                                        model_key = get_model_key_from_name(model_name)
-
-                                        if model_key not in token_usage_data['by_model']:
-                                            token_usage_data['by_model'][model_key] = {
-                                                'requests': 0,
-                                                'inputTokens': 0,
-                                                'outputTokens': 0,
-                                                'rawTokens': 0,
-                                                'weightedTokens': 0
-                                            }
-
-                                        token_usage_data['by_model'][model_key]['requests'] += 1
-                                        token_usage_data['by_model'][model_key]['inputTokens'] += weighted['raw_input']
-                                        token_usage_data['by_model'][model_key]['outputTokens'] += weighted['raw_output']
-                                        token_usage_data['by_model'][model_key]['rawTokens'] += weighted['raw_input'] + weighted['raw_output']
-                                        token_usage_data['by_model'][model_key]['weightedTokens'] += weighted['total_weighted']
-
-                        # ユーザーメッセージ送信イベントを処理
-                        elif event_type in ['UserPromptSubmit', 'user_prompt', 'user']:
-                            # サイドチェーン（サブエージェント）のメッセージを除外
-                            is_sidechain = entry.get('isSidechain', False)
-                            if is_sidechain:
-                                continue
+    with profile_phase('collect'):
+        if source == 'store':
+            import sqlite3
 
-                            # 実際のユーザーメッセージのみをカウント
-                            message = entry.get('message', {})
-                            if isinstance(message, dict):
-                                content = message.get('content', '')
-
-                                # content が配列形式の場合の処理
-                                if isinstance(content, list):
-                                    # 配列が空の場合は除外
-                                    if len(content) == 0:
-                                        continue
-                                    # 最初の要素が text オブジェクトかチェック
-                                    first_item = content[0]
-                                    if not isinstance(first_item, dict) or first_item.get('type') != 'text':
-                                        continue
-                                    # text の内容が空の場合は除外
-                                    text_content = first_item.get('text', '')
-                                    if not isinstance(text_content, str) or len(text_content.strip()) == 0:
-                                        continue
-                                # content が文字列形式の場合の処理
-                                elif isinstance(content, str):
-                                    if len(content.strip()) == 0:
-                                        continue
-                                else:
-                                    # その他の形式は除外
-                                    continue
+            # SQLite イベントストアから集計（失敗時はログを直接走査）
+            try:
+                token_usage_data = query_store_usage(log_dir, window_start, bucket_hours)
+            except sqlite3.Error as e:
+                print(f"Warning: Failed to query event store: {e}", file=sys.stderr)
+                token_usage_data = scan_usage(log_dir, window_start, workers, bucket_hours)
+        elif source == 'columnar':
+            # 列指向ストアから集計（失敗時はログを直接走査）
+            try:
+                token_usage_data = query_columnar_usage(log_dir, window_start, bucket_hours)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Failed to query columnar store: {e}", file=sys.stderr)
+                token_usage_data = scan_usage(log_dir, window_start, workers, bucket_hours)
+        else:
+            token_usage_data = scan_usage(log_dir, window_start, workers, bucket_hours)
 
-                            # タイムスタンプの解析
-                            ts_str = entry.get('timestamp')
-                            msg_uuid = entry.get('uuid')
-                            if ts_str:
-                                # ISO 8601形式をパース
-                                ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                                if ts > window_start:
-                                    # 対応するアシスタント応答のモデルを取得
-                                    model_name = assistant_models.get(msg_uuid, '')
-                                    model_weight = get_model_weight(model_name)
-
-                                    messages.append({
-                                        'timestamp': ts.isoformat(),
-                                        'file': str(jsonl_file.name),
-                                        'model': model_name,
-                                        'weight': model_weight
-                                    })
-
-                    except (json.JSONDecodeError, ValueError, KeyError) as e:
-                        # JSONパースエラーや予期されるキーエラーは無視
-                        continue
-        except OSError as e:
-            # ファイル読み込みエラー
-            print(f"Warning: Failed to read file {jsonl_file}: {e}", file=sys.stderr)
-            continue
-        except Exception as e:
-            # その他の予期しないエラー
-            print(f"Error processing file {jsonl_file}: {e}", file=sys.stderr)
-            continue
+    messages = token_usage_data['messages']
 
     # 新しいウィンドウを開始する場合（初回 or リセット後の最初のメッセージ）
     # reset_timestamp が存在する場合もリセット後の最初のメッセージとして扱う
@@ -903,6 +4378,8 @@ def calculate_message_usage(window_hours=5, message_limit=None):
             "weighted": token_usage_data['weighted']
         },
         "modelBreakdown": token_usage_data['by_model'],
+        # プロジェクト・セッション別の使用量の上位とアクティブな件数
+        "usageBreakdown": token_usage_data.get('breakdown') or UsageBreakdown(log_dir).report(),
 
         # モデル別使用率（新方式）
         "modelPercents": model_percents,
@@ -924,14 +4401,808 @@ def calculate_message_usage(window_hours=5, message_limit=None):
         },
 
         # 後方互換性のため、トップレベルにも messagePercent を残す
-        "messagePercent": token_percent  # モデル別合算の使用率を表示
+        "messagePercent": token_percent,  # モデル別合算の使用率を表示
+
+        # usage-config.json の windows で定義したウィンドウごとの使用量（5時間・24時間・7日など）
+        "windows": evaluate_usage_windows(usage_windows, token_usage_data, window_start, now, base_limit),
+
+        # 今回の実行で読み込んだ行数（バイトマーカーで除外した行はデコードしない）
+        "scanStats": token_usage_data.get('scan', new_scan_stats())
+    }
+
+def calculate_message_usage_shared(source='scan', workers=1):
+    """
+    他のプロセスと計算をまとめて（single-flight）使用率を計算
+
+    USAGE_COMPUTE_LOCK の排他ロックを取得したプロセスのみが計算する。計算中に呼ばれた
+    プロセスはロックの解放を待ち、待ち始めた後に同じ集計方法で完了した結果
+    （USAGE_RESULT_FILE）があればそれを返す。複数の Claude Code のステータスライン更新・daemon・--watch が
+    重なっても同じ計算を繰り返さず、ウィンドウ状態やチェックポイントの更新も直列になる。
+
+    Args:
+        source: 集計方法（calculate_message_usage を参照）
+        workers: トランスクリプト走査のワーカープロセス数
+
+    Returns:
+        dict: calculate_message_usage の結果
+    """
+    requested_at = time.time()
+
+    with file_lock(USAGE_COMPUTE_LOCK):
+        profile_count('lockWaitMs', round((time.time() - requested_at) * 1000, 3))
+
+        shared = read_json_file(USAGE_RESULT_FILE)
+        if (isinstance(shared, dict) and isinstance(shared.get('usage'), dict)
+                and shared.get('source') == source
+                and shared.get('finishedAt', 0) >= requested_at):
+            profile_count('sharedResults')
+            return shared['usage']
+
+        usage = calculate_message_usage(source=source, workers=workers)
+        try:
+            write_json_atomic(USAGE_RESULT_FILE, {'finishedAt': time.time(), 'source': source, 'usage': usage})
+        except OSError as e:
+            print(f"Warning: Failed to write shared usage result: {e}", file=sys.stderr)
+        return usage
+
+def build_cache_data(usage, now=None):
+    """
+    使用率データから ccusage-cache.json の内容を作成（ccusage-daemon.mjs の updateCache と同じ形式）
+
+    Args:
+        usage: calculate_message_usage() の結果
+        now: キャッシュのタイムスタンプ（デフォルト: 現在時刻）
+
+    Returns:
+        dict: キャッシュデータ
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    return {
+        "timestamp": now.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        # トークンベースの使用率（メイン表示用）
+        "tokenPercent": usage.get('tokenPercent') or 0,
+        "tokenLimit": usage.get('tokenLimit') or 0,
+        "remainingTokens": usage.get('remainingTokens') or 0,
+        # トークン詳細
+        "tokens": usage.get('tokens') or None,
+        "modelBreakdown": usage.get('modelBreakdown') or None,
+        # 後方互換性のため messagePercent も保持（トークンベースの値）
+        "messagePercent": usage.get('messagePercent') or 0,
+        # レガシー: メッセージベースの情報
+        "legacy": usage.get('legacy') or None,
+        # プラン情報
+        "plan": usage.get('plan') or 'pro',
+        # ウィンドウ情報（リセット機能対応）
+        "windowStart": usage.get('windowStart') or None,
+        "windowEnd": usage.get('windowEnd') or None,
+        "windowHours": usage.get('windowHours') or 5,
+        "timeUntilReset": usage.get('timeUntilReset') or 0,
+        # リセット状態
+        "resetStatus": usage.get('resetStatus') or None
     }
 
+def update_usage_cache(source='scan', workers=1):
+    """
+    使用率を計算して ccusage-cache.json を更新
+
+    Args:
+        source: 集計方法（calculate_message_usage を参照）
+        workers: トランスクリプト走査のワーカープロセス数
+
+    Returns:
+        dict: 書き込んだキャッシュデータ
+    """
+    try:
+        usage = calculate_message_usage_shared(source=source, workers=workers)
+        cache_data = build_cache_data(usage)
+        if _profile is not None:
+            cache_data['perf'] = _profile.report(usage.get('scanStats'))
+    except Exception as e:
+        print(f"Error: Failed to calculate usage: {e}", file=sys.stderr)
+        # エラー時も空のキャッシュを書き込む
+        cache_data = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            "tokenPercent": 0,
+            "tokenLimit": 0,
+            "messagePercent": 0,
+            "error": str(e)
+        }
+
+    try:
+        write_json_atomic(USAGE_CACHE_FILE, cache_data, indent=2)
+    except OSError as e:
+        print(f"Warning: Failed to write usage cache: {e}", file=sys.stderr)
+
+    return cache_data
+
+class InotifyWatcher:
+    """
+    inotify によるログディレクトリの変更監視（Linux のみ）
+
+    ログディレクトリ配下の全ディレクトリを監視し、新しく作られた
+    プロジェクトディレクトリも自動的に監視対象に追加する。
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root):
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = self._get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._dirs = {}
+        self._add_tree(root)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), self.WATCH_MASK)
+        if wd < 0:
+            errno = self._get_errno()
+            print(f"Warning: Failed to watch {path}: {os.strerror(errno)}", file=sys.stderr)
+            return
+        self._dirs[wd] = Path(path)
+
+    def _add_tree(self, root):
+        self._add_watch(root)
+        for dirpath, _, _ in os.walk(root):
+            if Path(dirpath) != Path(root):
+                self._add_watch(dirpath)
+
+    def wait(self, timeout):
+        """
+        トランスクリプトの変更を待つ
+
+        Args:
+            timeout: 最大待ち時間（秒）
+
+        Returns:
+            bool: トランスクリプトが変更されたらTrue（タイムアウト時はFalse）
+        """
+        import select
+
+        changed = False
+        deadline = time.monotonic() + timeout
+
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                break
+            changed = self._read_events()
+
+        return changed
+
+    def drain(self):
+        """溜まっているイベントを読み捨てる（新規ディレクトリの監視追加は行う）"""
+        self._read_events()
+
+    def _read_events(self):
+        changed = False
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, pos)
+                pos += self.EVENT_HEADER.size
+                name = data[pos:pos + name_len].rstrip(b'\0').decode('utf-8', 'replace')
+                pos += name_len
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # キューが溢れた場合は変更ありとして全体を再計算
+                    changed = True
+                elif mask & self.IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                elif mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO) and wd in self._dirs:
+                        # 新しいプロジェクトディレクトリを監視対象に追加
+                        self._add_tree(self._dirs[wd] / name)
+                        changed = True
+                elif is_transcript_name(name):
+                    changed = True
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    stat ポーリングによるログディレクトリの変更監視（inotify が使えない環境用）
+
+    since を指定した場合は集計時の走査と同じく、更新のないディレクトリを stat しない
+    （iter_transcripts 参照）。ポーリングのたびに全履歴を確認しないため。
+    """
+
+    def __init__(self, root, interval=None, since=None):
+        self.root = root
+        self.interval = WATCH_POLL_INTERVAL if interval is None else interval
+        self.since = since
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        since = self.since() if self.since is not None else None
+        for jsonl_file, st in iter_transcripts(self.root, since=since):
+            snapshot[str(jsonl_file)] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        """
+        トランスクリプトの変更を待つ
+
+        Args:
+            timeout: 最大待ち時間（秒）
+
+        Returns:
+            bool: トランスクリプトが変更されたらTrue（タイムアウト時はFalse）
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+
+            snapshot = self._take_snapshot()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                return True
+
+    def drain(self):
+        self._snapshot = self._take_snapshot()
+
+    def close(self):
+        pass
+
+def create_watcher(log_dir, since=None):
+    """
+    利用可能な監視方式でウォッチャーを作成（inotify を優先）
+
+    Args:
+        log_dir: Claude Code のログディレクトリパス
+        since: stat ポーリング時に確認するファイルの更新日時の下限を返す関数（PollingWatcher 参照）
+
+    Returns:
+        InotifyWatcher or PollingWatcher: ウォッチャー
+    """
+    try:
+        return InotifyWatcher(log_dir)
+    except (OSError, AttributeError) as e:
+        print(f"[INFO] inotify が使えないため stat ポーリングで監視します: {e}", file=sys.stderr)
+        return PollingWatcher(log_dir, since=since)
+
+def get_watch_since():
+    """
+    監視するファイルの更新日時の下限（集計時の走査と同じ範囲、get_scan_since 参照）
+
+    Returns:
+        datetime: ウィンドウ開始時刻（リセット後はリセット時刻、状態がなければ5時間前）と
+            rolling ウィンドウの下限の早い方
+    """
+    window_state = get_window_state()
+    if window_state is None:
+        window_start = datetime.now(timezone.utc) - timedelta(hours=FIXED_WINDOW_HOURS)
+    else:
+        window_start = window_state.get('resetTimestamp', window_state['windowStart'])
+    return get_scan_since(window_start, get_bucket_hours(get_usage_windows()))[0]
+
+def catch_up_store(source, log_dir):
+    """
+    イベントストア・列指向ストアに全トランスクリプトを取り込む（--watch の起動時に1回）
+
+    集計ごとの取り込みはウィンドウ内に更新されたファイルのみ確認するため、
+    それより前の履歴はここで取り込む。
+
+    Args:
+        source: 集計方法（'store' / 'columnar' 以外は何もしない）
+        log_dir: Claude Code のログディレクトリパス
+    """
+    if source == 'store':
+        import sqlite3
+
+        try:
+            conn = open_event_store()
+            try:
+                ingest_usage_events(conn, log_dir)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to update event store: {e}", file=sys.stderr)
+    elif source == 'columnar':
+        try:
+            ColumnarUsageStore().ingest(log_dir)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Failed to update columnar store: {e}", file=sys.stderr)
+
+class UsageQueryServer:
+    """
+    Unix ドメインソケットで使用率の問い合わせに答えるサーバー（--serve モード）
+
+    集計結果が更新されるたびに全クエリの応答をあらかじめ組み立てておくため、
+    問い合わせごとの処理は辞書参照とソケットへの書き込みのみで済む。
+    受け付けはバックグラウンドスレッドで行う。
+
+    クライアントはクエリ名を1行送り、サーバーは1行を返して切断する:
+        percent  使用率（%、整数。ウィンドウ終了後は 0）
+        window   ウィンドウ終了時刻（UTC エポック秒、未開始なら空）
+        models   モデル別使用率（例: "opus=12.5 sonnet=3.0"）
+        status   "使用率 ウィンドウ終了時刻"
+        json     ccusage-cache.json と同じ内容（1行の JSON）
+    """
+
+    def __init__(self, socket_path=None):
+        self.socket_path = USAGE_SOCKET_FILE if socket_path is None else socket_path
+        # (ウィンドウ終了時刻, 応答, ウィンドウ終了後の応答) を1つのタプルで差し替える
+        self.state = (None, {}, {})
+        self.sock = None
+
+    def start(self):
+        """
+        ソケットを作成して受け付けを開始
+
+        Returns:
+            bool: 開始できた場合 True（別のサーバーが稼働中の場合は False）
+        """
+        import socket
+        import threading
+
+        path = str(self.socket_path)
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.socket_path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                return False
+            except OSError:
+                # 前回異常終了したサーバーのソケットファイル
+                self.socket_path.unlink()
+            finally:
+                probe.close()
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # 自分以外からは接続させない
+        try:
+            self.sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(USAGE_SOCKET_BACKLOG)
+
+        threading.Thread(target=self._serve, name='usage-query-server', daemon=True).start()
+        return True
+
+    def update(self, cache_data):
+        """
+        最新のキャッシュデータから応答を組み立てる
+
+        Args:
+            cache_data: build_cache_data() の結果
+        """
+        window_end = None
+        if cache_data.get('windowEnd'):
+            try:
+                window_end = int(datetime.fromisoformat(cache_data['windowEnd']).timestamp())
+            except ValueError:
+                window_end = None
+
+        percent = int(cache_data.get('tokenPercent') or cache_data.get('messagePercent') or 0)
+        models = ' '.join(
+            f"{model_key}={model_data['calculatedPercent']}"
+            for model_key, model_data in (cache_data.get('modelBreakdown') or {}).items()
+            if 'calculatedPercent' in model_data
+        )
+        window = '' if window_end is None else str(window_end)
+        data = json.dumps(cache_data)
+
+        def encode(values):
+            return {query: f'{value}\n'.encode('utf-8') for query, value in values.items()}
+
+        responses = encode({
+            'percent': percent, 'window': window, 'models': models,
+            'status': f'{percent} {window}', 'json': data
+        })
+        expired = encode({
+            'percent': 0, 'window': window, 'models': '',
+            'status': f'0 {window}', 'json': data
+        })
+        self.state = (window_end, responses, expired)
+
+    def respond(self, query):
+        """
+        クエリへの応答を返す
+
+        Args:
+            query: クエリ名（str）
+
+        Returns:
+            bytes: 応答
+        """
+        window_end, responses, expired = self.state
+        if window_end is not None and int(time.time()) > window_end:
+            responses = expired
+        return responses.get(query, b'error: unknown query\n')
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return  # close() でソケットが閉じられた
+
+            with conn:
+                try:
+                    conn.settimeout(USAGE_SOCKET_TIMEOUT)
+                    query = conn.recv(64).split(b'\n', 1)[0].strip().decode('ascii', 'replace')
+                    conn.sendall(self.respond(query))
+                except OSError:
+                    continue
+
+    def close(self):
+        import socket
+
+        if self.sock is None:
+            return
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+        try:
+            self.socket_path.unlink()
+        except OSError:
+            pass
+
+def create_query_server():
+    """
+    問い合わせサーバーを起動
+
+    Returns:
+        UsageQueryServer or None: 起動できなかった場合は None（監視のみ続行）
+    """
+    import socket
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Warning: Unix domain sockets are not supported on this platform", file=sys.stderr)
+        return None
+
+    server = UsageQueryServer()
+    try:
+        if not server.start():
+            print(f"[INFO] 問い合わせサーバーは既に起動しています: {server.socket_path}", file=sys.stderr)
+            return None
+    except OSError as e:
+        print(f"Warning: Failed to start query server: {e}", file=sys.stderr)
+        return None
+
+    print(f"[INFO] 問い合わせサーバーを起動: {server.socket_path}", file=sys.stderr)
+    return server
+
+def watch_usage(source='scan', workers=1, serve=False, profile=False):
+    """
+    ログディレクトリを監視し、トランスクリプトが更新されるたびに ccusage-cache.json を書き換える
+
+    変更がない場合も WATCH_MAX_INTERVAL ごとに再計算する（ウィンドウのリセット判定用）。
+    起動元のプロセス（daemon）が終了した場合は監視を終了する。
+    store / columnar では起動時に全トランスクリプトを取り込む（catch_up_store 参照）。
+
+    Args:
+        source: 集計方法（calculate_message_usage を参照）
+        workers: トランスクリプト走査のワーカープロセス数
+        serve: True なら USAGE_SOCKET_FILE で問い合わせにも答える
+        profile: True なら再計算ごとにフェーズ別の所要時間を stderr に1行の JSON で出力する
+    """
+    log_dir = get_log_directory()
+    parent_pid = os.getppid()
+    server = create_query_server() if serve else None
+
+    def refresh():
+        if profile:
+            start_profile()
+        cache_data = update_usage_cache(source, workers)
+        if server is not None:
+            server.update(cache_data)
+        if 'perf' in cache_data:
+            print(f"[PERF] {json.dumps(cache_data['perf'], separators=(',', ':'))}", file=sys.stderr, flush=True)
+
+    try:
+        # ログディレクトリができるまで待機
+        while not log_dir.exists():
+            refresh()
+            time.sleep(WATCH_MAX_INTERVAL)
+
+        catch_up_store(source, log_dir)
+        watcher = create_watcher(log_dir, since=get_watch_since)
+        print(f"[INFO] ログディレクトリの監視を開始: {log_dir} ({type(watcher).__name__})", file=sys.stderr)
+
+        try:
+            while os.getppid() == parent_pid:
+                refresh()
+
+                if watcher.wait(WATCH_MAX_INTERVAL):
+                    # 連続する書き込み（ストリーミング中の複数行）をまとめて処理
+                    time.sleep(WATCH_DEBOUNCE)
+                    watcher.drain()
+        finally:
+            watcher.close()
+    finally:
+        if server is not None:
+            server.close()
+
+def format_model_display_name(model_name):
+    """モデル名を表示用にフォーマット（例: claude-opus-4-5-20251101 → Opus 4.5）"""
+    model_lower = model_name.lower()
+    if 'opus' in model_lower:
+        return 'Opus 4.5'
+    elif 'sonnet' in model_lower:
+        return 'Sonnet 4.5'
+    elif 'haiku' in model_lower:
+        return 'Haiku'
+    # 不明なモデルの場合はそのまま表示
+    return model_name
+
+def find_git_branch(start=None):
+    """
+    カレントディレクトリの Git ブランチ名を取得（git コマンドを起動せず .git/HEAD を直接読む）
+
+    Args:
+        start: 探索を開始するディレクトリ（デフォルト: カレントディレクトリ）
+
+    Returns:
+        str: ブランチ名（リポジトリ外・detached HEAD の場合は空文字）
+    """
+    start = Path.cwd() if start is None else Path(start)
+
+    for directory in (start, *start.parents):
+        git_path = directory / '.git'
+        try:
+            if git_path.is_dir():
+                head_file = git_path / 'HEAD'
+            elif git_path.is_file():
+                # worktree / submodule（.git ファイルに gitdir が書かれている）
+                gitdir = git_path.read_text(encoding='utf-8').strip()
+                if not gitdir.startswith('gitdir:'):
+                    return ''
+                head_file = directory / gitdir[len('gitdir:'):].strip() / 'HEAD'
+            else:
+                continue
+
+            head = head_file.read_text(encoding='utf-8').strip()
+        except OSError:
+            return ''
+
+        if head.startswith('ref: refs/heads/'):
+            return head[len('ref: refs/heads/'):]
+        return ''
+
+    return ''
+
+def percent_color(percent):
+    """使用率から表示色を決定（50%未満: 緑、80%未満: 黄、それ以上: 赤）"""
+    if percent < 50:
+        return ANSI_GREEN
+    elif percent < 80:
+        return ANSI_YELLOW
+    return ANSI_RED
+
+def read_json_file(path):
+    """JSON ファイルを読み込む（存在しない・壊れている場合は None）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def render_statusline(data, now=None):
+    """
+    ステータスラインの1行を作成（status-line.sh と同じ表示）
+
+    Args:
+        data: Claude Code が標準入力に渡す JSON
+        now: 現在時刻（UTC エポック秒、デフォルト: 現在時刻）
+
+    Returns:
+        str: ANSI カラー付きの表示文字列
+    """
+    if now is None:
+        now = time.time()
+
+    workspace = data.get('workspace') or {}
+    dir_name = os.path.basename(str(workspace.get('current_dir') or '.')) or '.'
+
+    # モデル情報はトランスクリプトから直接取得（/model 切り替えを反映するため）
+    model = 'Unknown'
+    transcript_path = data.get('transcript_path')
+    if transcript_path and os.path.isfile(transcript_path):
+        raw_model = find_latest_model(transcript_path)
+        if raw_model:
+            model = format_model_display_name(raw_model)
+    if model == 'Unknown':
+        model = (data.get('model') or {}).get('display_name') or 'Unknown'
+
+    parts = [f'[{ANSI_CYAN}{model}{ANSI_RESET}] [DIR:{dir_name}]']
+
+    branch = find_git_branch()
+    if branch:
+        parts.append(f'{ANSI_GREEN}{branch}{ANSI_RESET}')
+
+    # コンテキスト使用率
+    context_window = data.get('context_window') or {}
+    context_size = context_window.get('context_window_size') or 0
+    current_usage = context_window.get('current_usage')
+    if current_usage and isinstance(context_size, int) and context_size > 0:
+        current_tokens = sum(
+            current_usage.get(field) or 0
+            for field in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+        )
+        context_percent = current_tokens * 100 // context_size
+        parts.append(f'Ctx:{percent_color(context_percent)}{context_percent}%{ANSI_RESET}')
+
+    # Session 使用率（24時間以内に更新されたキャッシュのみ）
+    try:
+        session_fresh = now - STATUSLINE_SESSION_CACHE.stat().st_mtime < STATUSLINE_SESSION_MAX_AGE
+    except OSError:
+        session_fresh = False
+    if session_fresh:
+        session = (read_json_file(STATUSLINE_SESSION_CACHE) or {}).get('session') or {}
+        utilization = session.get('utilization') or 0
+        if utilization:
+            session_percent = int(f'{utilization * 100:.0f}')
+            parts.append(f'Session:{percent_color(session_percent)}{session_percent}%{ANSI_RESET}')
+
+    # 5時間ウィンドウの使用率（ウィンドウ終了後は 0%）
+    usage_cache = read_json_file(USAGE_CACHE_FILE)
+    if isinstance(usage_cache, dict):
+        token_percent = usage_cache.get('tokenPercent')
+        if token_percent is None:
+            token_percent = usage_cache.get('messagePercent') or 0
+
+        window_end = usage_cache.get('windowEnd')
+        if window_end:
+            try:
+                if now > datetime.fromisoformat(window_end.replace('Z', '+00:00')).timestamp():
+                    token_percent = 0
+            except ValueError:
+                pass
+
+        parts.append(f'5h:{percent_color(token_percent)}{token_percent}%{ANSI_RESET}')
+
+    return ' | '.join(parts)
+
+def print_statusline():
+    """
+    標準入力の JSON からステータスラインを描画して出力
+
+    描画に STATUSLINE_BUDGET_MS 以上かかった場合は stderr に警告を出す
+    （インタプリタの起動時間は含まない）。
+    """
+    started = time.perf_counter()
+
+    try:
+        data = json.load(sys.stdin)
+        if not isinstance(data, dict):
+            data = {}
+    except ValueError:
+        data = {}
+
+    sys.stdout.write(render_statusline(data) + '\n')
+    sys.stdout.flush()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms > STATUSLINE_BUDGET_MS:
+        print(f"Warning: Status line took {elapsed_ms:.1f} ms (budget: {STATUSLINE_BUDGET_MS:.0f} ms)",
+              file=sys.stderr)
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description='Claude Code メッセージ使用率計算')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--store', dest='source', action='store_const', const='store', default='scan',
+                        help=f'SQLite イベントストア（{EVENT_STORE_FILE}）経由で集計する')
+    source.add_argument('--columnar', dest='source', action='store_const', const='columnar',
+                        help=f'列指向ストア（{COLUMNAR_DIR}）経由で集計する（NumPy があれば memmap で集計）')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='トランスクリプトを N プロセスで並列に走査する（0: CPU数、デフォルト: 1）')
+    parser.add_argument('--watch', action='store_true',
+                        help=f'常駐してログの変更を監視し、{USAGE_CACHE_FILE} を更新し続ける')
+    parser.add_argument('--serve', action='store_true',
+                        help=f'--watch に加え、{USAGE_SOCKET_FILE} で使用率の問い合わせに答える')
+    parser.add_argument('--history', action='store_true',
+                        help='終了したウィンドウ・日別合計・モデル構成比をロールアップから出力する'
+                             '（--store を併用すると先に追記分を取り込む）')
+    parser.add_argument('--days', type=int, default=HISTORY_DAYS, metavar='N',
+                        help=f'--history で集計する日数（デフォルト: {HISTORY_DAYS}）')
+    parser.add_argument('--profile', action='store_true',
+                        help='出力にフェーズ別の所要時間とカウンター（perf）を追加する'
+                             '（--watch / --serve では再計算ごとに stderr へ出力）')
+    parser.add_argument('--statusline', action='store_true',
+                        help='標準入力の JSON からステータスラインを描画する（status-line.sh と同じ表示）')
+    parser.add_argument('--latest-model', metavar='TRANSCRIPT',
+                        help='トランスクリプト末尾から最新の assistant 応答のモデル名を出力する')
+    parser.add_argument('--compact', action='store_true',
+                        help='終了したセッションごとに集計に使うフィールドだけのサイドカー'
+                             f'（*{COMPACT_SUFFIX}）を作り、以降の走査ではそちらを読む')
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error('--workers には 0 以上を指定してください')
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    if args.days < 1:
+        parser.error('--days には 1 以上を指定してください')
+    return args
+
 def main():
     """メイン処理"""
+    args = parse_args()
+
+    if args.statusline:
+        print_statusline()
+        sys.exit(0)
+
+    if args.latest_model is not None:
+        model_name = find_latest_model(args.latest_model)
+        if model_name:
+            print(model_name)
+        sys.exit(0 if model_name else 1)
+
+    if args.compact:
+        print(json.dumps(compact_transcripts(get_log_directory()), indent=2))
+        sys.exit(0)
+
+    if args.history:
+        import sqlite3
+
+        try:
+            print(json.dumps(build_usage_history(args.days, ingest=args.source == 'store'), indent=2))
+        except sqlite3.Error as e:
+            print(json.dumps({"error": str(e)}, indent=2))
+            sys.exit(2)
+        sys.exit(0)
+
+    if args.watch or args.serve:
+        # daemon からの終了要求（SIGTERM）でもソケットファイル等を片付けてから終了
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            watch_usage(source=args.source, workers=args.workers, serve=args.serve, profile=args.profile)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     try:
         # メッセージ使用率を計算
-        usage = calculate_message_usage()
+        profile = start_profile() if args.profile else None
+        usage = calculate_message_usage_shared(source=args.source, workers=args.workers)
+        if profile is not None:
+            usage['perf'] = profile.report(usage.get('scanStats'))
 
         # JSON形式で出力
         print(json.dumps(usage, indent=2))
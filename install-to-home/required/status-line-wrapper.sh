@@ -1,10 +1,7 @@
 #!/bin/bash
 # Claude Code ステータスライン ラッパースクリプト
 # OS を自動判定して適切なスクリプトを呼び出す
-
-# 標準入力を一時ファイルに保存（両OS で使用するため）
-TEMP_INPUT=$(mktemp)
-cat > "$TEMP_INPUT"
+# （標準入力はそのまま引き継ぐため、一時ファイルは作らない）
 
 # OS 判定
 OS_TYPE=$(uname -s)
@@ -13,16 +10,22 @@ case "$OS_TYPE" in
   MINGW* | MSYS* | CYGWIN*)
     # Windows (Git Bash)
     # PowerShell を呼び出して標準入力を渡す
-    cat "$TEMP_INPUT" | powershell.exe -NoProfile -ExecutionPolicy Bypass -File "$HOME/.claude/status-line.ps1"
+    exec powershell.exe -NoProfile -ExecutionPolicy Bypass -File "$HOME/.claude/status-line.ps1"
     ;;
   Darwin | Linux)
     # macOS / Linux
-    cat "$TEMP_INPUT" | bash "$HOME/.claude/status-line.sh"
+    # Python があれば1プロセスで描画（jq などを起動しない）、なければシェル版を使用
+    if command -v python3 > /dev/null 2>&1; then
+      USAGE_SCRIPT="$HOME/.claude/get-message-usage.py"
+      # zipapp（tools/build-zipapp.py で作成）がスクリプトより新しければバイトコード済みのそちらを使う
+      if [ "$HOME/.claude/get-message-usage.pyz" -nt "$USAGE_SCRIPT" ]; then
+        USAGE_SCRIPT="$HOME/.claude/get-message-usage.pyz"
+      fi
+      exec python3 "$USAGE_SCRIPT" --statusline
+    fi
+    exec bash "$HOME/.claude/status-line.sh"
     ;;
   *)
     echo "Unknown OS: $OS_TYPE"
     ;;
 esac
-
-# 一時ファイル削除
-rm -f "$TEMP_INPUT"
@@ -109,57 +109,49 @@ if [ -f "$CACHE_FILE" ]; then
     fi
 fi
 
-# 5時間ウィンドウのトークン使用状況をキャッシュから取得
+# 5時間ウィンドウのトークン使用状況を取得
+# get-message-usage.py --serve のソケットに直接問い合わせる
+# （応答は整数の使用率そのものなので jq は通さない。ウィンドウ終了後は 0）
 TOKEN_INFO=""
-# キャッシュファイルのパス（ホームディレクトリ配下の .claude/cache/ を使用）
+TOKEN_PERCENT=""
+USAGE_SOCKET="$HOME/.claude/cache/usage.sock"
 USAGE_CACHE="$HOME/.claude/cache/ccusage-cache.json"
 
-if [ -f "$USAGE_CACHE" ]; then
-    # キャッシュファイルが存在する場合
-    # windowEnd を確認して、5時間ウィンドウが終了しているかチェック
-    WINDOW_END=$(jq -r '.windowEnd // ""' "$USAGE_CACHE" 2>/dev/null)
-
-    # ウィンドウ終了判定
-    WINDOW_EXPIRED=false
-    if [ -n "$WINDOW_END" ] && [ "$WINDOW_END" != "null" ]; then
-        # windowEnd を Unix タイムスタンプに変換
-        # タイムゾーン情報とミリ秒を除去してUTCとして扱う
-        WINDOW_END_CLEAN="${WINDOW_END%%+*}"  # +00:00 を削除
-        WINDOW_END_CLEAN="${WINDOW_END_CLEAN%%Z*}"  # Z を削除（ISO 8601形式対応）
-        WINDOW_END_CLEAN="${WINDOW_END_CLEAN%%.*}"  # ミリ秒を削除
-        # date コマンドの互換性対応（GNU date vs BSD date）
-        # -u オプションで UTC として明示的に扱う
-        WINDOW_END_EPOCH=$(date -u -d "$WINDOW_END_CLEAN" +%s 2>/dev/null || date -u -j -f "%Y-%m-%dT%H:%M:%S" "$WINDOW_END_CLEAN" +%s 2>/dev/null || echo 0)
-        CURRENT_EPOCH=$(date -u +%s)
-
-        if [ "$WINDOW_END_EPOCH" -gt 0 ] && [ "$CURRENT_EPOCH" -gt "$WINDOW_END_EPOCH" ]; then
-            WINDOW_EXPIRED=true
-        fi
-    fi
+if [ -S "$USAGE_SOCKET" ] && command -v nc > /dev/null 2>&1; then
+    TOKEN_PERCENT=$(printf 'percent\n' | nc -U "$USAGE_SOCKET" 2>/dev/null)
+    case "$TOKEN_PERCENT" in
+        ''|*[!0-9]*) TOKEN_PERCENT="" ;;
+    esac
+fi
 
-    if [ "$WINDOW_EXPIRED" = true ]; then
-        # ウィンドウが終了している場合は 0% を表示（緑色）
-        TOKEN_INFO=" | 5h:\033[32m0%\033[0m"
-    else
-        # トークンベースの使用率を取得（tokenPercent を優先、なければ messagePercent を使用）
-        TOKEN_PERCENT=$(jq -r '.tokenPercent // .messagePercent // 0' "$USAGE_CACHE" 2>/dev/null)
-
-        if [ -n "$TOKEN_PERCENT" ] && [ "$TOKEN_PERCENT" != "null" ]; then
-            # 使用率から色を決定
-            # 50%未満 → 緑
-            # 50-80% → 黄色
-            # 80%以上 → 赤
-            if [ "$TOKEN_PERCENT" -ge 80 ] 2>/dev/null; then
-                TOKEN_COLOR="\033[31m"  # 赤
-            elif [ "$TOKEN_PERCENT" -ge 50 ] 2>/dev/null; then
-                TOKEN_COLOR="\033[33m"  # 黄
-            else
-                TOKEN_COLOR="\033[32m"  # 緑
-            fi
+# サーバー未起動時はキャッシュから jq 1 回で取得
+# ウィンドウ終了時刻を過ぎた（現在時刻 > 終了時刻）場合は 0
+if [ -z "$TOKEN_PERCENT" ] && [ -f "$USAGE_CACHE" ]; then
+    TOKEN_PERCENT=$(jq -r --argjson now "$(date -u +%s)" '
+        (.windowEnd // "") as $window_end_iso
+        | (if $window_end_iso == "" then null
+           else $window_end_iso | sub("\\.[0-9]+"; "") | sub("(\\+00:00|Z)$"; "Z") | fromdateiso8601
+           end) as $window_end
+        | if $window_end != null and $now > $window_end then 0
+          else (.tokenPercent // .messagePercent // 0)
+          end
+    ' "$USAGE_CACHE" 2>/dev/null)
+fi
 
-            TOKEN_INFO=" | 5h:${TOKEN_COLOR}${TOKEN_PERCENT}%\033[0m"
-        fi
+if [ -n "$TOKEN_PERCENT" ]; then
+    # 使用率から色を決定
+    # 50%未満 → 緑
+    # 50-80% → 黄色
+    # 80%以上 → 赤
+    if [ "$TOKEN_PERCENT" -ge 80 ] 2>/dev/null; then
+        TOKEN_COLOR="\033[31m"  # 赤
+    elif [ "$TOKEN_PERCENT" -ge 50 ] 2>/dev/null; then
+        TOKEN_COLOR="\033[33m"  # 黄
+    else
+        TOKEN_COLOR="\033[32m"  # 緑
     fi
+
+    TOKEN_INFO=" | 5h:${TOKEN_COLOR}${TOKEN_PERCENT}%\033[0m"
 fi
 
 echo -e "[\033[36m$MODEL\033[0m] [DIR:$DIR_NAME]$GIT_BRANCH$CONTEXT_INFO$USAGE_INFO$TOKEN_INFO"
@@ -0,0 +1,58 @@
+#!/bin/bash
+# 使用率の問い合わせクライアント
+#
+# get-message-usage.py --serve（ccusage-daemon.mjs が起動）のソケットに問い合わせる。
+# サーバーが起動していない場合は ccusage-cache.json から同じ形式で値を返す。
+#
+# 使い方: usage-query.sh [percent|window|models|status|json]
+#   percent  使用率（%、整数。ウィンドウ終了後は 0）
+#   window   ウィンドウ終了時刻（UTC エポック秒）
+#   models   モデル別使用率（例: "opus=12.5 sonnet=3.0"）
+#   status   "使用率 ウィンドウ終了時刻"（デフォルト）
+#   json     キャッシュの内容
+
+QUERY="${1:-status}"
+USAGE_SOCKET="$HOME/.claude/cache/usage.sock"
+USAGE_CACHE="$HOME/.claude/cache/ccusage-cache.json"
+
+# ソケット経由（サーバーがメモリ上の集計結果から即座に応答）
+if [ -S "$USAGE_SOCKET" ] && command -v nc > /dev/null 2>&1; then
+    RESPONSE=$(printf '%s\n' "$QUERY" | nc -U "$USAGE_SOCKET" 2>/dev/null)
+    if [ -n "$RESPONSE" ] || [ "$QUERY" = "models" ]; then
+        case "$RESPONSE" in
+            error:*) exit 1 ;;
+        esac
+        [ -n "$RESPONSE" ] && printf '%s\n' "$RESPONSE"
+        exit 0
+    fi
+fi
+
+# フォールバック: キャッシュファイルから取得
+[ -f "$USAGE_CACHE" ] || exit 1
+
+if [ "$QUERY" = "json" ]; then
+    jq -c . "$USAGE_CACHE" 2>/dev/null
+    exit $?
+fi
+
+jq -r --arg q "$QUERY" --argjson now "$(date -u +%s)" '
+    # ISO 8601（+00:00 / Z、小数秒付き）を UTC エポック秒に変換
+    def epoch:
+        if . == null or . == "" then null
+        else sub("\\.[0-9]+"; "") | sub("(\\+00:00|Z)$"; "Z") | fromdateiso8601
+        end;
+    (.windowEnd | epoch) as $window_end
+    | ($window_end != null and $now > $window_end) as $expired
+    | (if $expired then 0 else (.tokenPercent // .messagePercent // 0) end) as $percent
+    | if $q == "percent" then $percent
+      elif $q == "window" then ($window_end // "")
+      elif $q == "models" then
+          if $expired then empty
+          else [(.modelBreakdown // {}) | to_entries[]
+                | select(.value.calculatedPercent != null)
+                | "\(.key)=\(.value.calculatedPercent)"] | join(" ")
+          end
+      elif $q == "status" then "\($percent) \($window_end // "")"
+      else error("unknown query")
+      end
+' "$USAGE_CACHE" 2>/dev/null
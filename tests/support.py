@@ -0,0 +1,153 @@
+"""
+テスト共通のヘルパー
+
+一時ディレクトリを HOME として get-message-usage.py を別プロセスで実行し、
+手書きのトランスクリプト（JSONL）から集計結果を確認します。
+"""
+
+import functools
+import importlib.util
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+REQUIRED_DIR = REPO_ROOT / 'install-to-home' / 'required'
+SCRIPT = REQUIRED_DIR / 'get-message-usage.py'
+CONFIG_FILES = ('model-calibration.json', 'usage-calibration.json')
+ENGINE_TIMEOUT = 120  # ロック待ちなどで止まった場合に失敗させる（秒）
+
+SONNET = 'claude-sonnet-4-5-20250929'
+HAIKU = 'claude-haiku-4-5-20251001'
+OPUS = 'claude-opus-4-1-20250805'
+
+_ids = itertools.count(1)
+
+
+def isoformat(ts):
+    """トランスクリプトと同じ形式（ミリ秒・Z 付き）のタイムスタンプ"""
+    return ts.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f'{ts.microsecond // 1000:03d}Z'
+
+
+def assistant_event(ts, model=SONNET, input_tokens=100, output_tokens=50, cache_creation=0, cache_read=0,
+                    parent_uuid=None, session_id='session-1', uuid=None, message_id=None, request_id=None):
+    """usage を含むアシスタント応答のイベント（ID は省略時に一意の値を振る）"""
+    n = next(_ids)
+    return {
+        'type': 'assistant',
+        'uuid': uuid or f'a-{n}',
+        'parentUuid': parent_uuid,
+        'sessionId': session_id,
+        'requestId': request_id or f'req-{n}',
+        'timestamp': isoformat(ts),
+        'message': {
+            'id': message_id or f'msg-{n}',
+            'model': model,
+            'usage': {
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'cache_creation_input_tokens': cache_creation,
+                'cache_read_input_tokens': cache_read
+            }
+        }
+    }
+
+
+def user_event(ts, text='hello', uuid=None, session_id='session-1'):
+    """テキスト入力のユーザーメッセージのイベント"""
+    return {
+        'type': 'user',
+        'uuid': uuid or f'u-{next(_ids)}',
+        'sessionId': session_id,
+        'timestamp': isoformat(ts),
+        'message': {'role': 'user', 'content': text}
+    }
+
+
+def encode_events(events):
+    return ''.join(json.dumps(event) + '\n' for event in events).encode('utf-8')
+
+
+def write_transcript(home, project, session, events, append=False):
+    """~/.claude/projects/<project>/<session>.jsonl にイベントを書き込む（append で追記）"""
+    path = home / '.claude' / 'projects' / project / f'{session}.jsonl'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'ab' if append else 'wb') as f:
+        f.write(encode_events(events))
+    return path
+
+
+def touch(path, seconds=1):
+    """mtime を進める（同じサイズの書き換えを mtime の分解能に関係なく検出させる）"""
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 1_000_000_000))
+
+
+def write_window_state(home, window_start):
+    """ウィンドウ状態（usage-window.json）を書き込む"""
+    state = {'windowStart': window_start.isoformat(), 'firstMessageTimestamp': window_start.isoformat()}
+    (home / '.claude' / 'usage-window.json').write_text(json.dumps(state), encoding='utf-8')
+
+
+@functools.lru_cache(maxsize=None)
+def load_engine():
+    """get-message-usage.py をモジュールとして読み込む（ファイル名にハイフンを含むため importlib を使う）"""
+    spec = importlib.util.spec_from_file_location('get_message_usage', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_engine(home, *args, env=None):
+    """HOME を切り替えて get-message-usage.py を実行し、出力の JSON を返す"""
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), *args],
+        env={**os.environ, 'HOME': str(home), **(env or {})}, capture_output=True, text=True,
+        timeout=ENGINE_TIMEOUT
+    )
+    # 終了コード 1 は使用率 80% 以上の警告
+    if result.returncode not in (0, 1):
+        raise AssertionError(f'{" ".join(args) or "scan"} failed ({result.returncode}):\n{result.stderr}{result.stdout}')
+    return json.loads(result.stdout)
+
+
+class EngineTestCase(unittest.TestCase):
+    """テストごとに空の HOME（~/.claude/projects とプラン設定）を用意する"""
+
+    plan = 'max-200'
+
+    def setUp(self):
+        self.home = Path(tempfile.mkdtemp(prefix='usage-home-'))
+        self.addCleanup(shutil.rmtree, self.home, True)
+        (self.home / '.claude' / 'projects').mkdir(parents=True)
+        for name in CONFIG_FILES:
+            shutil.copy(REQUIRED_DIR / name, self.home / '.claude' / name)
+        (self.home / '.claude' / 'usage-config.json').write_text(
+            json.dumps({'plan': self.plan}), encoding='utf-8')
+        self.now = datetime.now(timezone.utc)
+        self.window_start = self.now - timedelta(hours=1)
+        write_window_state(self.home, self.window_start)
+
+    def minutes_ago(self, minutes):
+        return self.now - timedelta(minutes=minutes)
+
+    def run_engine(self, *args, **kwargs):
+        # 実行のたびに firstMessageTimestamp などが更新されるため、ウィンドウ状態を揃える
+        write_window_state(self.home, self.window_start)
+        return run_engine(self.home, *args, **kwargs)
+
+    def cold_run(self, *args):
+        """チェックポイントなどのキャッシュを消して全件を集計し直した結果"""
+        shutil.rmtree(self.home / '.claude' / 'cache', ignore_errors=True)
+        return self.run_engine(*args)
+
+    def assertTokensEqual(self, expected, actual):
+        self.assertEqual(expected['tokens'], actual['tokens'])
+        self.assertEqual(expected['modelBreakdown'], actual['modelBreakdown'])
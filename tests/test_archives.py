@@ -0,0 +1,77 @@
+"""圧縮済みトランスクリプト（.jsonl.gz / .jsonl.zst）の集計のテスト"""
+import gzip
+import os
+import subprocess
+import sys
+import unittest
+
+from tests.support import (ENGINE_TIMEOUT, SCRIPT, EngineTestCase, HAIKU, assistant_event, encode_events, load_engine,
+                           write_transcript)
+
+BACKENDS = ([], ['--store'], ['--columnar'], ['--workers', '2'])
+
+
+class ArchiveTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_transcript(self.home, 'p', 'live', [assistant_event(self.minutes_ago(10), input_tokens=100)])
+        self.archived_events = [
+            assistant_event(self.minutes_ago(40), input_tokens=200, session_id='archived'),
+            assistant_event(self.minutes_ago(30), model=HAIKU, input_tokens=300, session_id='archived')
+        ]
+
+    def archive_path(self, suffix):
+        return self.home / '.claude' / 'projects' / 'p' / f'archived.jsonl{suffix}'
+
+    def assertInputTokens(self, expected):
+        for args in BACKENDS:
+            with self.subTest(backend=args):
+                result = self.cold_run(*args)
+                self.assertEqual(result['tokens']['raw']['input'], expected)
+
+    def test_gzip_archive(self):
+        self.archive_path('.gz').write_bytes(gzip.compress(encode_events(self.archived_events)))
+        self.assertInputTokens(600)
+        self.assertIn('haiku', self.cold_run()['modelBreakdown'])
+
+    def test_gzip_archive_without_trailing_newline(self):
+        """アーカイブは書き込み途中にならないため、改行で終わらない末尾の行も数える"""
+        self.archive_path('.gz').write_bytes(gzip.compress(encode_events(self.archived_events).rstrip(b'\n')))
+        self.assertInputTokens(600)
+
+    def test_corrupt_archive_is_skipped(self):
+        """途中で切れたアーカイブは警告を出して除き、他のファイルは集計する"""
+        data = gzip.compress(encode_events(self.archived_events))
+        self.archive_path('.gz').write_bytes(data[:len(data) // 2])
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT)], env={**os.environ, 'HOME': str(self.home)},
+            capture_output=True, text=True, timeout=ENGINE_TIMEOUT
+        )
+        self.assertIn('archived.jsonl.gz', result.stderr)
+        self.assertEqual(self.run_engine()['tokens']['raw']['input'], 100)
+
+    def test_compressed_after_counting(self):
+        """集計済みのセッションを圧縮しても二重に数えない"""
+        plain = write_transcript(self.home, 'p', 'archived', self.archived_events)
+        self.assertEqual(self.run_engine()['tokens']['raw']['input'], 600)
+
+        self.archive_path('.gz').write_bytes(gzip.compress(plain.read_bytes()))
+        plain.unlink()
+        self.assertEqual(self.run_engine()['tokens']['raw']['input'], 600)
+
+    def test_zstd_archive(self):
+        if load_engine().load_zstd() is None:
+            self.skipTest('zstd を展開できない環境（Python 3.14+ または zstandard が必要）')
+        try:
+            from compression.zstd import compress
+        except ImportError:
+            import zstandard
+            compress = zstandard.ZstdCompressor().compress
+
+        self.archive_path('.zst').write_bytes(compress(encode_events(self.archived_events)))
+        self.assertInputTokens(600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""プロジェクト・セッション別の上位（usageBreakdown）のテスト"""
+import unittest
+
+from tests.support import EngineTestCase, assistant_event, load_engine, user_event, write_transcript
+
+BACKENDS = ([], ['--store'], ['--columnar'], ['--workers', '2'])
+
+
+class UsageBreakdownTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # プロジェクトごとの入力トークン数（セッションごと）
+        self.sizes = {'project-a': [100, 700], 'project-b': [300, 200, 900], 'project-c': [400, 500]}
+        for project, sizes in self.sizes.items():
+            for index, size in enumerate(sizes):
+                session = f'{project}-s{index}'
+                write_transcript(self.home, project, session, [
+                    user_event(self.minutes_ago(40), session_id=session),
+                    assistant_event(self.minutes_ago(30), input_tokens=size, session_id=session)
+                ])
+
+    def test_top_sessions_and_projects(self):
+        breakdown = self.cold_run()['usageBreakdown']
+        self.assertEqual(breakdown['activeProjects'], 3)
+        self.assertEqual(breakdown['activeSessions'], 7)
+        self.assertEqual([s['session'] for s in breakdown['sessions']],
+                         ['project-b-s2', 'project-a-s1', 'project-c-s1', 'project-c-s0', 'project-b-s0'])
+        self.assertEqual([(p['project'], p['sessions'], p['rawTokens']) for p in breakdown['projects']],
+                         [('project-b', 3, 1550), ('project-c', 2, 1000), ('project-a', 2, 900)])
+        self.assertEqual(breakdown['projects'][0]['messages'], 3)
+        self.assertAlmostEqual(sum(p['weightedRatio'] for p in breakdown['projects']), 100, delta=0.5)
+
+    def test_backends_and_warm_run_agree(self):
+        expected = self.cold_run()['usageBreakdown']
+        self.assertEqual(self.run_engine()['usageBreakdown'], expected)
+        for args in BACKENDS:
+            with self.subTest(backend=args):
+                self.assertEqual(self.cold_run(*args)['usageBreakdown'], expected)
+
+
+class UsageBreakdownUnitTest(unittest.TestCase):
+
+    def test_keeps_only_top_k(self):
+        engine = load_engine()
+        breakdown = engine.UsageBreakdown('/logs', top_k=2)
+        for path, weighted in (('/logs/a/1.jsonl', 10), ('/logs/a/2.jsonl', 40), ('/logs/b/1.jsonl', 30),
+                               ('/logs/c/1.jsonl', 20), ('/logs/c/2.jsonl', 25)):
+            breakdown.add(path, weighted, weighted, 1, 1)
+        report = breakdown.report()
+        self.assertEqual((report['activeProjects'], report['activeSessions']), (3, 5))
+        self.assertEqual([p['project'] for p in report['projects']], ['a', 'c'])
+        self.assertEqual([(s['project'], s['session']) for s in report['sessions']], [('a', '2'), ('b', '1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
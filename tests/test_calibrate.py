@@ -0,0 +1,84 @@
+"""claude-calibrate.py --fit（非負の最小二乗による当てはめ）のテスト"""
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+
+from tests.support import (ENGINE_TIMEOUT, REQUIRED_DIR, SCRIPT, EngineTestCase, assistant_event, isoformat,
+                           write_transcript)
+
+CALIBRATE_SCRIPT = REQUIRED_DIR / 'claude-calibrate.py'
+
+
+def load_calibrate():
+    spec = importlib.util.spec_from_file_location('claude_calibrate', CALIBRATE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class NonNegativeLeastSquaresTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calibrate = load_calibrate()
+
+    def assertVectorAlmostEqual(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, places=6)
+
+    def test_matches_least_squares_when_feasible(self):
+        rows = [[1, 0], [0, 1], [1, 1], [2, 1]]
+        target = [row[0] * 3 + row[1] * 0.5 for row in rows]
+        self.assertVectorAlmostEqual([3, 0.5], self.calibrate.solve_nonnegative(rows, target))
+
+    def test_clamps_negative_coefficient(self):
+        """制約なしの解が負になる変数は 0 にし、残りの変数で当てはめ直す"""
+        rows = [[1, 1], [1, 2], [1, 3]]
+        target = [3, 2, 1]
+        self.assertVectorAlmostEqual([4, -1], self.calibrate.solve_least_squares(rows, target))
+        self.assertVectorAlmostEqual([2, 0], self.calibrate.solve_nonnegative(rows, target))
+
+    def test_fit_drops_zero_columns(self):
+        columns = {'a': [1000, 2000, 3000], 'b': [3000, 2000, 1000], 'empty': [0, 0, 0]}
+        solution = self.calibrate.fit_nonnegative(columns, [1, 2, 3])
+        self.assertEqual(list(solution), ['a'])
+        self.assertAlmostEqual(solution['a'], 0.001)
+
+
+class FitTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        shutil.copy(SCRIPT, self.home / '.claude' / SCRIPT.name)
+        write_transcript(self.home, 'p', 's', [
+            assistant_event(self.minutes_ago(30), input_tokens=100000),
+            assistant_event(self.minutes_ago(10), input_tokens=100000)
+        ])
+        self.readings = self.home / 'readings.csv'
+        self.readings.write_text(f'{isoformat(self.minutes_ago(20))},10\n{isoformat(self.minutes_ago(1))},20\n',
+                                 encoding='utf-8')
+
+    def run_fit(self, *args):
+        result = subprocess.run(
+            [sys.executable, str(CALIBRATE_SCRIPT), '--fit', str(self.readings), *args],
+            env={**os.environ, 'HOME': str(self.home)}, capture_output=True, text=True, timeout=ENGINE_TIMEOUT
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads((self.home / '.claude' / 'model-calibration.json').read_text(encoding='utf-8'))
+
+    def test_dry_run_keeps_calibration(self):
+        before = json.loads((REQUIRED_DIR / 'model-calibration.json').read_text(encoding='utf-8'))
+        self.assertEqual(self.run_fit('--dry-run'), before)
+
+    def test_fitted_limit_reproduces_readings(self):
+        calibration = self.run_fit()
+        self.assertGreater(calibration['models']['sonnet-4.5']['limit'], 0)
+        self.assertAlmostEqual(self.run_engine()['modelPercents']['sonnet'], 20, delta=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
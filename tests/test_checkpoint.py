@@ -0,0 +1,102 @@
+"""
+チェックポイント（usage-checkpoint.json）による差分集計のテスト
+
+追記・書き込み途中の行・書き換え・ウィンドウの変更の後も、
+チェックポイントを使った集計がキャッシュなしの全件集計と一致することを確認します。
+"""
+
+import json
+import unittest
+
+from tests.support import (EngineTestCase, HAIKU, assistant_event, encode_events, touch, user_event,
+                           write_transcript)
+
+
+class CheckpointTest(EngineTestCase):
+
+    def read_checkpoint(self):
+        path = self.home / '.claude' / 'cache' / 'usage-checkpoint.json'
+        return json.loads(path.read_text(encoding='utf-8'))
+
+    def test_append_reads_only_new_bytes(self):
+        path = write_transcript(self.home, 'p', 's', [
+            user_event(self.minutes_ago(50)),
+            assistant_event(self.minutes_ago(49), output_tokens=10)
+        ])
+        first = self.run_engine()
+        self.assertEqual(first['tokens']['raw']['output'], 10)
+        self.assertEqual(self.read_checkpoint()['files'][str(path)]['offset'], path.stat().st_size)
+
+        write_transcript(self.home, 'p', 's', [
+            assistant_event(self.minutes_ago(10), model=HAIKU, output_tokens=20)
+        ], append=True)
+        second = self.run_engine()
+        self.assertEqual(second['tokens']['raw']['output'], 30)
+        self.assertIn('haiku', second['modelBreakdown'])
+        self.assertTokensEqual(self.cold_run(), second)
+
+    def test_unchanged_file_is_reused(self):
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(30))])
+        first = self.run_engine()
+        checkpoint = self.read_checkpoint()
+        second = self.run_engine()
+        self.assertEqual(checkpoint, self.read_checkpoint())
+        self.assertTokensEqual(first, second)
+
+    def test_partial_line_is_deferred(self):
+        path = write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(40), output_tokens=5)])
+        line = encode_events([assistant_event(self.minutes_ago(5), output_tokens=7)])
+        with open(path, 'ab') as f:
+            f.write(line[:20])
+
+        partial = self.run_engine()
+        self.assertEqual(partial['tokens']['raw']['output'], 5)
+        self.assertLess(self.read_checkpoint()['files'][str(path)]['offset'], path.stat().st_size)
+
+        with open(path, 'ab') as f:
+            f.write(line[20:])
+        self.assertEqual(self.run_engine()['tokens']['raw']['output'], 12)
+
+    def test_rewritten_file_is_rescanned(self):
+        """同じサイズで末尾を書き換えると、処理済み末尾の CRC の変化で先頭から集計し直す"""
+        path = write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(30), cache_read=1)])
+        self.run_engine()
+        path.write_bytes(path.read_bytes().replace(b'"cache_read_input_tokens": 1', b'"cache_read_input_tokens": 9'))
+        touch(path)
+
+        rewritten = self.run_engine()
+        self.assertEqual(rewritten['tokens']['raw']['cache_read'], 9)
+        self.assertTokensEqual(self.cold_run(), rewritten)
+
+    def test_replaced_file_is_rescanned(self):
+        """別の inode に置き換えられたファイルは先頭から集計し直す"""
+        path = write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(30), output_tokens=11)])
+        self.run_engine()
+        replacement = path.with_suffix('.tmp')
+        replacement.write_bytes(encode_events([assistant_event(self.minutes_ago(30), output_tokens=22)]))
+        replacement.replace(path)
+
+        self.assertEqual(self.run_engine()['tokens']['raw']['output'], 22)
+
+    def test_truncated_file_is_rescanned(self):
+        path = write_transcript(self.home, 'p', 's', [
+            assistant_event(self.minutes_ago(30), output_tokens=3),
+            assistant_event(self.minutes_ago(20), output_tokens=4)
+        ])
+        self.run_engine()
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(30), output_tokens=3)])
+        self.assertEqual(self.run_engine()['tokens']['raw']['output'], 3)
+
+    def test_window_change_discards_checkpoint(self):
+        write_transcript(self.home, 'p', 's', [
+            assistant_event(self.minutes_ago(50), output_tokens=1),
+            assistant_event(self.minutes_ago(10), output_tokens=2)
+        ])
+        self.assertEqual(self.run_engine()['tokens']['raw']['output'], 3)
+
+        self.window_start = self.minutes_ago(30)
+        self.assertEqual(self.run_engine()['tokens']['raw']['output'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+列指向ストア（--columnar）のテスト
+
+列ファイル経由の集計がログの直接走査と一致すること、時刻の逆転した追記が
+重なる範囲の書き直しだけで済むこと、取り込みがウィンドウ内に更新された
+ファイルの追記分に限られることを確認します。
+"""
+
+import array
+import fcntl
+import json
+import os
+import unittest
+
+from tests.support import EngineTestCase, HAIKU, OPUS, assistant_event, user_event, write_transcript
+
+
+class ColumnarStoreTest(EngineTestCase):
+
+    @property
+    def columns_dir(self):
+        return self.home / '.claude' / 'cache' / 'usage-columns'
+
+    def read_meta(self):
+        return json.loads((self.columns_dir / 'meta.json').read_text(encoding='utf-8'))
+
+    def read_ts_column(self):
+        values = array.array('q')
+        values.frombytes((self.columns_dir / 'ts.col').read_bytes())
+        return list(values)
+
+    def assertMatchesScan(self, columnar):
+        self.assertTokensEqual(self.run_engine(), columnar)
+        # ユーザーメッセージのモデルは store と同じくファイル内の後続の応答とも結合する
+        self.assertEqual(self.run_engine('--store')['legacy'], columnar['legacy'])
+
+    def test_columnar_matches_scan(self):
+        write_transcript(self.home, 'p1', 's1', [
+            user_event(self.minutes_ago(50), uuid='u-1'),
+            assistant_event(self.minutes_ago(49), parent_uuid='u-1', cache_creation=300, cache_read=1000),
+            assistant_event(self.minutes_ago(80), output_tokens=999)  # ウィンドウ外
+        ])
+        write_transcript(self.home, 'p2', 's2', [assistant_event(self.minutes_ago(20), model=HAIKU)])
+        self.assertMatchesScan(self.run_engine('--columnar'))
+
+        write_transcript(self.home, 'p2', 's2', [assistant_event(self.minutes_ago(5), model=OPUS)], append=True)
+        self.assertMatchesScan(self.run_engine('--columnar'))
+
+    def test_out_of_order_rows_merge_only_the_suffix(self):
+        write_transcript(self.home, 'p', 'a', [
+            assistant_event(self.minutes_ago(50), output_tokens=1),
+            assistant_event(self.minutes_ago(10), output_tokens=2)
+        ])
+        self.run_engine('--columnar')
+
+        # 並行セッションのより古い行が後から届く
+        write_transcript(self.home, 'p', 'b', [assistant_event(self.minutes_ago(30), output_tokens=4)])
+        columnar = self.run_engine('--columnar')
+        self.assertEqual(columnar['tokens']['raw']['output'], 7)
+        self.assertMatchesScan(columnar)
+
+        ts_column = self.read_ts_column()
+        self.assertEqual(ts_column, sorted(ts_column))
+        self.assertNotIn('merge', self.read_meta())
+        self.assertEqual([path.suffix for path in self.columns_dir.iterdir() if path.suffix == '.merge'], [])
+
+    def test_late_reply_model_is_patched(self):
+        """応答が次回の取り込みで届いたユーザーメッセージにもモデルを結合する"""
+        write_transcript(self.home, 'p', 's', [user_event(self.minutes_ago(20), uuid='late')])
+        self.run_engine('--columnar')
+        write_transcript(self.home, 'p', 's', [
+            assistant_event(self.minutes_ago(19), model=HAIKU, parent_uuid='late')
+        ], append=True)
+
+        columnar = self.run_engine('--columnar')
+        self.assertEqual(columnar['legacy']['modelCounts'], {'haiku': 1})
+        self.assertMatchesScan(columnar)
+
+    def test_ingest_skips_files_before_window(self):
+        old = write_transcript(self.home, 'p', 'old', [assistant_event(self.minutes_ago(300))])
+        stale = self.window_start.timestamp() - 3600
+        os.utime(old, (stale, stale))
+        recent = write_transcript(self.home, 'p', 'recent', [assistant_event(self.minutes_ago(10))])
+
+        self.run_engine('--columnar')
+        self.assertEqual(set(self.read_meta()['files']), {str(recent)})
+
+    def test_unchanged_run_takes_no_lock(self):
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(10), output_tokens=8)])
+        self.run_engine('--columnar')
+
+        # 別のプロセスが columns.lock を保持していても、変更がなければ待たずに集計できる
+        with open(self.columns_dir / 'columns.lock', 'a+b') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            usage = self.run_engine('--columnar')
+        self.assertEqual(usage['tokens']['raw']['output'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""--compact（終了したセッションの集計用サイドカー）のテスト"""
+import os
+import unittest
+from datetime import timedelta
+
+from tests.support import EngineTestCase, HAIKU, assistant_event, user_event, write_transcript
+
+BACKENDS = ([], ['--store'], ['--columnar'])
+
+
+class CompactTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 1時間以上前に終了したセッションもウィンドウに含める
+        self.window_start = self.now - timedelta(hours=4)
+
+        self.finished = write_transcript(self.home, 'p', 'finished', [
+            user_event(self.minutes_ago(180), text='x' * 20000, uuid='u-1'),
+            assistant_event(self.minutes_ago(179), model=HAIKU, input_tokens=200, parent_uuid='u-1'),
+            {'type': 'summary', 'summary': 'y' * 20000}
+        ])
+        mtime = self.minutes_ago(120).timestamp()
+        os.utime(self.finished, (mtime, mtime))
+        self.active = write_transcript(self.home, 'p', 'active', [
+            assistant_event(self.minutes_ago(10), input_tokens=300)
+        ])
+        self.sidecar = self.finished.with_name(self.finished.name + '.usage')
+
+    def assertSameUsage(self, expected, label):
+        for args in BACKENDS:
+            with self.subTest(label=label, backend=args):
+                actual = self.cold_run(*args)
+                self.assertTokensEqual(expected, actual)
+                self.assertEqual(expected['legacy']['modelCounts'], actual['legacy']['modelCounts'])
+
+    def test_sidecar_for_finished_session(self):
+        """更新のないセッションのみサイドカーを作り、集計結果は変わらない"""
+        expected = self.cold_run()
+        summary = self.run_engine('--compact')
+        self.assertEqual((summary['compacted'], summary['active']), (1, 1))
+        self.assertTrue(self.sidecar.exists())
+        self.assertFalse(self.active.with_name(self.active.name + '.usage').exists())
+        self.assertLess(summary['sidecarBytes'], summary['sourceBytes'] // 10)
+        self.assertEqual(self.sidecar.stat().st_mtime_ns, self.finished.stat().st_mtime_ns)
+        self.assertSameUsage(expected, 'compacted')
+
+        self.assertEqual(self.run_engine('--compact')['upToDate'], 1)
+
+    def test_appended_after_compaction(self):
+        """作成後に追記されたセッションは元のファイルから集計する"""
+        self.run_engine('--compact')
+        write_transcript(self.home, 'p', 'finished', [assistant_event(self.minutes_ago(5), input_tokens=50)],
+                         append=True)
+        self.assertEqual(self.cold_run()['tokens']['raw']['input'], 550)
+        self.assertSameUsage(self.cold_run(), 'appended')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""設定ファイルのスナップショット（ConfigSnapshot）のテスト"""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from tests.support import ENGINE_TIMEOUT, SCRIPT, EngineTestCase, assistant_event, write_transcript
+
+
+class ConfigSnapshotTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(10), input_tokens=300)])
+
+    def write_config(self, name, data):
+        (self.home / '.claude' / name).write_text(json.dumps(data), encoding='utf-8')
+
+    def run_with_stderr(self, *args):
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT), *args], env={**os.environ, 'HOME': str(self.home)},
+            capture_output=True, text=True, timeout=ENGINE_TIMEOUT
+        )
+        self.assertIn(result.returncode, (0, 1), result.stderr)
+        return json.loads(result.stdout), result.stderr
+
+    def test_reads_each_file_once(self):
+        """設定ファイル3つとウィンドウ状態（usage-window.json）をそれぞれ1回だけ読む"""
+        counters = self.run_engine('--profile')['perf']['counters']
+        self.assertEqual(counters['configLoads'], 4)
+
+    def test_non_object_config_uses_defaults(self):
+        self.write_config('usage-config.json', ['max-200'])
+        usage, stderr = self.run_with_stderr()
+        self.assertEqual(usage['plan'], 'pro')
+        self.assertIn('Failed to read config file: not an object', stderr)
+
+    def test_invalid_plan_uses_default(self):
+        self.write_config('usage-config.json', {'plan': 200})
+        usage, stderr = self.run_with_stderr()
+        self.assertEqual(usage['plan'], 'pro')
+        self.assertIn('Ignoring invalid plan: 200', stderr)
+
+    def test_invalid_confidence_ignores_calibration(self):
+        """confidence が数値でないキャリブレーションは使わない（未キャリブレーションと同じ結果）"""
+        expected = self.run_engine()
+        self.write_config('usage-calibration.json', {'current_limit': 1000, 'confidence': 'high'})
+        usage, stderr = self.run_with_stderr()
+        self.assertEqual(usage['tokenPercent'], expected['tokenPercent'])
+        self.assertNotIn('Traceback', stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""ストリーミング中の重複行・再開したセッションに複製されたイベントの重複除去のテスト"""
+import unittest
+
+from tests.support import EngineTestCase, assistant_event, load_engine, user_event, write_transcript
+
+BACKENDS = ([], ['--store'], ['--columnar'], ['--workers', '2'])
+
+
+class DedupeTest(EngineTestCase):
+
+    def write_sessions(self):
+        """元のセッションと、その履歴を複製して始まる再開したセッション"""
+        history = [
+            user_event(self.minutes_ago(50), uuid='u-history'),
+            assistant_event(self.minutes_ago(49), uuid='a-history', message_id='msg-history',
+                            request_id='req-history', output_tokens=10)
+        ]
+        original = write_transcript(self.home, 'p', 'original', history)
+        write_transcript(self.home, 'p', 'resumed', history + [
+            assistant_event(self.minutes_ago(10), output_tokens=20)
+        ])
+        return original
+
+    def assertOutputTokens(self, expected, label):
+        for args in BACKENDS:
+            with self.subTest(label=label, backend=args):
+                self.assertEqual(self.run_engine(*args)['tokens']['raw']['output'], expected)
+
+    def test_streamed_lines_counted_once(self):
+        """同じ message.id / requestId の行は1回だけ数える"""
+        event = assistant_event(self.minutes_ago(30), output_tokens=15)
+        write_transcript(self.home, 'p', 's', [event, event])
+        self.assertOutputTokens(15, 'streamed')
+        self.assertEqual(self.run_engine()['scanStats']['duplicatesSkipped'], 0)
+        self.assertEqual(self.cold_run()['scanStats']['duplicatesSkipped'], 1)
+
+    def test_resumed_session_counted_once(self):
+        self.write_sessions()
+        self.assertOutputTokens(30, 'resumed')
+
+    def test_rewritten_original_releases_copy(self):
+        """先に数えたファイルから消えたイベントは、複製したセッションで数え直す"""
+        original = self.write_sessions()
+        self.assertOutputTokens(30, 'before')
+
+        write_transcript(self.home, 'p', 'original', [user_event(self.minutes_ago(50), uuid='u-history')])
+        self.assertOutputTokens(30, 'rewritten')
+        self.assertTrue(original.exists())
+
+    def test_deleted_original_releases_copy(self):
+        original = self.write_sessions()
+        self.assertOutputTokens(30, 'before')
+
+        original.unlink()
+        for args in ([], ['--workers', '2']):
+            with self.subTest(backend=args):
+                self.assertEqual(self.run_engine(*args)['tokens']['raw']['output'], 30)
+
+
+class DedupeKeySetTest(unittest.TestCase):
+
+    def test_membership(self):
+        engine = load_engine()
+        typecode = engine.DEDUPE_KEY_TYPECODE
+        keys = engine.DedupeKeySet([engine.array.array(typecode, [5, -3]), engine.array.array(typecode, [9])])
+        self.assertIn(-3, keys)
+        self.assertNotIn(4, keys)
+
+        keys.discard_keys({5})
+        keys.add_keys({4})
+        self.assertNotIn(5, keys)
+        self.assertIn(4, keys)
+
+        keys.add_keys({5})
+        self.assertIn(5, keys)
+
+
+if __name__ == '__main__':
+    unittest.main()
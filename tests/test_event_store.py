@@ -0,0 +1,69 @@
+"""
+SQLite イベントストア（--store）のテスト
+
+ストア経由の集計がログの直接走査と一致すること、取り込みがウィンドウ内に
+更新されたファイルの追記分に限られることを確認します。
+"""
+
+import os
+import sqlite3
+import time
+import unittest
+from contextlib import closing
+
+from tests.support import EngineTestCase, HAIKU, assistant_event, user_event, write_transcript
+
+
+class EventStoreTest(EngineTestCase):
+
+    def connect(self):
+        return closing(sqlite3.connect(self.home / '.claude' / 'usage-events.db'))
+
+    def ingested_files(self):
+        with self.connect() as conn:
+            return {row[0] for row in conn.execute('SELECT path FROM files')}
+
+    def test_store_matches_scan(self):
+        write_transcript(self.home, 'p1', 's1', [
+            user_event(self.minutes_ago(50)),
+            assistant_event(self.minutes_ago(49), cache_creation=300, cache_read=1000),
+            assistant_event(self.minutes_ago(80), output_tokens=999)  # ウィンドウ外
+        ])
+        write_transcript(self.home, 'p2', 's2', [assistant_event(self.minutes_ago(20), model=HAIKU)])
+
+        store = self.run_engine('--store')
+        self.assertTokensEqual(self.run_engine(), store)
+
+        write_transcript(self.home, 'p2', 's2', [assistant_event(self.minutes_ago(5), output_tokens=70)], append=True)
+        store = self.run_engine('--store')
+        self.assertTokensEqual(self.run_engine(), store)
+        with self.connect() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM events WHERE kind = 'assistant'").fetchone()[0], 4)
+
+    def test_ingest_skips_files_before_window(self):
+        old = write_transcript(self.home, 'p', 'old', [assistant_event(self.minutes_ago(300))])
+        stale = self.window_start.timestamp() - 3600
+        os.utime(old, (stale, stale))
+        recent = write_transcript(self.home, 'p', 'recent', [assistant_event(self.minutes_ago(10))])
+
+        self.run_engine('--store')
+        self.assertEqual(self.ingested_files(), {str(recent)})
+
+    def test_unchanged_run_takes_no_write_lock(self):
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(10), output_tokens=8)])
+        self.run_engine('--store')
+
+        # 別の接続が書き込みロックを保持していても、変更がなければ待たずに集計できる
+        # （ロックを待つとロック待ちのタイムアウト 5 秒の後にストアの更新を諦める）
+        with self.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            started = time.monotonic()
+            usage = self.run_engine('--store')
+            elapsed = time.monotonic() - started
+            conn.execute('ROLLBACK')
+        self.assertLess(elapsed, 4)
+        self.assertEqual(usage['tokens']['raw']['output'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
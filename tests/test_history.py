@@ -0,0 +1,110 @@
+"""ウィンドウ終了時の台帳記録と --history のテスト"""
+import json
+import sqlite3
+import unittest
+from contextlib import closing
+from datetime import timedelta
+
+from tests.support import EngineTestCase, HAIKU, assistant_event, run_engine, write_transcript, write_window_state
+
+
+class WindowHistoryTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_transcript(self.home, 'project-a', 'session-1', [
+            assistant_event(self.minutes_ago(50)),
+            assistant_event(self.minutes_ago(40), model=HAIKU, input_tokens=300)
+        ])
+        self.closed_start = self.now - timedelta(hours=6)
+
+    @property
+    def event_store(self):
+        return self.home / '.claude' / 'usage-events.db'
+
+    def expire_window(self, result_window_start=None):
+        """
+        直前の計算結果とウィンドウ状態を、既に終了したウィンドウのものに書き換える
+
+        Returns:
+            dict: 書き換えた直前の計算結果（usage）
+        """
+        result_file = self.home / '.claude' / 'cache' / 'usage-result.json'
+        shared = json.loads(result_file.read_text(encoding='utf-8'))
+        shared['usage']['windowStart'] = (result_window_start or self.closed_start).isoformat()
+        result_file.write_text(json.dumps(shared), encoding='utf-8')
+        write_window_state(self.home, self.closed_start)
+        return shared['usage']
+
+    def read_ledger(self):
+        ledger = self.home / '.claude' / 'usage-window-ledger.jsonl'
+        if not ledger.exists():
+            return []
+        return [json.loads(line) for line in ledger.read_text(encoding='utf-8').splitlines() if line]
+
+    def test_scan_reset_uses_last_result(self):
+        """scan モードは直前の計算結果から記録し、イベントストアを作らない"""
+        self.run_engine()
+        usage = self.expire_window()
+
+        result = run_engine(self.home)
+        self.assertIsNone(result['windowStart'])
+        self.assertFalse(self.event_store.exists())
+
+        ledger = self.read_ledger()
+        self.assertEqual(len(ledger), 1)
+        self.assertEqual(ledger[0]['windowStart'], self.closed_start.isoformat())
+        self.assertEqual(ledger[0]['tokens']['raw']['total'], usage['tokens']['raw']['total'])
+        self.assertEqual(set(ledger[0]['modelBreakdown']), {'sonnet', 'haiku'})
+
+        # 同じウィンドウを二重に記録しない
+        write_window_state(self.home, self.closed_start)
+        run_engine(self.home)
+        self.assertEqual(len(self.read_ledger()), 1)
+
+    def test_scan_reset_skips_other_window(self):
+        """直前の計算結果が別のウィンドウのものなら記録しない"""
+        self.run_engine()
+        self.expire_window(result_window_start=self.window_start)
+
+        run_engine(self.home)
+        self.assertEqual(self.read_ledger(), [])
+        self.assertFalse(self.event_store.exists())
+
+    def test_store_reset_uses_rollups(self):
+        """store モードはイベントストアのロールアップから記録する"""
+        write_transcript(self.home, 'project-a', 'session-2', [
+            assistant_event(self.closed_start + timedelta(minutes=10), input_tokens=700)
+        ])
+        self.run_engine('--store')
+        self.expire_window()
+
+        run_engine(self.home, '--store')
+        ledger = self.read_ledger()
+        self.assertEqual(len(ledger), 1)
+        self.assertEqual(ledger[0]['windowStart'], self.closed_start.isoformat())
+        self.assertEqual(ledger[0]['tokens']['raw']['input'], 700)
+
+    def test_history_does_not_ingest(self):
+        """--history は --store を付けない限りトランスクリプトを取り込まない"""
+        self.run_engine()
+        self.expire_window()
+        run_engine(self.home)
+
+        history = run_engine(self.home, '--history')
+        self.assertEqual([entry['windowStart'] for entry in history['windows']], [self.closed_start.isoformat()])
+        self.assertFalse(history['rollups'])
+        self.assertIn('--history --store', history['note'])
+        self.assertEqual(history['daily'], [])
+        self.assertFalse(self.event_store.exists())
+
+        history = run_engine(self.home, '--history', '--store')
+        self.assertTrue(history['rollups'])
+        self.assertEqual(sum(day['tokens']['raw']['total'] for day in history['daily']), 500)
+        self.assertEqual(set(history['modelMix']), {'sonnet', 'haiku'})
+        with closing(sqlite3.connect(self.event_store)) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM events WHERE kind = 'assistant'").fetchone()[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
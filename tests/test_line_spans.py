@@ -0,0 +1,51 @@
+"""mmap 上での行の切り出し（map_transcript / iter_line_spans）のテスト"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.support import EngineTestCase, assistant_event, load_engine, user_event, write_transcript
+
+
+class LineSpanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = load_engine()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def spans(self, data, offset=0):
+        path = Path(self.tmp.name) / 'transcript.jsonl'
+        path.write_bytes(data)
+        with open(path, 'rb') as f, self.engine.map_transcript(f) as buf:
+            return [bytes(buf[start:end]) for start, end in self.engine.iter_line_spans(buf, offset)]
+
+    def test_complete_lines_only(self):
+        """改行で終わっていない末尾の行は返さない"""
+        self.assertEqual(self.spans(b'{"a":1}\n{"b":2}\n{"c"'), [b'{"a":1}\n', b'{"b":2}\n'])
+        self.assertEqual(self.spans(b'{"a":1}\n{"b":2}\n', offset=8), [b'{"b":2}\n'])
+
+    def test_empty_file(self):
+        self.assertEqual(self.spans(b''), [])
+
+    def test_line_longer_than_search_chunk(self):
+        """改行を探す単位（MMAP_RELEASE_BYTES）より長い行も1行として返す"""
+        long_line = b'x' * (self.engine.MMAP_RELEASE_BYTES * 2 + 10) + b'\n'
+        self.assertEqual(self.spans(long_line + b'{}\n'), [long_line, b'{}\n'])
+
+
+class LongLineScanTest(EngineTestCase):
+
+    def test_large_tool_result(self):
+        """巨大なツール実行結果の行を挟んでも集計結果は変わらない"""
+        tool_result = user_event(self.minutes_ago(25), text='y' * (3 * 1024 * 1024))
+        events = [assistant_event(self.minutes_ago(30), input_tokens=200), tool_result,
+                  assistant_event(self.minutes_ago(20), input_tokens=300)]
+        write_transcript(self.home, 'p', 's', events)
+
+        for args in ([], ['--store'], ['--columnar']):
+            with self.subTest(backend=args):
+                self.assertEqual(self.cold_run(*args)['tokens']['raw']['input'], 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""ユーザーメッセージのモデルを応答の parentUuid から求める結合（legacy.modelCounts）のテスト"""
+import unittest
+
+from tests.support import EngineTestCase, HAIKU, OPUS, assistant_event, user_event, write_transcript
+
+BACKENDS = ([], ['--store'], ['--columnar'])
+
+
+class ModelJoinTest(EngineTestCase):
+
+    def model_counts(self, *args):
+        return self.run_engine(*args)['legacy']['modelCounts']
+
+    def test_prompt_takes_response_model(self):
+        """ユーザーメッセージは後に続く応答のモデルで数え、全ての集計方法で一致する"""
+        write_transcript(self.home, 'p', 's', [
+            user_event(self.minutes_ago(40), uuid='u-1'),
+            assistant_event(self.minutes_ago(39), model=HAIKU, parent_uuid='u-1'),
+            user_event(self.minutes_ago(30), uuid='u-2'),
+            assistant_event(self.minutes_ago(29), model=OPUS, parent_uuid='u-2'),
+            assistant_event(self.minutes_ago(28), model=HAIKU, parent_uuid='u-2'),
+            user_event(self.minutes_ago(20), uuid='u-3')
+        ])
+        for args in BACKENDS:
+            with self.subTest(backend=args):
+                self.assertEqual(self.model_counts(*args), {'haiku': 1, 'opus': 1, 'unknown': 1})
+
+    def test_response_appended_in_later_run(self):
+        """応答待ちのメッセージはチェックポイントに残り、後の実行で追記された応答と結合する"""
+        write_transcript(self.home, 'p', 's', [user_event(self.minutes_ago(30), uuid='u-1')])
+        self.assertEqual(self.model_counts(), {'unknown': 1})
+
+        write_transcript(self.home, 'p', 's', [
+            assistant_event(self.minutes_ago(29), model=OPUS, parent_uuid='u-1')
+        ], append=True)
+        self.assertEqual(self.model_counts(), {'opus': 1})
+        self.assertEqual(self.cold_run()['legacy']['modelCounts'], {'opus': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""コンパイル済みのモデル照合・補間カーブのテスト（以前の線形探索と同じ結果になること）"""
+import json
+import random
+import unittest
+from unittest import mock
+
+from tests.support import REQUIRED_DIR, load_engine
+
+
+def reference_model_config(calibration, model_name, default):
+    """以前の get_model_config（models → fallback_patterns の順に部分一致を線形探索）"""
+    model_lower = model_name.lower() if model_name else ''
+    models = calibration.get('models', {})
+    for section in (models, calibration.get('fallback_patterns', {})):
+        for model_key, config in section.items():
+            for pattern in config.get('match_patterns', []):
+                if pattern.lower() in model_lower:
+                    if 'inherit_from' in config:
+                        return model_key, {**models.get(config['inherit_from'], {}), **config}
+                    return model_key, config
+    return 'unknown', calibration.get('default', default)
+
+
+def reference_interpolate(raw_tokens, data_points):
+    """以前の interpolate_percent（ソート済みの点を線形探索）"""
+    if not data_points or raw_tokens <= 0:
+        return 0.0
+    points = sorted(data_points, key=lambda x: x.get('raw_tokens', 0))
+    xs = [p.get('raw_tokens', 0) for p in points]
+    ys = [p.get('percent', 0) for p in points]
+    if raw_tokens <= xs[0]:
+        return ys[0] * (raw_tokens / xs[0]) if xs[0] > 0 else 0.0
+    if raw_tokens >= xs[-1]:
+        if len(xs) < 2:
+            return ys[-1]
+        slope = (ys[-1] - ys[-2]) / (xs[-1] - xs[-2]) if xs[-1] != xs[-2] else 0
+        return ys[-1] + slope * (raw_tokens - xs[-1])
+    for i in range(len(xs) - 1):
+        if xs[i] <= raw_tokens <= xs[i + 1]:
+            return ys[i] + (ys[i + 1] - ys[i]) * (raw_tokens - xs[i]) / (xs[i + 1] - xs[i])
+    return ys[-1]
+
+
+class ModelMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = load_engine()
+        self.addCleanup(setattr, self.engine, '_model_matcher', None)
+        self.engine._model_matcher = None
+
+    def use_calibration(self, calibration):
+        patcher = mock.patch.object(self.engine, 'load_model_calibration', return_value=calibration)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertMatchesReference(self, calibration, names):
+        self.use_calibration(calibration)
+        for name in names:
+            with self.subTest(model=name):
+                expected = reference_model_config(calibration, name, self.engine.DEFAULT_MODEL_CONFIG)
+                self.assertEqual(self.engine.get_model_config(name), expected)
+                # メモ化された2回目も同じ結果
+                self.assertEqual(self.engine.get_model_config(name), expected)
+
+    def test_bundled_calibration(self):
+        """同梱の model-calibration.json で以前の探索と同じモデルを選ぶ"""
+        calibration = json.loads((REQUIRED_DIR / 'model-calibration.json').read_text(encoding='utf-8'))
+        self.assertMatchesReference(calibration, [
+            'claude-opus-4-5-20251101', 'claude-opus-4-1-20250805', 'claude-sonnet-4-5-20250929',
+            'claude-3-5-sonnet-20241022', 'claude-haiku-4-5-20251001', 'claude-3-haiku-20240307',
+            'Claude-Sonnet-4', 'gpt-4o', '', None, '<synthetic>'
+        ])
+
+    def test_priority_and_inherit(self):
+        """models が fallback_patterns より、先に書かれたモデルが後のモデルより優先される"""
+        calibration = {
+            'models': {
+                'opus-4.5': {'match_patterns': ['opus-4-5'], 'type': 'curve', 'weight': 5},
+                'opus-special': {'match_patterns': ['opus-4-5-2025', 'special'], 'inherit_from': 'opus-4.5'},
+                'regex-chars': {'match_patterns': ['a.b(c)'], 'weight': 2},
+                'no-patterns': {'weight': 9}
+            },
+            'fallback_patterns': {
+                'opus': {'match_patterns': ['opus'], 'weight': 4},
+                'special-fallback': {'match_patterns': ['special'], 'inherit_from': 'opus-4.5'}
+            },
+            'default': {'weight': 1}
+        }
+        self.assertMatchesReference(calibration, [
+            'claude-opus-4-5-20251101', 'claude-opus-4-1', 'my-special-model', 'xa.b(c)y', 'axb(c)',
+            'no-patterns', 'OPUS'
+        ])
+        self.assertEqual(self.engine.get_model_config('my-special-model')[1]['type'], 'curve')
+        self.assertEqual(self.engine.get_model_key_from_name('claude-opus-4-5-20251101'), 'opus')
+
+    def test_calibration_change_rebuilds_matcher(self):
+        """キャリブレーション設定が変わればメモを使わずに照合し直す"""
+        self.use_calibration({'models': {'sonnet-a': {'match_patterns': ['sonnet']}}})
+        self.assertEqual(self.engine.get_model_config('claude-sonnet-4-5')[0], 'sonnet-a')
+
+        self.engine.load_model_calibration.return_value = {'models': {'sonnet-b': {'match_patterns': ['sonnet']}}}
+        self.assertEqual(self.engine.get_model_config('claude-sonnet-4-5')[0], 'sonnet-b')
+
+
+class CurveInterpolationTest(unittest.TestCase):
+
+    def test_matches_linear_search(self):
+        """二分探索による補間が以前の線形探索と一致する（乱数の点とトークン数）"""
+        engine = load_engine()
+        rng = random.Random(10)
+        for _ in range(200):
+            points = [{'raw_tokens': rng.randint(0, 5_000_000), 'percent': rng.uniform(0, 100)}
+                      for _ in range(rng.randint(1, 8))]
+            for raw_tokens in [0, -5, *(rng.randint(0, 6_000_000) for _ in range(10)),
+                               *(point['raw_tokens'] for point in points)]:
+                with self.subTest(points=points, raw_tokens=raw_tokens):
+                    self.assertAlmostEqual(engine.interpolate_percent(raw_tokens, points),
+                                           reference_interpolate(raw_tokens, points))
+
+    def test_empty_points(self):
+        self.assertEqual(load_engine().interpolate_percent(1000, []), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
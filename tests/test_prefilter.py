@@ -0,0 +1,86 @@
+"""
+バイト列による行の事前判定（is_relevant_line）のテスト
+
+集計に関係しない行（ツール実行結果・スナップショットなど）をデコードせずに
+読み飛ばしても、集計結果が変わらないことを確認します。
+"""
+
+import json
+import unittest
+from datetime import datetime, timezone
+
+from tests.support import EngineTestCase, assistant_event, isoformat, load_engine, user_event, write_transcript
+
+
+def tool_result_event(ts):
+    return {
+        'type': 'user',
+        'uuid': 'tool-result',
+        'timestamp': isoformat(ts),
+        'message': {'role': 'user', 'content': [
+            {'type': 'tool_result', 'tool_use_id': 'toolu_1', 'content': '"type": "text" in a string'}
+        ]}
+    }
+
+
+def noise_events(ts):
+    """集計対象にならない行"""
+    return [
+        tool_result_event(ts),
+        {'type': 'summary', 'summary': 'Session summary', 'leafUuid': 'x'},
+        {'type': 'file-history-snapshot', 'snapshot': {'files': {}}},
+        {'type': 'assistant', 'timestamp': isoformat(ts), 'message': {'model': 'x', 'content': []}}
+    ]
+
+
+def encode(event):
+    return json.dumps(event).encode('utf-8')
+
+
+class RelevantLineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.is_relevant_line = load_engine().is_relevant_line
+        self.now = datetime.now(timezone.utc)
+
+    def test_counted_events_are_relevant(self):
+        self.assertTrue(self.is_relevant_line(encode(assistant_event(self.now))))
+        self.assertTrue(self.is_relevant_line(encode(user_event(self.now))))
+        # compact 形式（空白なし）の JSON も判定できる
+        compact = json.dumps(assistant_event(self.now), separators=(',', ':')).encode('utf-8')
+        self.assertTrue(self.is_relevant_line(compact))
+
+    def test_noise_is_skipped(self):
+        for event in noise_events(self.now):
+            self.assertFalse(self.is_relevant_line(encode(event)), event['type'])
+
+    def test_tool_result_with_text_is_kept(self):
+        """ツール実行結果と一緒にテキストを送った user イベントはデコードする"""
+        event = tool_result_event(self.now)
+        event['message']['content'].append({'type': 'text', 'text': 'and a question'})
+        self.assertTrue(self.is_relevant_line(encode(event)))
+
+
+class PrefilterScanTest(EngineTestCase):
+
+    def test_noise_does_not_change_usage(self):
+        events = [user_event(self.minutes_ago(40)), assistant_event(self.minutes_ago(39), output_tokens=12)]
+        write_transcript(self.home, 'p', 's', events)
+        clean = self.cold_run()
+
+        write_transcript(self.home, 'p', 's', noise_events(self.minutes_ago(38)) + events)
+        noisy = self.cold_run()
+        self.assertTokensEqual(clean, noisy)
+        self.assertEqual(clean['legacy'], noisy['legacy'])
+        self.assertEqual(noisy['scanStats']['linesSkipped'], 4)
+        self.assertEqual(noisy['scanStats']['linesParsed'], 2)
+
+    def test_store_skips_the_same_lines(self):
+        write_transcript(self.home, 'p', 's', noise_events(self.minutes_ago(38)) + [
+            assistant_event(self.minutes_ago(30), output_tokens=9)
+        ])
+        self.assertTokensEqual(self.run_engine(), self.run_engine('--store'))
+
+
+if __name__ == '__main__':
+    unittest.main()
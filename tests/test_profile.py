@@ -0,0 +1,49 @@
+"""--profile のフェーズ別所要時間・走査カウンターのテスト"""
+import unittest
+
+from tests.support import EngineTestCase, HAIKU, assistant_event, user_event, write_transcript
+
+
+class ProfileTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_transcript(self.home, 'project-a', 'session-1', [
+            user_event(self.minutes_ago(31)),
+            assistant_event(self.minutes_ago(30)),
+            assistant_event(self.minutes_ago(20), model=HAIKU)
+        ])
+        write_transcript(self.home, 'project-b', 'session-2', [assistant_event(self.minutes_ago(10))])
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('perf', self.run_engine())
+
+    def test_scan_counters(self):
+        """カウンターは scanStats と一致し、変更のない2回目はファイルを開かない"""
+        result = self.run_engine('--profile')
+        perf = result['perf']
+        self.assertIn('scan', perf['phasesMs'])
+        self.assertIn('jsonParse', perf['scanPhasesMs'])
+        self.assertGreaterEqual(perf['totalMs'], 0)
+
+        counters = perf['counters']
+        for name, value in result['scanStats'].items():
+            self.assertEqual(counters[name], value, name)
+        self.assertEqual(counters['filesSeen'], 2)
+        self.assertEqual(counters['filesOpened'], 2)
+        self.assertEqual(counters['eventsCounted'], 4)
+        self.assertEqual(counters['parseErrors'], 0)
+
+        counters = self.run_engine('--profile')['perf']['counters']
+        self.assertEqual(counters['filesSeen'], 2)
+        self.assertEqual(counters['filesOpened'], 0)
+        self.assertEqual(counters['bytesRead'], 0)
+
+    def test_store_phases(self):
+        perf = self.run_engine('--store', '--profile')['perf']
+        self.assertIn('ingest', perf['phasesMs'])
+        self.assertEqual(perf['counters']['filesOpened'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""--serve の問い合わせサーバーと usage-query.sh のテスト"""
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+from tests.support import REQUIRED_DIR, load_engine
+
+QUERIES = ('percent', 'window', 'models', 'status')
+
+
+def make_cache_data(window_end):
+    return {
+        'timestamp': '2026-01-01T00:00:00.000Z',
+        'tokenPercent': 42,
+        'messagePercent': 42,
+        'windowEnd': datetime.fromtimestamp(window_end, timezone.utc).isoformat(),
+        'modelBreakdown': {
+            'sonnet': {'rawTokens': 1000, 'calculatedPercent': 30.5},
+            'haiku': {'rawTokens': 10, 'calculatedPercent': 11.5},
+            'unknown': {'rawTokens': 1}
+        }
+    }
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix ドメインソケットが必要')
+class UsageQueryServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = load_engine()
+        self.directory = Path(tempfile.mkdtemp(prefix='usage-sock-'))
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.socket_path = self.directory / 'usage.sock'
+        self.server = self.engine.UsageQueryServer(self.socket_path)
+        self.assertTrue(self.server.start())
+        self.addCleanup(self.server.close)
+
+    def query(self, name):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(5)
+            client.connect(str(self.socket_path))
+            client.sendall(f'{name}\n'.encode('ascii'))
+            chunks = []
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8')
+
+    def test_responses(self):
+        window_end = int(time.time()) + 3600
+        cache_data = make_cache_data(window_end)
+        self.server.update(cache_data)
+
+        self.assertEqual(self.query('percent'), '42\n')
+        self.assertEqual(self.query('window'), f'{window_end}\n')
+        self.assertEqual(self.query('models'), 'sonnet=30.5 haiku=11.5\n')
+        self.assertEqual(self.query('status'), f'42 {window_end}\n')
+        self.assertEqual(json.loads(self.query('json')), cache_data)
+        self.assertTrue(self.query('bogus').startswith('error:'))
+
+    def test_expired_window(self):
+        """ウィンドウ終了時刻を過ぎたら（厳密に大きい場合のみ）使用率 0 を返す"""
+        window_end = int(time.time()) - 10
+        self.server.update(make_cache_data(window_end))
+        self.assertEqual(self.query('percent'), '0\n')
+        self.assertEqual(self.query('models'), '\n')
+        self.assertEqual(self.query('status'), f'0 {window_end}\n')
+
+        self.server.update(make_cache_data(int(time.time()) + 5))
+        self.assertEqual(self.query('percent'), '42\n')
+
+    def test_second_server_and_stale_socket(self):
+        """稼働中のサーバーがあれば起動せず、残ったソケットファイルは置き換える"""
+        self.assertFalse(self.engine.UsageQueryServer(self.socket_path).start())
+
+        stale_path = self.directory / 'stale.sock'
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(str(stale_path))
+        stale.close()
+        server = self.engine.UsageQueryServer(stale_path)
+        self.assertTrue(server.start())
+        server.close()
+        self.assertFalse(stale_path.exists())
+
+
+@unittest.skipUnless(shutil.which('bash') and shutil.which('jq'), 'bash と jq が必要')
+class UsageQueryClientTest(unittest.TestCase):
+    """サーバー未起動時の usage-query.sh（キャッシュファイル参照）がサーバーと同じ値を返す"""
+
+    def setUp(self):
+        self.home = Path(tempfile.mkdtemp(prefix='usage-home-'))
+        self.addCleanup(shutil.rmtree, self.home, True)
+        (self.home / '.claude' / 'cache').mkdir(parents=True)
+
+    def assertClientMatchesServer(self, cache_data):
+        (self.home / '.claude' / 'cache' / 'ccusage-cache.json').write_text(json.dumps(cache_data), encoding='utf-8')
+        server = load_engine().UsageQueryServer(self.home / 'unused.sock')
+        server.update(cache_data)
+        for query in QUERIES:
+            with self.subTest(query=query):
+                result = subprocess.run(
+                    ['bash', str(REQUIRED_DIR / 'usage-query.sh'), query],
+                    env={**os.environ, 'HOME': str(self.home)}, capture_output=True, text=True, timeout=30
+                )
+                # サーバーは models が空でも改行を返す（クライアントは何も出力しない）
+                self.assertEqual(result.stdout or '\n', server.respond(query).decode('utf-8'))
+
+    def test_active_window(self):
+        self.assertClientMatchesServer(make_cache_data(int(time.time()) + 3600))
+
+    def test_expired_window(self):
+        self.assertClientMatchesServer(make_cache_data(int(time.time()) - 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
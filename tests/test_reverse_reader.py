@@ -0,0 +1,66 @@
+"""
+末尾からの逆順読み込み（iter_lines_reverse・find_latest_model）のテスト
+"""
+
+import io
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from tests.support import HAIKU, OPUS, SCRIPT, assistant_event, encode_events, load_engine, user_event
+
+
+class IterLinesReverseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.iter_lines_reverse = load_engine().iter_lines_reverse
+
+    def reverse(self, data, block_size):
+        return list(self.iter_lines_reverse(io.BytesIO(data), block_size=block_size))
+
+    def test_matches_forward_split(self):
+        lines = [b'a' * n for n in (1, 7, 30, 3, 64, 2)]
+        data = b'\n'.join(lines) + b'\n'
+        for block_size in (1, 2, 5, 16, 64, 1024):
+            self.assertEqual(self.reverse(data, block_size), lines[::-1], block_size)
+
+    def test_unterminated_last_line_and_blank_lines(self):
+        data = b'first\n\n\nsecond\nlast-without-newline'
+        self.assertEqual(self.reverse(data, 4), [b'last-without-newline', b'second', b'first'])
+
+    def test_empty_file(self):
+        self.assertEqual(self.reverse(b'', 8), [])
+
+
+class FindLatestModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = load_engine()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.transcript = Path(directory.name) / 'session.jsonl'
+        now = datetime.now(timezone.utc)
+        self.transcript.write_bytes(encode_events([
+            assistant_event(now - timedelta(minutes=3), model=OPUS),
+            assistant_event(now - timedelta(minutes=2), model=HAIKU),
+            user_event(now - timedelta(minutes=1))
+        ]))
+
+    def test_returns_newest_assistant_model(self):
+        self.assertEqual(self.engine.find_latest_model(self.transcript), HAIKU)
+
+    def test_max_lines_limits_the_search(self):
+        self.assertIsNone(self.engine.find_latest_model(self.transcript, max_lines=1))
+        self.assertIsNone(self.engine.find_latest_model(self.transcript.with_name('missing.jsonl')))
+
+    def test_command_line(self):
+        result = subprocess.run([sys.executable, str(SCRIPT), '--latest-model', str(self.transcript)],
+                                capture_output=True, text=True)
+        self.assertEqual((result.returncode, result.stdout.strip()), (0, HAIKU))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+"""同時に起動した計算をまとめる（single-flight）共有結果のテスト"""
+import json
+import time
+import unittest
+
+from tests.support import EngineTestCase, assistant_event, write_transcript
+
+
+class SharedResultTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(10), input_tokens=300)])
+        self.result_file = self.home / '.claude' / 'cache' / 'usage-result.json'
+
+    def write_pending_result(self, source):
+        """ロック待ちの間に他のプロセスが書き込んだ計算結果（待ち始めより後に完了）"""
+        self.result_file.parent.mkdir(parents=True, exist_ok=True)
+        shared = {'finishedAt': time.time() + 60, 'source': source,
+                  'usage': {'messagePercent': 0, 'sharedBy': source}}
+        self.result_file.write_text(json.dumps(shared), encoding='utf-8')
+
+    def test_reuses_result_of_same_source(self):
+        self.write_pending_result('scan')
+        self.assertEqual(self.run_engine(), {'messagePercent': 0, 'sharedBy': 'scan'})
+
+    def test_recomputes_for_other_source(self):
+        """別の集計方法の結果は使わずに計算し、集計方法とともに結果を書き込む"""
+        self.write_pending_result('scan')
+        usage = self.run_engine('--store')
+        self.assertEqual(usage['tokens']['raw']['input'], 300)
+
+        shared = json.loads(self.result_file.read_text(encoding='utf-8'))
+        self.assertEqual(shared['source'], 'store')
+        self.assertEqual(shared['usage']['tokens'], usage['tokens'])
+        self.assertEqual([path.name for path in self.result_file.parent.glob('*.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""起動時の import を抑えているか・zipapp が同じ結果を返すかのテスト"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.support import ENGINE_TIMEOUT, REPO_ROOT, SCRIPT, EngineTestCase, assistant_event, write_transcript
+
+# 特定のモードでしか使わないため、使用する関数の中で import するモジュール
+# （fcntl は全てのモードで計算の排他ロック（single-flight）に使う）
+DEFERRED_MODULES = ('sqlite3', 'concurrent.futures', 'socket', 'threading', 'select', 'signal')
+
+
+def imported_modules(stderr):
+    """-X importtime の出力から import されたモジュール名を取り出す"""
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            if name != 'imported package':
+                modules.add(name)
+    return modules
+
+
+class DeferredImportTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_transcript(self.home, 'project-a', 'session-1', [assistant_event(self.minutes_ago(10))])
+
+    def run_with_importtime(self, *args):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', str(SCRIPT), *args],
+            env={**os.environ, 'HOME': str(self.home)}, capture_output=True, text=True, timeout=ENGINE_TIMEOUT
+        )
+        self.assertIn(result.returncode, (0, 1), result.stderr)
+        return imported_modules(result.stderr)
+
+    def test_scan_mode(self):
+        """既定の scan モードでは遅延 import のモジュールを読み込まない"""
+        modules = self.run_with_importtime()
+        self.assertIn('json', modules)
+        for name in DEFERRED_MODULES:
+            with self.subTest(module=name):
+                self.assertNotIn(name, modules)
+
+    def test_store_mode(self):
+        """--store では使用する時点で sqlite3 を読み込む"""
+        self.assertIn('sqlite3', self.run_with_importtime('--store'))
+
+
+class ZipappTest(EngineTestCase):
+
+    def test_zipapp_matches_script(self):
+        """tools/build-zipapp.py で作成した .pyz がスクリプトと同じ集計結果を返す"""
+        write_transcript(self.home, 'project-a', 'session-1', [
+            assistant_event(self.minutes_ago(20)),
+            assistant_event(self.minutes_ago(10), input_tokens=400)
+        ])
+        with tempfile.TemporaryDirectory() as output_dir:
+            subprocess.run(
+                [sys.executable, str(REPO_ROOT / 'tools' / 'build-zipapp.py'), str(SCRIPT), '--output-dir', output_dir],
+                check=True, capture_output=True, timeout=ENGINE_TIMEOUT
+            )
+            pyz = Path(output_dir) / 'get-message-usage.pyz'
+            self.assertTrue(pyz.is_file())
+
+            expected = self.cold_run()
+            result = subprocess.run(
+                [sys.executable, str(pyz)], env={**os.environ, 'HOME': str(self.home)},
+                capture_output=True, text=True, timeout=ENGINE_TIMEOUT
+            )
+        self.assertIn(result.returncode, (0, 1), result.stderr)
+        self.assertTokensEqual(expected, json.loads(result.stdout))
+
+
+if __name__ == '__main__':
+    unittest.main()
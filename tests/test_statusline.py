@@ -0,0 +1,100 @@
+"""--statusline が status-line.sh と同じ行を出力するかのテスト"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+from datetime import datetime, timezone
+
+from tests.support import ENGINE_TIMEOUT, EngineTestCase, HAIKU, OPUS, REQUIRED_DIR, SCRIPT, assistant_event
+
+# Session 表示は /tmp の共有キャッシュと stat の実装（GNU / BSD）に依存するため比較から除く
+SESSION_SEGMENT = re.compile(r' \| Session:\x1b\[3[123]m\d+%\x1b\[0m')
+
+
+@unittest.skipUnless(shutil.which('bash') and shutil.which('jq'), 'bash と jq が必要')
+class StatuslineTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cwd = self.home / 'work' / 'my-project'
+        self.cwd.mkdir(parents=True)
+
+    def render(self, command, data):
+        result = subprocess.run(
+            command, input=json.dumps(data), cwd=self.cwd, env={**os.environ, 'HOME': str(self.home)},
+            capture_output=True, text=True, timeout=ENGINE_TIMEOUT
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return SESSION_SEGMENT.sub('', result.stdout)
+
+    def assertSameLine(self, data):
+        expected = self.render(['bash', str(REQUIRED_DIR / 'status-line.sh')], data)
+        actual = self.render([sys.executable, str(SCRIPT), '--statusline'], data)
+        self.assertEqual(actual, expected)
+        return actual
+
+    def write_usage_cache(self, token_percent, window_end):
+        cache = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'tokenPercent': token_percent,
+            'messagePercent': token_percent,
+            'windowEnd': datetime.fromtimestamp(window_end, timezone.utc).isoformat()
+        }
+        (self.home / '.claude' / 'cache').mkdir(exist_ok=True)
+        (self.home / '.claude' / 'cache' / 'ccusage-cache.json').write_text(json.dumps(cache), encoding='utf-8')
+
+    def make_input(self, transcript=None, context_tokens=None):
+        data = {'model': {'display_name': 'Claude Sonnet 4.5'}, 'workspace': {'current_dir': str(self.cwd)}}
+        if transcript is not None:
+            data['transcript_path'] = str(transcript)
+        if context_tokens is not None:
+            data['context_window'] = {
+                'context_window_size': 200000,
+                'current_usage': {'input_tokens': context_tokens, 'output_tokens': 500,
+                                  'cache_creation_input_tokens': 1000, 'cache_read_input_tokens': 2000}
+            }
+        return data
+
+    def test_full_line(self):
+        """トランスクリプトのモデル・コンテキスト・5h の各色"""
+        # status-line.sh は Claude Code と同じ区切り（空白なし）の JSON を前提に grep する
+        transcript = self.home / 'transcript.jsonl'
+        transcript.write_text(''.join(
+            json.dumps(event, separators=(',', ':')) + '\n'
+            for event in (assistant_event(self.minutes_ago(10), model=HAIKU),
+                          assistant_event(self.minutes_ago(5), model=OPUS))
+        ), encoding='utf-8')
+        for context_tokens, token_percent in ((10000, 12), (110000, 65), (170000, 93)):
+            with self.subTest(context_tokens=context_tokens, token_percent=token_percent):
+                self.write_usage_cache(token_percent, int(time.time()) + 3600)
+                line = self.assertSameLine(self.make_input(transcript, context_tokens))
+                self.assertIn('Opus 4.5', line)
+                self.assertIn('5h:', line)
+
+    def test_expired_window(self):
+        """ウィンドウ終了後は 5h:0%"""
+        self.write_usage_cache(88, int(time.time()) - 10)
+        line = self.assertSameLine(self.make_input())
+        self.assertIn('5h:\x1b[32m0%', line)
+
+    def test_minimal_input(self):
+        """トランスクリプト・キャッシュなしでは Claude Code が渡すモデル名のみ"""
+        line = self.assertSameLine(self.make_input(transcript=self.home / 'missing.jsonl'))
+        self.assertIn('Claude Sonnet 4.5', line)
+        self.assertNotIn('5h:', line)
+
+    @unittest.skipUnless(shutil.which('git'), 'git が必要')
+    def test_git_branch(self):
+        """.git/HEAD から読んだブランチ名が git branch --show-current と一致する"""
+        subprocess.run(['git', 'init', '-q', str(self.cwd)], check=True)
+        subprocess.run(['git', '-C', str(self.cwd), 'checkout', '-q', '-b', 'feature/statusline'], check=True)
+        line = self.assertSameLine(self.make_input(context_tokens=10000))
+        self.assertIn('feature/statusline', line)
+
+
+if __name__ == '__main__':
+    unittest.main()
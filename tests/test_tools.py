@@ -0,0 +1,74 @@
+"""tools/ のコーパス生成・ベンチマークのテスト"""
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.support import ENGINE_TIMEOUT, REPO_ROOT
+
+GENERATOR = REPO_ROOT / 'tools' / 'gen-transcripts.py'
+BENCH = REPO_ROOT / 'tools' / 'bench.py'
+GENERATOR_ARGS = ('--projects', '2', '--sessions', '2', '--lines', '200', '--seed', '3',
+                  '--now', '2026-01-01T00:00:00+00:00', '--malformed-rate', '0.02')
+
+
+class ToolsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp(prefix='usage-tools-'))
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+
+    def run_tool(self, script, *args):
+        result = subprocess.run([sys.executable, str(script), *args],
+                                capture_output=True, text=True, timeout=ENGINE_TIMEOUT)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+
+class GeneratorTest(ToolsTestCase):
+
+    def generate(self, name, *args):
+        home = self.work_dir / name
+        self.run_tool(GENERATOR, str(home), *GENERATOR_ARGS, *args)
+        return home
+
+    def read_corpus(self, home):
+        projects = home / '.claude' / 'projects'
+        return {str(path.relative_to(projects)): path.read_bytes() for path in sorted(projects.rglob('*.jsonl'))}
+
+    def test_deterministic(self):
+        """同じシードと基準時刻からは同じコーパスを生成し、マニフェストの件数と一致する"""
+        first = self.read_corpus(self.generate('a'))
+        self.assertEqual(first, self.read_corpus(self.generate('b')))
+        self.assertNotEqual(first, self.read_corpus(self.generate('c', '--seed', '4')))
+
+        manifest = json.loads((self.work_dir / 'a' / '.claude' / 'bench-corpus.json').read_text(encoding='utf-8'))
+        self.assertEqual(manifest['files'], len(first))
+        self.assertEqual(manifest['lines'], sum(data.count(b'\n') for data in first.values()))
+        self.assertEqual(manifest['bytes'], sum(len(data) for data in first.values()))
+        self.assertGreater(manifest['malformedLines'], 0)
+
+
+class BenchTest(ToolsTestCase):
+
+    def test_report(self):
+        """各ベンチマークが別プロセスで実行され、エラーなく結果を返す"""
+        # シード 5 の small コーパスは1時間以内に終了したセッションを含む（ウィンドウ内のイベントがある）
+        report = json.loads(self.run_tool(
+            BENCH, '--preset', 'small', '--seed', '5', '--bench', 'calculate_message_usage,statusline',
+            '--repeat', '1', '--work-dir', str(self.work_dir)
+        ))
+        results = report['corpora']['small']['results']
+        self.assertEqual(sorted(results), ['calculate_message_usage', 'statusline'])
+        for name, result in results.items():
+            with self.subTest(benchmark=name):
+                self.assertNotIn('error', result)
+                self.assertGreater(result['peakRssMb'], 0)
+        self.assertGreater(results['calculate_message_usage']['events'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
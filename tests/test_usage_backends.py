@@ -0,0 +1,254 @@
+"""
+集計方法ごとの一致を確認する回帰テスト
+
+tools/gen-transcripts.py で生成した合成コーパスを一時ディレクトリの HOME に置き、
+ログの直接走査・SQLite イベントストア（--store）・列指向ストア（--columnar）・
+並列走査（--workers N）の結果が一致することを確認します。差分取り込み
+（追記・書き換え・ファイルの削除と名前の変更）の結果も確認します。
+
+使い方:
+    python3 -m unittest discover tests
+    python3 -m unittest tests.test_usage_backends.BackendAgreementTest
+"""
+import json
+import math
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from tests.support import CONFIG_FILES, ENGINE_TIMEOUT, REPO_ROOT, run_engine, write_window_state
+
+GENERATOR = REPO_ROOT / 'tools' / 'gen-transcripts.py'
+
+# 比較するフィールド（legacy はメッセージ数の互換表示で、store は parent_uuid を
+# ファイルをまたいで結合するため応答待ちのメッセージのモデルが異なることがある）
+COMPARED_FIELDS = ('windowStart', 'windowEnd', 'tokens', 'modelBreakdown', 'modelPercents',
+                   'usageBreakdown', 'tokenPercent', 'remainingPercent', 'windows')
+SESSION_FIELDS = ('sessions', 'activeSessions')
+BACKENDS = {
+    'scan': [],
+    'store': ['--store'],
+    'columnar': ['--columnar'],
+    'workers': ['--workers', '3']
+}
+USAGE_WINDOWS = [
+    {'name': '5h', 'type': 'fixed', 'hours': 5},
+    {'name': '24h', 'type': 'rolling', 'hours': 24, 'perModel': True}
+]
+WINDOW_AGE = timedelta(hours=4)  # ウィンドウ開始時刻（生成したログの大半が含まれる）
+REL_TOLERANCE = 1e-9             # 浮動小数点の加算順序による差を許容する
+
+
+def generate_corpus(home, seed=7):
+    """HOME 配下に合成コーパスを生成し、ウィンドウ設定を書き込む"""
+    subprocess.run(
+        [sys.executable, str(GENERATOR), str(home), '--projects', '2', '--sessions', '3',
+         '--lines', '600', '--span-hours', '3', '--seed', str(seed), '--resume-rate', '0.3'],
+        check=True, capture_output=True, timeout=ENGINE_TIMEOUT
+    )
+    config_file = home / '.claude' / 'usage-config.json'
+    config = json.loads(config_file.read_text(encoding='utf-8'))
+    config['windows'] = USAGE_WINDOWS
+    config_file.write_text(json.dumps(config), encoding='utf-8')
+
+
+def transcript_files(home):
+    return sorted((home / '.claude' / 'projects').rglob('*.jsonl'))
+
+
+class CorpusTestCase(unittest.TestCase):
+    """合成コーパスをクラスごとに1回生成し、テストごとに複製して使う"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus_dir = Path(tempfile.mkdtemp(prefix='usage-corpus-'))
+        generate_corpus(cls.corpus_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.corpus_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp(prefix='usage-home-'))
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.window_start = datetime.now(timezone.utc) - WINDOW_AGE
+
+    def make_home(self, name):
+        """コーパスを複製した HOME を作る（ウィンドウ状態は共通の開始時刻）"""
+        home = self.work_dir / name
+        shutil.copytree(self.corpus_dir, home, symlinks=True)
+        write_window_state(home, self.window_start)
+        return home
+
+    def run_backend(self, home, backend):
+        # リセット判定の状態を毎回揃える（実行のたびに firstMessageTimestamp などが更新される）
+        write_window_state(home, self.window_start)
+        return run_engine(home, *BACKENDS[backend])
+
+    def assertUsageEqual(self, expected, actual, label, sessions=True):
+        """
+        比較対象のフィールドが一致することを確認（浮動小数点は相対誤差で比較）
+
+        sessions=False ではセッション別の内訳（上位とアクティブなセッション数）を比較しない。
+        再開したセッションに複製されたイベントは先に読んだファイルに数えるため、
+        追記を取り込む順序によってどのセッションに数えるかが変わる（合計は変わらない）。
+        """
+        for field in COMPARED_FIELDS:
+            self.assertIn(field, expected, f'{label}: {field}')
+            expected_value = normalize_field(field, expected[field])
+            actual_value = normalize_field(field, actual.get(field))
+            if field == 'usageBreakdown' and not sessions:
+                expected_value, actual_value = without_sessions(expected_value), without_sessions(actual_value)
+            self._assert_close(expected_value, actual_value, f'{label}: {field}')
+
+    def _assert_close(self, expected, actual, path):
+        if isinstance(expected, float) or isinstance(actual, float):
+            self.assertIsInstance(actual, (int, float), path)
+            self.assertTrue(math.isclose(expected, actual, rel_tol=REL_TOLERANCE, abs_tol=1e-9),
+                            f'{path}: {expected!r} != {actual!r}')
+        elif isinstance(expected, dict):
+            self.assertIsInstance(actual, dict, path)
+            self.assertEqual(sorted(expected), sorted(actual), path)
+            for key in expected:
+                self._assert_close(expected[key], actual[key], f'{path}.{key}')
+        elif isinstance(expected, list):
+            self.assertIsInstance(actual, list, path)
+            self.assertEqual(len(expected), len(actual), path)
+            for index, (a, b) in enumerate(zip(expected, actual)):
+                self._assert_close(a, b, f'{path}[{index}]')
+        else:
+            self.assertEqual(expected, actual, path)
+
+
+def without_sessions(breakdown):
+    """usageBreakdown からセッション単位の値（プロジェクトごとのセッション数を含む）を除く"""
+    breakdown = {key: value for key, value in breakdown.items() if key not in SESSION_FIELDS}
+    breakdown['projects'] = [
+        {key: value for key, value in project.items() if key != 'sessions'} for project in breakdown['projects']
+    ]
+    return breakdown
+
+
+def normalize_field(field, value):
+    """実行時刻に依存する値を除く（ローリングウィンドウの開始・終了時刻）"""
+    if field != 'windows' or not isinstance(value, dict):
+        return value
+    return {
+        name: {key: v for key, v in window.items() if not (window.get('type') == 'rolling' and key in ('start', 'end'))}
+        for name, window in value.items()
+    }
+
+
+class BackendAgreementTest(CorpusTestCase):
+    """同じログに対して全ての集計方法が同じ結果を返す"""
+
+    def test_cold_run(self):
+        home = self.make_home('cold')
+        results = {backend: self.run_backend(home, backend) for backend in BACKENDS}
+        self.assertGreater(results['scan']['tokens']['raw']['total'], 0)
+        for backend in BACKENDS:
+            self.assertUsageEqual(results['scan'], results[backend], backend)
+
+    def test_warm_run(self):
+        """チェックポイント・ストアが作成済みの2回目以降も結果が変わらない"""
+        home = self.make_home('warm')
+        first = {backend: self.run_backend(home, backend) for backend in BACKENDS}
+        for backend in BACKENDS:
+            self.assertUsageEqual(first[backend], self.run_backend(home, backend), backend)
+
+
+class IncrementalIngestTest(CorpusTestCase):
+    """差分取り込み（チェックポイントからの再開・無効化）の結果が全件走査と一致する"""
+
+    def cold_scan(self, home, name):
+        """同じログを新しい HOME で走査し直した結果"""
+        fresh = self.work_dir / name
+        shutil.copytree(home / '.claude' / 'projects', fresh / '.claude' / 'projects')
+        for config in ('usage-config.json', *CONFIG_FILES):
+            shutil.copy2(home / '.claude' / config, fresh / '.claude' / config)
+        return self.run_backend(fresh, 'scan')
+
+    def assertBackendsMatchColdScan(self, home, label, backends=BACKENDS):
+        expected = self.cold_scan(home, f'{label}-cold')
+        for backend in backends:
+            self.assertUsageEqual(expected, self.run_backend(home, backend), f'{label}: {backend}', sessions=False)
+
+    def truncate_transcripts(self, home):
+        """各ファイルを途中で切り詰め、残りの行を返す（ファイルごとにばらばらの位置で切る）"""
+        rest = {}
+        for index, path in enumerate(transcript_files(home)):
+            lines = path.read_bytes().splitlines(keepends=True)
+            cut = len(lines) * (3 + index % 5) // 10
+            path.write_bytes(b''.join(lines[:cut]))
+            rest[path] = lines[cut:]
+        return rest
+
+    def test_append_in_stages(self):
+        """追記を取り込むたびに全件走査と一致する（列指向ストアは時刻が前後する行を含む）"""
+        home = self.make_home('append')
+        rest = self.truncate_transcripts(home)
+        self.assertBackendsMatchColdScan(home, 'stage0')
+
+        for stage in (1, 2):
+            for path, lines in rest.items():
+                chunk = lines[:len(lines) // 2 + 1] if stage == 1 else lines
+                rest[path] = lines[len(chunk):]
+                with open(path, 'ab') as f:
+                    f.write(b''.join(chunk))
+            self.assertBackendsMatchColdScan(home, f'stage{stage}')
+
+        meta = json.loads((home / '.claude' / 'cache' / 'usage-columns' / 'meta.json').read_text(encoding='utf-8'))
+        self.assertNotIn('merge', meta)
+
+    def test_append_partial_line(self):
+        """書き込み途中の行は完成してから取り込まれる"""
+        home = self.make_home('partial')
+        path = transcript_files(home)[0]
+        lines = path.read_bytes().splitlines(keepends=True)
+        tail = lines[-1]
+        path.write_bytes(b''.join(lines[:-1]) + tail[:len(tail) // 2])
+        self.assertBackendsMatchColdScan(home, 'partial')
+
+        with open(path, 'ab') as f:
+            f.write(tail[len(tail) // 2:])
+        self.assertBackendsMatchColdScan(home, 'completed')
+
+    def test_rewritten_file(self):
+        """
+        ファイルが短く書き換えられた場合は取り込み済みの内容を捨てて読み直す
+
+        消えたイベントが再開したセッションに複製されていれば、そちらで数え直す。
+        """
+        home = self.make_home('rewrite')
+        self.assertBackendsMatchColdScan(home, 'before')
+
+        path = transcript_files(home)[1]
+        lines = path.read_bytes().splitlines(keepends=True)
+        path.write_bytes(b''.join(lines[:len(lines) // 3]))
+        self.assertBackendsMatchColdScan(home, 'rewritten')
+
+    def test_deleted_and_renamed_files(self):
+        """
+        削除されたファイルの使用量は除かれ、名前を変えたファイルは二重に数えない
+
+        イベントストア・列指向ストアは削除済みのトランスクリプトのイベントを残すため、
+        削除前の合計のまま変わらない。
+        """
+        home = self.make_home('rotate')
+        before = self.run_backend(home, 'scan')
+        self.assertBackendsMatchColdScan(home, 'before')
+
+        files = transcript_files(home)
+        files[0].unlink()
+        files[-1].rename(files[-1].with_name('renamed-' + files[-1].name))
+        self.assertBackendsMatchColdScan(home, 'rotated', ['scan', 'workers'])
+        for backend in ('store', 'columnar'):
+            self.assertUsageEqual(before, self.run_backend(home, backend), f'rotated: {backend}', sessions=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
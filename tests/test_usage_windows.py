@@ -0,0 +1,74 @@
+"""複数ウィンドウ（windows）の同時集計のテスト"""
+import contextlib
+import io
+import json
+import os
+import unittest
+
+from tests.support import EngineTestCase, HAIKU, assistant_event, load_engine, write_transcript
+
+USAGE_WINDOWS = [
+    {'name': '5h', 'type': 'fixed', 'hours': 5},
+    {'name': '24h', 'type': 'rolling', 'hours': 24, 'perModel': True}
+]
+
+
+class UsageWindowsTest(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_config(USAGE_WINDOWS)
+
+    def write_config(self, windows):
+        (self.home / '.claude' / 'usage-config.json').write_text(
+            json.dumps({'plan': self.plan, 'windows': windows}), encoding='utf-8')
+
+    def write_old_transcript(self, minutes):
+        """ウィンドウ開始より前に書き込まれ、それ以降更新されていないトランスクリプト"""
+        path = write_transcript(self.home, 'project-old', 'session-old', [
+            assistant_event(self.minutes_ago(minutes), model=HAIKU, input_tokens=1000)
+        ])
+        mtime = self.minutes_ago(minutes).timestamp()
+        os.utime(path, (mtime, mtime))
+
+    def test_rolling_window_includes_earlier_events(self):
+        """rolling ウィンドウは5時間ウィンドウの開始より前のイベントも数える"""
+        self.write_old_transcript(180)
+        write_transcript(self.home, 'project-a', 'session-1', [assistant_event(self.minutes_ago(10))])
+
+        windows = self.cold_run()['windows']
+        self.assertEqual(list(windows), ['5h', '24h'])
+        self.assertEqual(windows['5h']['requests'], 1)
+        self.assertEqual(windows['5h']['tokens']['raw']['input'], 100)
+        self.assertEqual(windows['24h']['requests'], 2)
+        self.assertEqual(windows['24h']['tokens']['raw']['input'], 1100)
+        self.assertEqual(sorted(windows['24h']['byModel']), ['haiku', 'sonnet'])
+
+    def test_store_and_columnar_read_bucket_range(self):
+        """--store / --columnar もウィンドウ開始より前に更新されたログを rolling ウィンドウに含める"""
+        self.write_old_transcript(180)
+        write_transcript(self.home, 'project-a', 'session-1', [assistant_event(self.minutes_ago(10))])
+
+        expected = self.cold_run()['windows']['24h']
+        for backend in ('--store', '--columnar'):
+            with self.subTest(backend=backend):
+                actual = self.cold_run(backend)['windows']['24h']
+                self.assertEqual(expected['requests'], actual['requests'])
+                self.assertEqual(expected['tokens'], actual['tokens'])
+
+    def test_fixed_window_requires_five_hours(self):
+        """fixed ウィンドウの hours が 5 以外なら警告を出して無視する"""
+        definitions = [
+            {'name': '5h', 'type': 'fixed', 'hours': 5},
+            {'name': '8h', 'type': 'fixed', 'hours': 8},
+            {'name': '8h-rolling', 'type': 'rolling', 'hours': 8}
+        ]
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            windows = load_engine().parse_usage_windows(definitions)
+        self.assertEqual([w['name'] for w in windows], ['5h', '8h-rolling'])
+        self.assertIn("Ignoring fixed window '8h'", stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+トランスクリプトの列挙（iter_transcripts）のテスト
+
+os.scandir による列挙の順序と、更新日時による絞り込み・古いディレクトリの
+stat の省略を確認します。
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from tests.support import load_engine
+
+DAY = 24 * 3600
+
+
+class IterTranscriptsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = load_engine()
+        self.root = Path(tempfile.mkdtemp(prefix='usage-walk-'))
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.now = time.time()
+
+    def make_file(self, relative, age=0):
+        path = self.root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('{}\n', encoding='utf-8')
+        os.utime(path, (self.now - age, self.now - age))
+        return path
+
+    def set_dir_age(self, relative, age):
+        os.utime(self.root / relative, (self.now - age, self.now - age))
+
+    def walk(self, since=None):
+        return [path.relative_to(self.root).as_posix() for path, _ in self.engine.iter_transcripts(self.root, since)]
+
+    def test_lists_transcripts_in_name_order(self):
+        self.make_file('b/2.jsonl')
+        self.make_file('a/1.jsonl')
+        self.make_file('a/sub/3.jsonl')
+        self.make_file('a/notes.txt')
+        self.assertEqual(self.walk(), ['a/1.jsonl', 'a/sub/3.jsonl', 'b/2.jsonl'])
+
+    def test_since_skips_old_files(self):
+        self.make_file('p/recent.jsonl', age=60)
+        self.make_file('p/old.jsonl', age=2 * DAY)
+        since = datetime.fromtimestamp(self.now - DAY, timezone.utc)
+        self.assertEqual(self.walk(since), ['p/recent.jsonl'])
+
+    def test_stale_directories_are_pruned(self):
+        """since - DIR_PRUNE_GRACE より古いディレクトリ直下は stat しない（サブディレクトリは確認する）"""
+        self.make_file('stale/appended.jsonl', age=60)
+        self.make_file('stale/sub/new.jsonl', age=60)
+        self.make_file('active/session.jsonl', age=60)
+        stale_age = self.engine.DIR_PRUNE_GRACE.total_seconds() + 2 * DAY
+        self.set_dir_age('stale', stale_age)
+
+        since = datetime.fromtimestamp(self.now - DAY, timezone.utc)
+        self.assertEqual(self.walk(since), ['active/session.jsonl', 'stale/sub/new.jsonl'])
+        # since を指定しなければ全て列挙する
+        self.assertEqual(self.walk(), ['active/session.jsonl', 'stale/appended.jsonl', 'stale/sub/new.jsonl'])
+
+    def test_directory_within_grace_is_read(self):
+        """ディレクトリの mtime は追記では変わらないため、猶予期間内なら直下のファイルを確認する"""
+        self.make_file('p/long-session.jsonl', age=60)
+        self.set_dir_age('p', 3 * DAY)
+        since = datetime.fromtimestamp(self.now - DAY, timezone.utc)
+        self.assertGreater(self.engine.DIR_PRUNE_GRACE, timedelta(days=3))
+        self.assertEqual(self.walk(since), ['p/long-session.jsonl'])
+
+
+if __name__ == '__main__':
+    unittest.main()
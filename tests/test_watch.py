@@ -0,0 +1,139 @@
+"""
+--watch モードのテスト
+
+ウォッチャー（inotify・stat ポーリング）が追記を検知すること、ポーリングが
+ウィンドウより前に更新されたファイルを比較しないこと、常駐プロセスが
+キャッシュを更新し続け、設定ファイルの変更を反映することを確認します。
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from tests.support import SCRIPT, EngineTestCase, assistant_event, load_engine, write_transcript
+
+WAIT_TIMEOUT = 10.0
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = load_engine()
+        self.root = Path(tempfile.mkdtemp(prefix='usage-watch-'))
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.transcript = self.root / 'project' / 'session.jsonl'
+        self.transcript.parent.mkdir()
+        self.transcript.write_text('{}\n', encoding='utf-8')
+
+    def append_line(self, path):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('{}\n')
+
+    def test_polling_detects_append(self):
+        watcher = self.engine.PollingWatcher(self.root, interval=0.05)
+        self.append_line(self.transcript)
+        self.assertTrue(watcher.wait(WAIT_TIMEOUT))
+        self.assertFalse(watcher.wait(0.2))
+
+    def test_polling_skips_files_before_since(self):
+        old = self.root / 'project' / 'old.jsonl'
+        old.write_text('{}\n', encoding='utf-8')
+        stale = time.time() - 3600
+        os.utime(old, (stale, stale))
+
+        since = datetime.now(timezone.utc) - timedelta(minutes=5)
+        watcher = self.engine.PollingWatcher(self.root, interval=0.05, since=lambda: since)
+        self.assertEqual(set(watcher._take_snapshot()), {str(self.transcript)})
+
+        # 更新されたファイルは範囲に入るため検知する
+        self.append_line(old)
+        self.assertTrue(watcher.wait(WAIT_TIMEOUT))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify は Linux のみ')
+    def test_inotify_detects_new_project(self):
+        watcher = self.engine.InotifyWatcher(self.root)
+        self.addCleanup(watcher.close)
+        new_file = self.root / 'new-project' / 'session.jsonl'
+        new_file.parent.mkdir()
+        self.assertTrue(watcher.wait(WAIT_TIMEOUT))
+        watcher.drain()
+
+        new_file.write_text('{}\n', encoding='utf-8')
+        self.assertTrue(watcher.wait(WAIT_TIMEOUT))
+
+
+class WatchModeTest(EngineTestCase):
+
+    def start_watch(self, *args):
+        process = subprocess.Popen(
+            [sys.executable, str(SCRIPT), '--watch', *args],
+            env={**os.environ, 'HOME': str(self.home)},
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+
+        def stop():
+            process.terminate()
+            process.wait(WAIT_TIMEOUT)
+            process.stderr.close()
+        self.addCleanup(stop)
+        return process
+
+    def wait_for_cache(self, predicate):
+        cache_file = self.home / '.claude' / 'cache' / 'ccusage-cache.json'
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                cache = json.loads(cache_file.read_text(encoding='utf-8'))
+                if predicate(cache):
+                    return cache
+            except (OSError, ValueError):
+                pass
+            time.sleep(0.05)
+        self.fail('ccusage-cache.json was not updated')
+
+    def output_tokens(self, cache):
+        return (cache.get('tokens') or {}).get('raw', {}).get('output')
+
+    def test_watch_updates_cache_on_append(self):
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(30), output_tokens=5)])
+        self.start_watch()
+        self.wait_for_cache(lambda cache: self.output_tokens(cache) == 5)
+
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(1), output_tokens=6)], append=True)
+        self.wait_for_cache(lambda cache: self.output_tokens(cache) == 11)
+
+    def test_watch_reloads_config(self):
+        """常駐中に変更したプラン設定は次の再計算から反映される"""
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(30), output_tokens=5)])
+        self.start_watch()
+        self.wait_for_cache(lambda cache: cache.get('plan') == self.plan)
+
+        (self.home / '.claude' / 'usage-config.json').write_text(json.dumps({'plan': 'pro'}), encoding='utf-8')
+        write_transcript(self.home, 'p', 's', [assistant_event(self.minutes_ago(1), output_tokens=6)], append=True)
+        self.wait_for_cache(lambda cache: cache.get('plan') == 'pro' and self.output_tokens(cache) == 11)
+
+    def test_watch_store_catches_up_history(self):
+        """--watch --store は起動時にウィンドウより前のトランスクリプトも取り込む"""
+        old = write_transcript(self.home, 'p', 'old', [assistant_event(self.minutes_ago(600))])
+        stale = self.window_start.timestamp() - 3600
+        os.utime(old, (stale, stale))
+        write_transcript(self.home, 'p', 'recent', [assistant_event(self.minutes_ago(10), output_tokens=7)])
+
+        self.start_watch('--store')
+        self.wait_for_cache(lambda cache: self.output_tokens(cache) == 7)
+        with closing(sqlite3.connect(self.home / '.claude' / 'usage-events.db')) as conn:
+            paths = {row[0] for row in conn.execute('SELECT path FROM files')}
+        self.assertIn(str(old), paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
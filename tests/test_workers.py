@@ -0,0 +1,54 @@
+"""
+並列走査（--workers N）のテスト
+
+プロセスプールで走査した結果とチェックポイントが直列実行と一致することを確認します。
+"""
+
+import json
+import unittest
+
+from tests.support import EngineTestCase, HAIKU, OPUS, assistant_event, user_event, write_transcript
+
+MODELS = (None, HAIKU, OPUS)
+
+
+class ParallelScanTest(EngineTestCase):
+
+    def write_sessions(self, count, append=False):
+        for n in range(count):
+            model = MODELS[n % len(MODELS)]
+            events = [user_event(self.minutes_ago(55 - n)),
+                      assistant_event(self.minutes_ago(54 - n), output_tokens=10 + n, cache_read=100 * n)]
+            if model is not None:
+                events.append(assistant_event(self.minutes_ago(30 - n), model=model, output_tokens=n + 1))
+            write_transcript(self.home, f'project-{n % 3}', f'session-{n}', events, append=append)
+
+    def read_checkpoint_files(self):
+        path = self.home / '.claude' / 'cache' / 'usage-checkpoint.json'
+        return json.loads(path.read_text(encoding='utf-8'))['files']
+
+    def test_parallel_matches_serial(self):
+        self.write_sessions(8)
+        serial = self.cold_run()
+        serial_checkpoint = self.read_checkpoint_files()
+
+        parallel = self.cold_run('--workers', '3')
+        self.assertTokensEqual(serial, parallel)
+        self.assertEqual(serial['legacy'], parallel['legacy'])
+        self.assertEqual(serial_checkpoint, self.read_checkpoint_files())
+
+    def test_parallel_incremental(self):
+        self.write_sessions(6)
+        self.run_engine('--workers', '4')
+        self.write_sessions(3, append=True)
+
+        parallel = self.run_engine('--workers', '4')
+        self.assertTokensEqual(self.cold_run(), parallel)
+
+    def test_cpu_count_workers(self):
+        self.write_sessions(2)
+        self.assertTokensEqual(self.cold_run(), self.cold_run('--workers', '0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
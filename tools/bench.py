@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+get-message-usage.py のベンチマークスクリプト
+
+tools/gen-transcripts.py で生成した合成コーパス（small / medium / huge）に対して、
+主要な処理の実行時間・ピークメモリ（RSS）・スループットを計測し、JSON で出力します。
+
+計測対象:
+    calculate_message_usage  初回（キャッシュなし）と2回目以降（チェックポイント利用）
+    find_latest_activity     最新アクティビティの検索
+    interpolate_percent      キャリブレーション曲線の補間（1回あたりの時間）
+    statusline               ステータスライン1行の描画（render_statusline）
+
+各計測は HOME を合成コーパスに向けた別プロセスで実行するため、ピーク RSS は計測ごとの値です。
+コーパスは --work-dir に生成して再利用します（生成条件が変わったか、基準時刻から
+CORPUS_MAX_AGE 以上経った場合は生成し直します）。
+
+使い方:
+    python3 tools/bench.py                                   # small, medium
+    python3 tools/bench.py --preset huge --source store
+    python3 tools/bench.py --preset small --repeat 20 > before.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SCRIPT = REPO_ROOT / 'install-to-home' / 'required' / 'get-message-usage.py'
+GENERATOR = Path(__file__).resolve().parent / 'gen-transcripts.py'
+MANIFEST_NAME = 'bench-corpus.json'
+
+BENCHMARKS = ('calculate_message_usage', 'find_latest_activity', 'interpolate_percent', 'statusline')
+DEFAULT_PRESETS = 'small,medium'
+DEFAULT_REPEAT = 5
+DEFAULT_SEED = 1
+CORPUS_MAX_AGE = timedelta(hours=1)  # ウィンドウ（5時間）内にイベントが残るよう、古いコーパスは作り直す
+INTERPOLATE_CALLS = 100000
+INTERPOLATE_MODEL = 'opus-4.5'  # 補間曲線を借りる model-calibration.json のモデル
+
+
+def summarize(values):
+    return {
+        'min': round(min(values), 3),
+        'median': round(statistics.median(values), 3),
+        'max': round(max(values), 3)
+    }
+
+
+def peak_rss_mb():
+    """
+    このプロセス（と終了済みの子プロセス）のピーク RSS
+
+    Returns:
+        float or None: MB 単位（resource モジュールがない環境では None）
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux は KB、macOS はバイト単位
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / scale, 1)
+
+
+def load_engine(script):
+    """get-message-usage.py をモジュールとして読み込む（ファイル名にハイフンがあるため）"""
+    spec = importlib.util.spec_from_file_location('get_message_usage', script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reset_state(home):
+    """前回の計測で作られたキャッシュ・ストアを消し、進行中のウィンドウ状態を書き込む"""
+    claude_dir = home / '.claude'
+    shutil.rmtree(claude_dir / 'cache', ignore_errors=True)
+    for name in ('usage-events.db', 'usage-events.db-wal', 'usage-events.db-shm',
+                 'usage-window-ledger.jsonl'):
+        try:
+            (claude_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    # 2時間前の正時に開始したウィンドウ（リセットが起きないようにする）
+    window_start = (datetime.now(timezone.utc) - timedelta(hours=2)).replace(minute=0, second=0, microsecond=0)
+    with open(claude_dir / 'usage-window.json', 'w', encoding='utf-8') as f:
+        json.dump({'windowStart': window_start.isoformat(),
+                   'firstMessageTimestamp': window_start.isoformat()}, f, indent=2)
+
+
+def time_calls(func, repeat):
+    """func を repeat 回呼び、(各回の ms のリスト, 最後の戻り値) を返す"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, result
+
+
+def bench_calculate(engine, options):
+    """calculate_message_usage: 初回（全走査）と2回目以降（差分なし）の時間"""
+    def run():
+        return engine.calculate_message_usage(source=options.source, workers=options.workers)
+
+    cold_ms, result = time_calls(run, 1)
+    warm_ms, _ = time_calls(run, options.repeat)
+
+    scan_stats = result.get('scanStats') or {}
+    events = scan_stats.get('linesParsed', 0) + scan_stats.get('linesSkipped', 0)
+    return {
+        'coldMs': round(cold_ms[0], 3),
+        'wallMs': summarize(warm_ms),
+        'events': events,
+        'eventsPerSec': round(events / (cold_ms[0] / 1000)) if cold_ms[0] > 0 else None,
+        'tokenPercent': result.get('tokenPercent')
+    }
+
+
+def bench_latest_activity(engine, options):
+    """find_latest_activity: 全ファイルからの最新アクティビティ検索"""
+    log_dir = engine.get_log_directory()
+    timings, latest = time_calls(lambda: engine.find_latest_activity(log_dir), options.repeat)
+    return {
+        'wallMs': summarize(timings),
+        'callsPerSec': round(1000 / statistics.median(timings)),
+        'latest': latest.isoformat() if latest else None
+    }
+
+
+def bench_interpolate(engine, options):
+    """interpolate_percent: INTERPOLATE_CALLS 回の補間をまとめて計測"""
+    config = engine.load_model_calibration().get('models', {}).get(INTERPOLATE_MODEL, {})
+    data_points = config.get('data_points') or []
+    if not data_points:
+        return {'error': f'no data_points for {INTERPOLATE_MODEL} in model-calibration.json'}
+
+    upper = max(point['raw_tokens'] for point in data_points) * 1.2
+    inputs = [upper * i / INTERPOLATE_CALLS for i in range(INTERPOLATE_CALLS)]
+
+    def run():
+        for raw_tokens in inputs:
+            engine.interpolate_percent(raw_tokens, data_points)
+
+    timings, _ = time_calls(run, options.repeat)
+    median_ms = statistics.median(timings)
+    return {
+        'calls': INTERPOLATE_CALLS,
+        'wallMs': summarize(timings),
+        'nsPerCall': round(median_ms * 1e6 / INTERPOLATE_CALLS, 1),
+        'callsPerSec': round(INTERPOLATE_CALLS / (median_ms / 1000))
+    }
+
+
+def bench_statusline(engine, options):
+    """render_statusline: 最新トランスクリプトと使用率キャッシュを読む1行の描画"""
+    # 描画が読む ccusage-cache.json を先に作っておく（計測には含めない）
+    engine.update_usage_cache(source=options.source, workers=options.workers)
+
+    log_dir = engine.get_log_directory()
+    newest = max(log_dir.glob('*/*.jsonl'), key=lambda path: path.stat().st_mtime, default=None)
+    data = {
+        'model': {'display_name': 'Unknown'},
+        'workspace': {'current_dir': str(Path.cwd())},
+        'transcript_path': str(newest) if newest else None,
+        'context_window': {'context_window_size': 200000,
+                           'current_usage': {'input_tokens': 1200, 'output_tokens': 800,
+                                             'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 40000}}
+    }
+    timings, line = time_calls(lambda: engine.render_statusline(data), options.repeat)
+    return {
+        'wallMs': summarize(timings),
+        'callsPerSec': round(1000 / statistics.median(timings)),
+        'line': line
+    }
+
+
+WORKER_BENCHMARKS = {
+    'calculate_message_usage': bench_calculate,
+    'find_latest_activity': bench_latest_activity,
+    'interpolate_percent': bench_interpolate,
+    'statusline': bench_statusline
+}
+
+
+def run_worker(options):
+    """
+    計測プロセス側: HOME（合成コーパス）で1つのベンチマークを実行し、結果を標準出力に書く
+
+    モジュールのパス定数は import 時に HOME から決まるため、親プロセスが HOME を設定して起動する。
+    """
+    home = Path(os.environ['HOME'])
+    reset_state(home)
+    engine = load_engine(options.script)
+
+    started = time.perf_counter()
+    result = WORKER_BENCHMARKS[options.worker](engine, options)
+    result['totalMs'] = round((time.perf_counter() - started) * 1000, 3)
+    result['peakRssMb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def read_manifest(home):
+    try:
+        with open(home / '.claude' / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_corpus(home, preset, seed):
+    """
+    プリセットのコーパスを用意する（条件が同じで新しいものがあれば再利用）
+
+    Returns:
+        dict: コーパスのマニフェスト
+    """
+    manifest = read_manifest(home)
+    if manifest is not None and manifest.get('seed') == seed and manifest.get('preset') == preset:
+        generated = datetime.fromisoformat(manifest['now'])
+        if datetime.now(timezone.utc) - generated < CORPUS_MAX_AGE:
+            return manifest
+
+    print(f"[INFO] {preset} コーパスを生成中: {home}", file=sys.stderr)
+    subprocess.run(
+        [sys.executable, str(GENERATOR), str(home), '--preset', preset, '--seed', str(seed), '--force'],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    manifest = read_manifest(home)
+    manifest['preset'] = preset
+    with open(home / '.claude' / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def run_benchmark(name, home, options):
+    """計測プロセスを起動して結果を受け取る"""
+    command = [sys.executable, str(Path(__file__).resolve()), '--worker', name,
+               '--script', str(options.script), '--source', options.source,
+               '--workers', str(options.workers), '--repeat', str(options.repeat)]
+    env = dict(os.environ, HOME=str(home))
+    completed = subprocess.run(command, cwd=home, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1:] or f'exit {completed.returncode}'}
+    return json.loads(completed.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='get-message-usage.py のベンチマーク')
+    parser.add_argument('--preset', default=DEFAULT_PRESETS,
+                        help=f'カンマ区切りのコーパス規模 small / medium / huge（デフォルト: {DEFAULT_PRESETS}）')
+    parser.add_argument('--bench', default=','.join(BENCHMARKS),
+                        help='カンマ区切りの計測対象（デフォルト: すべて）')
+    parser.add_argument('--script', type=Path, default=DEFAULT_SCRIPT,
+                        help=f'計測する get-message-usage.py（デフォルト: {DEFAULT_SCRIPT}）')
+    parser.add_argument('--source', choices=['scan', 'store', 'columnar'], default='scan',
+                        help='calculate_message_usage の集計方法（デフォルト: scan）')
+    parser.add_argument('--workers', type=int, default=1, help='走査のワーカープロセス数（デフォルト: 1）')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'2回目以降の計測回数（デフォルト: {DEFAULT_REPEAT}）')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='コーパスの乱数シード')
+    parser.add_argument('--work-dir', type=Path,
+                        default=Path(tempfile.gettempdir()) / 'claude-usage-bench',
+                        help='コーパスを置くディレクトリ')
+    parser.add_argument('--worker', choices=BENCHMARKS, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    options.script = options.script.expanduser().resolve()
+
+    if options.worker:
+        run_worker(options)
+        return
+
+    benchmarks = [name.strip() for name in options.bench.split(',') if name.strip()]
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    report = {
+        'script': str(options.script),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'source': options.source,
+        'workers': options.workers,
+        'repeat': options.repeat,
+        'corpora': {}
+    }
+    for preset in (name.strip() for name in options.preset.split(',') if name.strip()):
+        home = options.work_dir / preset
+        manifest = ensure_corpus(home, preset, options.seed)
+        report['corpora'][preset] = {
+            'files': manifest['files'],
+            'lines': manifest['lines'],
+            'bytes': manifest['bytes'],
+            'results': {name: run_benchmark(name, home, options) for name in benchmarks}
+        }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+get-message-usage.py / claude-calibrate.py の zipapp ビルドスクリプト
+
+スクリプトをモジュールとして zipapp（.pyz）にまとめ、バイトコード（.pyc）を同梱します。
+通常のスクリプト実行では毎回ソースのコンパイルが発生しますが、.pyz から起動すると
+コンパイル済みのバイトコードがそのまま読み込まれるため、起動時間が短くなります。
+
+使い方:
+    python3 tools/build-zipapp.py                         # dist/ に出力
+    python3 tools/build-zipapp.py --output-dir ~/.claude  # インストール先に直接出力
+
+.pyz はスクリプトより新しい場合のみ daemon / status-line-wrapper.sh / claude-calibrate.py
+から使用されます（スクリプトを更新したら再ビルドしてください）。
+"""
+
+import argparse
+import py_compile
+import sys
+import tempfile
+import zipapp
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = REPO_ROOT / 'install-to-home' / 'required'
+DEFAULT_SCRIPTS = ('get-message-usage.py', 'claude-calibrate.py')
+DEFAULT_OUTPUT_DIR = REPO_ROOT / 'dist'
+INTERPRETER = '/usr/bin/env python3'
+
+MAIN_TEMPLATE = '''\
+# {script} を zipapp として実行するためのエントリーポイント（tools/build-zipapp.py が生成）
+import {module}
+
+{module}.main()
+'''
+
+
+def build_zipapp(script, output_dir):
+    """
+    スクリプト1本を zipapp にまとめる
+
+    バイトコードは UNCHECKED_HASH 形式でコンパイルする（zip 内のタイムスタンプに依存しない）。
+    実行する Python のバージョンが異なりバイトコードを使えない場合は、同梱したソースから読み込まれる。
+
+    Args:
+        script: スクリプトのパス（例: install-to-home/required/get-message-usage.py）
+        output_dir: 出力先ディレクトリ
+
+    Returns:
+        Path: 作成した .pyz のパス
+    """
+    module = script.stem.replace('-', '_')
+    target = output_dir / f'{script.stem}.pyz'
+
+    with tempfile.TemporaryDirectory() as staging:
+        staging = Path(staging)
+        source = staging / f'{module}.py'
+        source.write_bytes(script.read_bytes())
+
+        # zipimport はパッケージ直下の <module>.pyc を読み込む（__pycache__ は参照しない）
+        py_compile.compile(
+            str(source),
+            cfile=str(staging / f'{module}.pyc'),
+            dfile=script.name,
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+        )
+        (staging / '__main__.py').write_text(
+            MAIN_TEMPLATE.format(script=script.name, module=module), encoding='utf-8'
+        )
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        # 展開のコストを避けるため無圧縮で格納
+        zipapp.create_archive(staging, target, interpreter=INTERPRETER, compressed=False)
+
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='スクリプトを zipapp（.pyz）にまとめる')
+    parser.add_argument('scripts', nargs='*', metavar='SCRIPT',
+                        help=f'対象スクリプト（デフォルト: {", ".join(DEFAULT_SCRIPTS)}）')
+    parser.add_argument('--output-dir', type=Path, default=DEFAULT_OUTPUT_DIR,
+                        help=f'出力先ディレクトリ（デフォルト: {DEFAULT_OUTPUT_DIR}）')
+    args = parser.parse_args()
+
+    scripts = [Path(s) for s in args.scripts] or [SCRIPTS_DIR / name for name in DEFAULT_SCRIPTS]
+    output_dir = args.output_dir.expanduser()
+
+    for script in scripts:
+        if not script.is_file():
+            print(f"エラー: スクリプトが見つかりません: {script}", file=sys.stderr)
+            sys.exit(1)
+        target = build_zipapp(script, output_dir)
+        print(f"[BUILD] {script.name} -> {target} ({target.stat().st_size:,} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の合成トランスクリプト生成スクリプト
+
+Claude Code のログ（`~/.claude/projects/*/*.jsonl`）と同じ形式のツリーを、
+シード値から決定的に生成します。同じ引数（--seed / --now を含む）なら同じバイト列になります。
+
+再現できる要素:
+    - プロジェクト数・プロジェクトごとのセッション数・ファイルあたりの行数
+    - モデルの混在比率
+    - ストリーミングによる重複行（同じ message.id / requestId の assistant 行）
+    - 再開したセッション（直前のセッションの履歴を複製した新しいファイル）
+    - gzip 圧縮済みのアーカイブ（ローテーションで圧縮した .jsonl.gz）
+    - 巨大なツール実行結果の行
+    - 壊れた行（書き込み途中で切れた JSON など）
+
+使い方:
+    python3 tools/gen-transcripts.py /tmp/bench-home --preset small
+    python3 tools/gen-transcripts.py /tmp/bench-home --preset medium --seed 2 --force
+    python3 tools/gen-transcripts.py /tmp/bench-home --projects 3 --sessions 5 --lines 2000 \\
+        --model-mix opus=1,sonnet=3 --duplicate-rate 0.5 --malformed-rate 0.01
+
+生成先は OUTPUT/.claude/projects/ です。HOME=OUTPUT で get-message-usage.py を実行すると
+生成したログが集計されます。生成条件と件数は OUTPUT/.claude/bench-corpus.json に記録します。
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CONFIG_DIR = REPO_ROOT / 'install-to-home' / 'required'
+CONFIG_FILES = ('usage-config.json', 'model-calibration.json', 'usage-calibration.json')
+MANIFEST_NAME = 'bench-corpus.json'
+
+# コーパスの規模（--projects / --sessions / --lines で個別に上書きできる）
+PRESETS = {
+    'small': {'projects': 2, 'sessions': 4, 'lines': 500},
+    'medium': {'projects': 6, 'sessions': 12, 'lines': 2000},
+    'huge': {'projects': 10, 'sessions': 20, 'lines': 5000}
+}
+DEFAULT_PRESET = 'small'
+
+# モデル名（model-calibration.json の match_patterns に一致するもの）
+MODEL_NAMES = {
+    'opus': 'claude-opus-4-5-20251101',
+    'sonnet': 'claude-sonnet-4-5-20250929',
+    'haiku': 'claude-haiku-4-5-20251001'
+}
+DEFAULT_MODEL_MIX = 'opus=2,sonnet=6,haiku=2'
+
+DEFAULT_SPAN_HOURS = 24.0        # セッションの終了時刻を分散させる範囲（現在時刻からさかのぼる時間）
+DEFAULT_DUPLICATE_RATE = 0.4     # assistant 応答がストリーミングで複数行に分かれる確率
+DEFAULT_TOOL_RATE = 0.6          # assistant 応答の後にツール実行が続く確率
+DEFAULT_SIDECHAIN_RATE = 0.05    # ユーザー入力がサブエージェント（サイドチェーン）のものである確率
+DEFAULT_HUGE_LINE_RATE = 0.002   # ツール実行結果が巨大な行になる確率
+DEFAULT_HUGE_LINE_BYTES = 2 * 1024 * 1024
+DEFAULT_MALFORMED_RATE = 0.001   # 壊れた行を挟む確率（1行ごと）
+DEFAULT_RESUME_RATE = 0.1        # セッションが直前のセッションの再開（履歴の複製から始まる）である確率
+DEFAULT_ARCHIVE_RATE = 0.0       # セッションを gzip 圧縮済みのアーカイブ（.jsonl.gz）として書く確率
+
+
+def parse_model_mix(spec):
+    """
+    'opus=2,sonnet=6' 形式のモデル比率を解析
+
+    Args:
+        spec: モデル比率の文字列（名前は MODEL_NAMES のキーか完全なモデル名）
+
+    Returns:
+        tuple: (モデル名のリスト, 重みのリスト)
+    """
+    names = []
+    weights = []
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        if not name:
+            continue
+        try:
+            value = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid weight in model mix: {item}')
+        if value <= 0:
+            continue
+        names.append(MODEL_NAMES.get(name, name))
+        weights.append(value)
+    if not names:
+        raise argparse.ArgumentTypeError(f'empty model mix: {spec}')
+    return names, weights
+
+
+def format_timestamp(dt):
+    """Claude Code と同じ形式（ミリ秒 + Z）のタイムスタンプ文字列"""
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond // 1000:03d}Z'
+
+
+class SessionWriter:
+    """
+    1セッション分の JSONL 行を生成する
+
+    行は (秒オフセット, dict) で組み立て、最後にセッション終了時刻に合わせて
+    タイムスタンプを確定させる。
+    """
+
+    def __init__(self, rng, options, session_id, cwd):
+        self.rng = rng
+        self.options = options
+        self.session_id = session_id
+        self.cwd = cwd
+        self.lines = []
+        self.elapsed = 0.0
+        self.parent_uuid = None
+        self.counts = {'assistantLines': 0, 'assistantResponses': 0, 'userPrompts': 0,
+                       'toolResults': 0, 'hugeLines': 0, 'malformedLines': 0}
+
+    def new_uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def append(self, entry):
+        entry.setdefault('sessionId', self.session_id)
+        entry.setdefault('cwd', self.cwd)
+        self.lines.append((self.elapsed, entry))
+
+    def advance(self, low, high):
+        self.elapsed += self.rng.uniform(low, high)
+
+    def add_user_prompt(self):
+        rng = self.rng
+        self.advance(5, 120)
+        prompt_uuid = self.new_uuid()
+        text = 'Please update the implementation ' + 'and tests ' * rng.randint(1, 40)
+        # 文字列形式と text 配列形式の両方を混ぜる
+        content = text if rng.random() < 0.5 else [{'type': 'text', 'text': text}]
+        self.append({
+            'parentUuid': self.parent_uuid,
+            'isSidechain': rng.random() < self.options.sidechain_rate,
+            'type': 'user',
+            'message': {'role': 'user', 'content': content},
+            'uuid': prompt_uuid,
+            'timestamp': None
+        })
+        self.parent_uuid = prompt_uuid
+        self.counts['userPrompts'] += 1
+
+    def add_assistant_response(self, model_name, with_tool_use):
+        rng = self.rng
+        self.advance(2, 40)
+        message_id = f'msg_{rng.getrandbits(96):024x}'
+        request_id = f'req_{rng.getrandbits(96):024x}'
+        usage = {
+            'input_tokens': rng.randint(1, 400),
+            'cache_creation_input_tokens': rng.randint(0, 20000),
+            'cache_read_input_tokens': rng.randint(0, 200000),
+            'output_tokens': rng.randint(1, 4000),
+            'service_tier': 'standard'
+        }
+
+        # ストリーミングでは content ブロックごとに同じ message.id / usage の行が書かれる
+        blocks = [{'type': 'text', 'text': 'Working on it. ' * rng.randint(1, 30)}]
+        if rng.random() < self.options.duplicate_rate:
+            blocks.insert(0, {'type': 'thinking', 'thinking': 'Let me think. ' * rng.randint(1, 60),
+                              'signature': f'{rng.getrandbits(256):064x}'})
+            if rng.random() < 0.5:
+                blocks.append({'type': 'text', 'text': 'Also. ' * rng.randint(1, 10)})
+        if with_tool_use:
+            blocks.append({'type': 'tool_use', 'id': f'toolu_{rng.getrandbits(96):024x}', 'name': 'Bash',
+                           'input': {'command': 'ls -la', 'description': 'List files'}})
+
+        stop_reason = 'tool_use' if with_tool_use else 'end_turn'
+        for index, block in enumerate(blocks):
+            line_uuid = self.new_uuid()
+            self.append({
+                'parentUuid': self.parent_uuid,
+                'isSidechain': False,
+                'type': 'assistant',
+                'message': {
+                    'id': message_id,
+                    'type': 'message',
+                    'role': 'assistant',
+                    'model': model_name,
+                    'content': [block],
+                    'stop_reason': stop_reason if index == len(blocks) - 1 else None,
+                    'usage': usage
+                },
+                'requestId': request_id,
+                'uuid': line_uuid,
+                'timestamp': None
+            })
+            self.parent_uuid = line_uuid
+            self.elapsed += 0.2
+            self.counts['assistantLines'] += 1
+        self.counts['assistantResponses'] += 1
+
+    def add_tool_result(self):
+        rng = self.rng
+        self.advance(0.5, 20)
+        if rng.random() < self.options.huge_line_rate:
+            size = self.options.huge_line_bytes
+            self.counts['hugeLines'] += 1
+        else:
+            # 大半は短く、たまに数十KBになる分布
+            size = min(int(rng.lognormvariate(6.5, 1.2)), 64 * 1024)
+        result_uuid = self.new_uuid()
+        self.append({
+            'parentUuid': self.parent_uuid,
+            'isSidechain': False,
+            'type': 'user',
+            'message': {'role': 'user', 'content': [{
+                'tool_use_id': f'toolu_{rng.getrandbits(96):024x}',
+                'type': 'tool_result',
+                'content': 'x' * size,
+                'is_error': False
+            }]},
+            'uuid': result_uuid,
+            'timestamp': None
+        })
+        self.parent_uuid = result_uuid
+        self.counts['toolResults'] += 1
+
+    def generate(self, line_target, model_names, model_weights):
+        """line_target 行に達するまで、ユーザー入力→応答（→ツール実行→応答...）を繰り返す"""
+        rng = self.rng
+        self.lines.append((0.0, {'type': 'summary', 'summary': 'Synthetic benchmark session',
+                                 'leafUuid': self.new_uuid()}))
+        model_name = rng.choices(model_names, model_weights)[0]
+
+        while len(self.lines) < line_target:
+            # /model の切り替えを模して、たまにモデルを変える
+            if rng.random() < 0.1:
+                model_name = rng.choices(model_names, model_weights)[0]
+            self.add_user_prompt()
+            while True:
+                with_tool_use = rng.random() < self.options.tool_rate
+                self.add_assistant_response(model_name, with_tool_use)
+                if not with_tool_use or len(self.lines) >= line_target:
+                    break
+                self.add_tool_result()
+
+    def render(self, end_time):
+        """
+        タイムスタンプを確定させて JSONL のバイト列を作る
+
+        Args:
+            end_time: セッション最後の行の時刻
+
+        Returns:
+            bytes: ファイル内容
+        """
+        rng = self.rng
+        start_time = end_time - timedelta(seconds=self.elapsed)
+        chunks = []
+        for offset, entry in self.lines:
+            if 'timestamp' in entry:
+                entry['timestamp'] = format_timestamp(start_time + timedelta(seconds=offset))
+            line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+            if rng.random() < self.options.malformed_rate:
+                # 書き込み途中で切れた行・壊れた行
+                chunks.append(line[:rng.randint(1, max(1, len(line) - 1))] if rng.random() < 0.7 else '{"type":')
+                chunks.append('\n')
+                self.counts['malformedLines'] += 1
+            chunks.append(line)
+            chunks.append('\n')
+        return ''.join(chunks).encode('utf-8')
+
+
+def generate_corpus(output, options):
+    """
+    合成トランスクリプトのツリーを生成
+
+    Args:
+        output: 生成先（HOME として使うディレクトリ）
+        options: 生成条件（argparse の Namespace）
+
+    Returns:
+        dict: 生成条件と件数（マニフェスト）
+    """
+    rng = random.Random(options.seed)
+    model_names, model_weights = options.model_mix
+    now = options.now
+    claude_dir = output / '.claude'
+    projects_dir = claude_dir / 'projects'
+    projects_dir.mkdir(parents=True, exist_ok=True)
+
+    totals = {'files': 0, 'lines': 0, 'bytes': 0, 'resumedSessions': 0, 'archivedSessions': 0}
+    counts = {}
+    for project_index in range(options.projects):
+        cwd = f'/home/user/work/project-{project_index:03d}'
+        project_dir = projects_dir / cwd.replace('/', '-')
+        project_dir.mkdir(exist_ok=True)
+        previous = None
+
+        for _ in range(options.sessions):
+            session_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            writer = SessionWriter(rng, options, session_id, cwd)
+            writer.generate(options.lines, model_names, model_weights)
+
+            if previous is not None and rng.random() < options.resume_rate:
+                # 再開したセッションは、直前のセッションの履歴（同じ uuid・message.id）の複製から始まる
+                previous_data, previous_end = previous
+                end_time = min(now, previous_end + timedelta(hours=rng.uniform(0.1, 2)))
+                data = previous_data + writer.render(end_time)
+                totals['resumedSessions'] += 1
+            else:
+                end_time = now - timedelta(hours=rng.uniform(0, options.span_hours))
+                data = writer.render(end_time)
+            previous = (data, end_time)
+            path = project_dir / f'{session_id}.jsonl'
+            if options.archive_rate and rng.random() < options.archive_rate:
+                # 同じ引数で同じバイト列になるよう gzip ヘッダーの時刻は固定する
+                path = path.with_name(path.name + '.gz')
+                path.write_bytes(gzip.compress(data, mtime=0))
+                totals['archivedSessions'] += 1
+            else:
+                path.write_bytes(data)
+            os.utime(path, (end_time.timestamp(), end_time.timestamp()))
+
+            totals['files'] += 1
+            totals['lines'] += data.count(b'\n')
+            totals['bytes'] += len(data)
+            for key, value in writer.counts.items():
+                counts[key] = counts.get(key, 0) + value
+
+    if not options.no_config:
+        for name in CONFIG_FILES:
+            source = CONFIG_DIR / name
+            if source.exists():
+                shutil.copyfile(source, claude_dir / name)
+
+    manifest = {
+        'seed': options.seed,
+        'now': now.isoformat(),
+        'projects': options.projects,
+        'sessions': options.sessions,
+        'linesPerFile': options.lines,
+        'modelMix': dict(zip(model_names, model_weights)),
+        'spanHours': options.span_hours,
+        'duplicateRate': options.duplicate_rate,
+        'toolRate': options.tool_rate,
+        'sidechainRate': options.sidechain_rate,
+        'hugeLineRate': options.huge_line_rate,
+        'hugeLineBytes': options.huge_line_bytes,
+        'malformedRate': options.malformed_rate,
+        'resumeRate': options.resume_rate,
+        'archiveRate': options.archive_rate,
+        **totals,
+        **counts
+    }
+    with open(claude_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def parse_now(value):
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid ISO 8601 timestamp: {value}')
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='ベンチマーク用の合成トランスクリプトを生成する')
+    parser.add_argument('output', type=Path, help='生成先（HOME として使うディレクトリ）')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default=DEFAULT_PRESET,
+                        help=f'コーパスの規模（デフォルト: {DEFAULT_PRESET}）')
+    parser.add_argument('--projects', type=int, help='プロジェクト数')
+    parser.add_argument('--sessions', type=int, help='プロジェクトごとのセッション数')
+    parser.add_argument('--lines', type=int, help='ファイルあたりの行数（目安）')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード（デフォルト: 1）')
+    parser.add_argument('--now', type=parse_now,
+                        help='基準時刻（ISO 8601、デフォルト: 現在時刻を分単位で切り捨て）')
+    parser.add_argument('--span-hours', type=float, default=DEFAULT_SPAN_HOURS,
+                        help=f'セッション終了時刻を分散させる範囲（デフォルト: {DEFAULT_SPAN_HOURS}）')
+    parser.add_argument('--model-mix', type=parse_model_mix, default=DEFAULT_MODEL_MIX,
+                        help=f'モデルの比率（デフォルト: {DEFAULT_MODEL_MIX}）')
+    parser.add_argument('--duplicate-rate', type=float, default=DEFAULT_DUPLICATE_RATE,
+                        help='応答がストリーミングで複数行になる確率')
+    parser.add_argument('--tool-rate', type=float, default=DEFAULT_TOOL_RATE,
+                        help='応答の後にツール実行が続く確率')
+    parser.add_argument('--sidechain-rate', type=float, default=DEFAULT_SIDECHAIN_RATE,
+                        help='サイドチェーンのユーザー入力の確率')
+    parser.add_argument('--huge-line-rate', type=float, default=DEFAULT_HUGE_LINE_RATE,
+                        help='ツール実行結果が巨大な行になる確率')
+    parser.add_argument('--huge-line-bytes', type=int, default=DEFAULT_HUGE_LINE_BYTES,
+                        help=f'巨大な行のサイズ（デフォルト: {DEFAULT_HUGE_LINE_BYTES}）')
+    parser.add_argument('--malformed-rate', type=float, default=DEFAULT_MALFORMED_RATE,
+                        help='壊れた行を挟む確率')
+    parser.add_argument('--resume-rate', type=float, default=DEFAULT_RESUME_RATE,
+                        help='セッションが直前のセッションの再開（履歴の複製）である確率')
+    parser.add_argument('--archive-rate', type=float, default=DEFAULT_ARCHIVE_RATE,
+                        help='セッションを gzip 圧縮済みのアーカイブ（.jsonl.gz）として書く確率')
+    parser.add_argument('--no-config', action='store_true',
+                        help='usage-config.json などの設定ファイルをコピーしない')
+    parser.add_argument('--force', action='store_true', help='既存の projects/ を削除して生成し直す')
+    return parser
+
+
+def resolve_options(args):
+    """プリセットと個別指定を合わせた生成条件を確定させる"""
+    preset = PRESETS[args.preset]
+    for key, value in preset.items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    if isinstance(args.model_mix, str):
+        args.model_mix = parse_model_mix(args.model_mix)
+    if args.now is None:
+        args.now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    return args
+
+
+def main(argv=None):
+    args = resolve_options(build_parser().parse_args(argv))
+    output = args.output.expanduser().resolve()
+
+    # 実際の HOME のログを消さないための安全策
+    if output == Path.home().resolve():
+        print('Error: Refusing to generate into the real home directory', file=sys.stderr)
+        sys.exit(1)
+
+    projects_dir = output / '.claude' / 'projects'
+    if projects_dir.exists():
+        if not args.force:
+            print(f'Error: {projects_dir} already exists (use --force to replace it)', file=sys.stderr)
+            sys.exit(1)
+        shutil.rmtree(projects_dir)
+
+    manifest = generate_corpus(output, args)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+起動時間（コールドスタート）の計測スクリプト
+
+対象スクリプトを `python -X importtime` 付きで繰り返し実行し、実行時間・import 時間・
+import に時間のかかっているモジュールを JSON で出力します。
+インタプリタ単体の起動時間（`python -c pass`）も計測するため、スクリプト側の増分が分かります。
+
+使い方:
+    python3 tools/importtime-report.py                          # get-message-usage.py（引数なし）
+    python3 tools/importtime-report.py --script ~/.claude/get-message-usage.pyz
+    python3 tools/importtime-report.py --budget-ms 30 --input status.json -- --statusline
+
+--budget-ms を指定した場合、実行時間の中央値が上回ると終了コード 1 を返します。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SCRIPT = REPO_ROOT / 'install-to-home' / 'required' / 'get-message-usage.py'
+DEFAULT_RUNS = 10
+TOP_IMPORTS = 15
+
+
+def parse_importtime(stderr):
+    """
+    -X importtime の出力を解析
+
+    Args:
+        stderr: 標準エラー出力
+
+    Returns:
+        list: (モジュール名, 自身の時間 µs, 累積時間 µs, ネストの深さ) のリスト
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+            imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+        except ValueError:
+            continue
+    return imports
+
+
+def run_once(command, stdin_data):
+    """コマンドを1回実行し、(経過時間 ms, stderr) を返す"""
+    started = time.perf_counter()
+    result = subprocess.run(command, input=stdin_data, capture_output=True, env=os.environ)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return elapsed_ms, result.stderr.decode('utf-8', 'replace')
+
+
+def summarize(values):
+    return {
+        'min': round(min(values), 2),
+        'median': round(statistics.median(values), 2),
+        'max': round(max(values), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='起動時間と import 時間を計測する')
+    parser.add_argument('--script', type=Path, default=DEFAULT_SCRIPT,
+                        help=f'計測するスクリプト（.py / .pyz、デフォルト: {DEFAULT_SCRIPT}）')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help=f'計測回数（デフォルト: {DEFAULT_RUNS}）')
+    parser.add_argument('--budget-ms', type=float, help='実行時間（中央値）の上限。超えたら終了コード 1')
+    parser.add_argument('--input', type=Path, help='スクリプトの標準入力に毎回渡すファイル（--statusline 用）')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='スクリプトに渡す引数（-- の後に指定）')
+    args = parser.parse_args()
+
+    script_args = args.script_args[1:] if args.script_args[:1] == ['--'] else args.script_args
+    stdin_data = args.input.read_bytes() if args.input else b''
+
+    baseline_command = [sys.executable, '-c', 'pass']
+    command = [sys.executable, '-X', 'importtime', str(args.script), *script_args]
+    plain_command = [sys.executable, str(args.script), *script_args]
+
+    # 1回目はファイルキャッシュ・チェックポイントを温めるため計測から除外
+    run_once(plain_command, stdin_data)
+
+    baseline = [run_once(baseline_command, b'')[0] for _ in range(args.runs)]
+    wall = [run_once(plain_command, stdin_data)[0] for _ in range(args.runs)]
+
+    # import 時間は -X importtime 付きの実行から集計（計測自体のオーバーヘッドがあるため実行時間とは分ける）
+    import_totals = []
+    slowest = {}
+    for _ in range(args.runs):
+        _, stderr = run_once(command, stdin_data)
+        imports = parse_importtime(stderr)
+        import_totals.append(sum(self_us for _, self_us, _, _ in imports) / 1000)
+        for name, _, cumulative_us, depth in imports:
+            if depth == 0:
+                slowest.setdefault(name, []).append(cumulative_us)
+
+    top_imports = sorted(
+        ({'module': name, 'cumulativeMs': round(statistics.median(values) / 1000, 2)}
+         for name, values in slowest.items()),
+        key=lambda item: item['cumulativeMs'],
+        reverse=True
+    )[:TOP_IMPORTS]
+
+    report = {
+        'script': str(args.script),
+        'args': script_args,
+        'runs': args.runs,
+        'python': sys.version.split()[0],
+        'interpreterMs': summarize(baseline),
+        'wallMs': summarize(wall),
+        'scriptOverheadMs': round(statistics.median(wall) - statistics.median(baseline), 2),
+        'importMs': summarize(import_totals),
+        'topImports': top_imports
+    }
+    if args.budget_ms is not None:
+        report['budgetMs'] = args.budget_ms
+        report['withinBudget'] = statistics.median(wall) <= args.budget_ms
+
+    print(json.dumps(report, indent=2))
+
+    if args.budget_ms is not None and not report['withinBudget']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()